@@ -13,8 +13,12 @@ python3 << 'EOF'
 from database import engine, Base
 from models import Individual, Family, Event, Source, Note, Media
 
-# Drop all tables to start fresh
-Base.metadata.drop_all(bind=engine)
+# Drop all tables to start fresh, except the geocode cache so re-imported
+# places don't have to be geocoded again
+Base.metadata.drop_all(
+    bind=engine,
+    tables=[t for t in Base.metadata.sorted_tables if t.name != "geocode_cache"],
+)
 
 # Create all tables
 Base.metadata.create_all(bind=engine)
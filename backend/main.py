@@ -1,14 +1,28 @@
 """FastAPI application entry point."""
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from routers import (
     people, families, events, places,
-    media, backup, upload, nav, map, mcp, chat
+    media, backup, upload, nav, map, mcp, chat, autocomplete, search,
+    duplicates,
 )
 
-app = FastAPI(title="Ancestry API", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Geocoding jobs checkpoint their progress; pick up any that were cut off
+    map.resume_geocode_jobs()
+    map.prewarm_map_caches()
+    media.resume_derivative_jobs()
+    duplicates.fail_interrupted_scans()
+    yield
+
+
+app = FastAPI(title="Ancestry API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,6 +30,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # REST API routes
@@ -29,6 +44,9 @@ app.include_router(upload.router, prefix="/api")
 app.include_router(nav.router, prefix="/api")
 app.include_router(map.router, prefix="/api")
 app.include_router(chat.router, prefix="/api")
+app.include_router(autocomplete.router, prefix="/api")
+app.include_router(search.router, prefix="/api")
+app.include_router(duplicates.router, prefix="/api")
 
 
 # ===========================
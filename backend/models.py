@@ -1,7 +1,9 @@
 from sqlalchemy import (
+    DDL,
     Table,
     Column,
     Integer,
+    BigInteger,
     String,
     TIMESTAMP,
     func,
@@ -9,29 +11,36 @@ from sqlalchemy import (
     Text,
     ForeignKey,
     Float,
+    Computed,
+    Index,
+    UniqueConstraint,
+    JSON,
+    text,
+    event as sa_event,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from database import Base
 
 individual_event = Table(
     "individual_event",
     Base.metadata,
-    Column("individual_id", Integer, ForeignKey("individual.id")),
-    Column("event_id", Integer, ForeignKey("event.id")),
+    Column("individual_id", Integer, ForeignKey("individual.id"), index=True),
+    Column("event_id", Integer, ForeignKey("event.id"), index=True),
 )
 
 family_event = Table(
     "family_event",
     Base.metadata,
-    Column("family_id", Integer, ForeignKey("family.id")),
-    Column("event_id", Integer, ForeignKey("event.id")),
+    Column("family_id", Integer, ForeignKey("family.id"), index=True),
+    Column("event_id", Integer, ForeignKey("event.id"), index=True),
 )
 
 child_in_family = Table(
     "child_in_family",
     Base.metadata,
     Column("child_id", Integer, ForeignKey("individual.id")),
-    Column("family_id", Integer, ForeignKey("family.id")),
+    Column("family_id", Integer, ForeignKey("family.id"), index=True),
 )
 
 individual_source = Table(
@@ -65,8 +74,8 @@ family_note = Table(
 media_individual = Table(
     "media_individual",
     Base.metadata,
-    Column("media_id", Integer, ForeignKey("media.id")),
-    Column("individual_id", Integer, ForeignKey("individual.id")),
+    Column("media_id", Integer, ForeignKey("media.id"), index=True),
+    Column("individual_id", Integer, ForeignKey("individual.id"), index=True),
 )
 
 media_event = Table(
@@ -79,6 +88,9 @@ media_event = Table(
 
 class Individual(Base):
     __tablename__ = "individual"
+    __table_args__ = (
+        Index("ix_individual_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     gedcom_id = Column(String(255), unique=True)
@@ -86,6 +98,16 @@ class Individual(Base):
     last_name = Column(String(255))
     sex = Column(String(1))  # 'M', 'F', 'U'
     profile_image_id = Column(Integer, ForeignKey("media.id"), nullable=True)
+    # Full-text search vector, maintained by PostgreSQL on every write
+    search_vector = deferred(
+        Column(
+            TSVECTOR,
+            Computed(
+                "to_tsvector('simple', coalesce(first_name, '') || ' ' || coalesce(last_name, ''))",
+                persisted=True,
+            ),
+        )
+    )
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     updated_at = Column(
         TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
@@ -112,8 +134,8 @@ class Family(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     gedcom_id = Column(String(255), unique=True)
-    spouse1_id = Column(Integer, ForeignKey("individual.id"))
-    spouse2_id = Column(Integer, ForeignKey("individual.id"))
+    spouse1_id = Column(Integer, ForeignKey("individual.id"), index=True)
+    spouse2_id = Column(Integer, ForeignKey("individual.id"), index=True)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
@@ -133,12 +155,43 @@ class Family(Base):
 
 class Event(Base):
     __tablename__ = "event"
+    __table_args__ = (
+        Index("ix_event_search_vector", "search_vector", postgresql_using="gin"),
+        Index(
+            "ix_event_place_search",
+            text("to_tsvector('simple', coalesce(place, ''))"),
+            postgresql_using="gin",
+        ),
+        # Keyset ordering for event listings: by date, undated events last
+        Index(
+            "ix_event_sort_date",
+            text("coalesce(event_date, 'infinity'::date)"),
+            "id",
+        ),
+        Index(
+            "ix_event_type_sort_date",
+            "event_type",
+            text("coalesce(event_date, 'infinity'::date)"),
+            "id",
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     event_type = Column(String(50))  # 'BIRT', 'DEAT', 'MARR'
     event_date = Column(Date)
     place = Column(String(255))
+    place_id = Column(Integer, ForeignKey("place.id"), index=True)
     description = Column(Text)
+    search_vector = deferred(
+        Column(
+            TSVECTOR,
+            Computed(
+                "setweight(to_tsvector('english', coalesce(description, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(place, '')), 'B')",
+                persisted=True,
+            ),
+        )
+    )
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     updated_at = Column(
         TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
@@ -173,10 +226,19 @@ class Source(Base):
 
 class Note(Base):
     __tablename__ = "note"
+    __table_args__ = (
+        Index("ix_note_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     gedcom_id = Column(String(255), unique=True)
     text = Column(Text)
+    search_vector = deferred(
+        Column(
+            TSVECTOR,
+            Computed("to_tsvector('english', coalesce(text, ''))", persisted=True),
+        )
+    )
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     updated_at = Column(
         TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
@@ -190,16 +252,37 @@ class Note(Base):
 
 class Media(Base):
     __tablename__ = "media"
+    __table_args__ = (
+        Index("ix_media_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     filename = Column(String(255), nullable=False)
-    file_path = Column(String(512), nullable=False)  # Path in MinIO
+    # Path in MinIO; media with the same content share one blob (MediaBlob)
+    file_path = Column(String(512), nullable=False)
     thumbnail_path = Column(String(512), nullable=True)  # Thumbnail path in MinIO
+    # Resized copies by size and format (see services/derivatives.py);
+    # status is 'pending', 'ready' or 'failed', NULL for non-images
+    derivatives = Column(JSON)
+    derivatives_status = Column(String(20))
+    # When the derivative files were last written; versions cached copies
+    derivatives_updated_at = Column(TIMESTAMP(timezone=True))
     media_type = Column(String(50))  # 'image', 'video', 'document', etc.
-    file_size = Column(Integer)  # Size in bytes
+    file_size = Column(BigInteger)  # Size in bytes
+    content_hash = Column(String(64), index=True)  # SHA-256 hex digest
     media_date = Column(Date)  # When the media was taken/created
     description = Column(Text)  # Optional description
     extracted_text = Column(Text)  # Text extracted from document
+    search_vector = deferred(
+        Column(
+            TSVECTOR,
+            Computed(
+                "setweight(to_tsvector('english', coalesce(filename, '') || ' ' || coalesce(description, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(extracted_text, '')), 'B')",
+                persisted=True,
+            ),
+        )
+    )
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     updated_at = Column(
         TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
@@ -211,13 +294,48 @@ class Media(Base):
     events = relationship("Event", secondary=media_event, back_populates="media")
 
 
+class MediaBlob(Base):
+    """A stored media file, shared by every Media row with the same content."""
+
+    __tablename__ = "media_blob"
+
+    content_hash = Column(String(64), primary_key=True)  # SHA-256 hex digest
+    file_path = Column(String(512), nullable=False)  # Path in MinIO
+    size = Column(BigInteger)
+    ref_count = Column(Integer, nullable=False, default=0)  # Media rows using it
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+
 class Place(Base):
     __tablename__ = "place"
+    __table_args__ = (
+        Index("ix_place_ancestor_ids", "ancestor_ids", postgresql_using="gin"),
+        # Bounding-box lookups of geocoded places for map tiles
+        Index(
+            "ix_place_coordinates",
+            "latitude",
+            "longitude",
+            postgresql_where=text("geocoded = 1"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(
         String(512), unique=True, nullable=False
     )  # Original place name from GEDCOM
+    # Hierarchy parsed from the comma-separated name (see services/places.py)
+    parent_id = Column(Integer, ForeignKey("place.id"), index=True)
+    level = Column(String(20))  # 'locality', 'county', 'state', 'country'
+    ancestor_ids = Column(ARRAY(Integer))  # Root (country) first
+    # Spelling variants share a normalised name and point at one canonical
+    # place, which is the only one geocoded (see services/place_names.py)
+    normalized_name = Column(String(512), index=True)
+    canonical_id = Column(Integer, ForeignKey("place.id"), index=True)
+    # Events at this place, and at this place or any place below it
+    event_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_event_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
     geocoded = Column(Integer, default=0)  # 0=not attempted, 1=success, -1=failed
@@ -225,3 +343,139 @@ class Place(Base):
     updated_at = Column(
         TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
     )
+
+
+class DuplicateCandidate(Base):
+    __tablename__ = "duplicate_candidate"
+    __table_args__ = (
+        UniqueConstraint("individual1_id", "individual2_id"),
+        Index("ix_duplicate_candidate_status_score", "status", "score"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Pairs are stored with individual1_id < individual2_id
+    individual1_id = Column(
+        Integer, ForeignKey("individual.id", ondelete="CASCADE"), nullable=False
+    )
+    individual2_id = Column(
+        Integer, ForeignKey("individual.id", ondelete="CASCADE"), nullable=False
+    )
+    score = Column(Float, nullable=False)
+    details = Column(JSON)  # Per-feature component scores
+    # 'pending' or 'dismissed'; merging either person deletes the row
+    status = Column(String(20), default="pending")
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(
+        TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    individual1 = relationship("Individual", foreign_keys=[individual1_id])
+    individual2 = relationship("Individual", foreign_keys=[individual2_id])
+
+
+class DuplicateScan(Base):
+    __tablename__ = "duplicate_scan"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    mode = Column(String(20))  # 'full' or 'incremental'
+    status = Column(String(20), default="running")  # 'running', 'completed', 'failed'
+    people_scanned = Column(Integer, default=0)
+    pairs_compared = Column(Integer, default=0)
+    candidates_found = Column(Integer, default=0)
+    error = Column(Text)
+    started_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    finished_at = Column(TIMESTAMP(timezone=True))
+
+
+class GeocodeJob(Base):
+    __tablename__ = "geocode_job"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    mode = Column(String(20))  # 'pending' or 'force' (also retry failed places)
+    status = Column(String(20), default="running")  # 'running', 'completed', 'failed'
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    success = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    gazetteer = Column(Integer, default=0)
+    cached = Column(Integer, default=0)
+    remote = Column(Integer, default=0)
+    new_places = Column(Integer, default=0)
+    variants = Column(Integer, default=0)
+    # Remote lookups resume after this place ID; NULL until the offline
+    # phase (sync, dedup, gazetteer) has finished
+    last_place_id = Column(Integer)
+    error = Column(Text)
+    started_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(
+        TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+    finished_at = Column(TIMESTAMP(timezone=True))
+
+
+class GeocodeCache(Base):
+    # Remote geocoding results. Not tied to place rows, and kept by the
+    # schema reset in entrypoint.sh, so re-imported places need no lookups
+    __tablename__ = "geocode_cache"
+
+    # Normalised place name (see services/place_names.py) and remote provider
+    query = Column(String(512), primary_key=True)
+    provider = Column(String(20), primary_key=True)
+    latitude = Column(Float)  # NULL when the provider found nothing
+    longitude = Column(Float)
+    # Negative results expire so the place is retried; positive ones don't
+    expires_at = Column(TIMESTAMP(timezone=True))
+    updated_at = Column(
+        TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class DataVersion(Base):
+    # A single row counting committed transactions that changed events, places
+    # or person-event links; the map caches are keyed by it (see
+    # services/map_tiles.py). Bumped by the triggers below, so deletes and
+    # bulk Core statements count too
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
+DATA_VERSION_TABLES = ("event", "place", "individual_event")
+
+# The triggers are deferred to commit and bump the counter once per
+# transaction, so its row lock is only held while committing. The counter
+# starts from the current time in microseconds, so a recreated schema never
+# reuses the version of an older one (vector tiles are cached on disk).
+sa_event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('ygg.data_version_txid', true)
+                    IS DISTINCT FROM txid_current()::text THEN
+                UPDATE data_version SET version = version + 1;
+                PERFORM set_config('ygg.data_version_txid', txid_current()::text, true);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        INSERT INTO data_version (id, version)
+        VALUES (1, (extract(epoch FROM clock_timestamp()) * 1000000)::bigint)
+        ON CONFLICT DO NOTHING;
+        """
+        + "".join(
+            f"""
+        DROP TRIGGER IF EXISTS bump_data_version ON {table};
+        CREATE CONSTRAINT TRIGGER bump_data_version
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE FUNCTION bump_data_version();
+        """
+            for table in DATA_VERSION_TABLES
+        )
+    ),
+)
@@ -1,6 +1,9 @@
 """API routers package."""
 
-from . import people, families, events, places, media, backup, upload, nav, map
+from . import (
+    people, families, events, places, media, backup, upload, nav, map,
+    autocomplete, search, duplicates,
+)
 
 __all__ = [
     "people",
@@ -12,4 +15,7 @@ __all__ = [
     "upload",
     "nav",
     "map",
+    "autocomplete",
+    "search",
+    "duplicates",
 ]
@@ -0,0 +1,29 @@
+"""API routes for typeahead autocomplete of people and places."""
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from database import get_db
+from services.autocomplete import search_people, search_places
+
+router = APIRouter(prefix="/autocomplete", tags=["autocomplete"])
+
+
+@router.get("/people")
+async def autocomplete_people(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+):
+    """Get people whose given names or surname start with the typed terms."""
+    return search_people(db, q, limit)
+
+
+@router.get("/places")
+async def autocomplete_places(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+):
+    """Get place names matching the typed terms, most frequently used first."""
+    return search_places(db, q, limit)
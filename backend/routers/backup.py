@@ -4,6 +4,7 @@ import io
 import os
 import json
 import base64
+import mimetypes
 import zipfile
 from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
@@ -17,6 +18,7 @@ from models import (
     Family,
     Event,
     Media,
+    MediaBlob,
     Place,
     individual_event,
     family_event,
@@ -25,11 +27,58 @@ from models import (
     media_event,
 )
 from schemas.backup import GitHubBackupRequest
+from services import autocomplete, media_blobs
 from services.storage import minio_client
 
 router = APIRouter(prefix="/backup", tags=["backup"])
 
 
+def _import_media_blobs(db: Session, media_json: list, read_file) -> int:
+    """Point imported media rows at content-addressed blobs.
+
+    Files whose content is already stored are not read from the backup.
+    Others are read once each, even if several rows use them, and uploaded
+    unless a blob with the same content exists. Rows whose file is missing
+    keep their path. Returns the number of files uploaded.
+    """
+    hashes = {}  # backup file path -> content hash, None if missing
+    uploaded = 0
+    for m_data in media_json:
+        backup_path = m_data["file_path"]
+        if backup_path in hashes:
+            content_hash = hashes[backup_path]
+            if content_hash:
+                media_blobs.add_reference(db, content_hash)
+        else:
+            content_hash = m_data.get("content_hash")
+            if content_hash and db.get(MediaBlob, content_hash) is not None:
+                media_blobs.add_reference(db, content_hash)
+            else:
+                try:
+                    data = read_file(backup_path)
+                except KeyError:
+                    print(f"Warning: Media file not found in backup: {backup_path}")
+                    data = None
+                except Exception as e:
+                    print(f"Warning: Could not import media file {backup_path}: {e}")
+                    data = None
+                content_hash = None
+                if data is not None:
+                    content_type = (
+                        mimetypes.guess_type(m_data["filename"])[0]
+                        or "application/octet-stream"
+                    )
+                    _, _, content_hash, stored = media_blobs.store(
+                        db, io.BytesIO(data), content_type
+                    )
+                    uploaded += stored
+            hashes[backup_path] = content_hash
+        m_data["content_hash"] = content_hash
+        if content_hash:
+            m_data["file_path"] = media_blobs.blob_path(content_hash)
+    return uploaded
+
+
 @router.get("/export")
 async def export_backup(db: Session = Depends(get_db)):
     """Export all data to a ZIP file containing JSON and media files."""
@@ -90,6 +139,7 @@ async def export_backup(db: Session = Depends(get_db)):
                     "id": m.id,
                     "filename": m.filename,
                     "file_path": m.file_path,
+                    "content_hash": m.content_hash,
                     "media_type": m.media_type,
                     "file_size": m.file_size,
                     "media_date": m.media_date.isoformat() if m.media_date else None,
@@ -157,14 +207,14 @@ async def export_backup(db: Session = Depends(get_db)):
                 "data/relationships.json", json.dumps(relationships, indent=2)
             )
 
-            # Export media files from MinIO
-            for m in media_list:
+            # Export media files from MinIO, once per stored file
+            for file_path in {m.file_path for m in media_list}:
                 try:
-                    response = minio_client.get_object("media", m.file_path)
+                    response = minio_client.get_object("media", file_path)
                     file_data = response.read()
-                    zip_file.writestr(f"media/{m.file_path}", file_data)
+                    zip_file.writestr(f"media/{file_path}", file_data)
                 except Exception as e:
-                    print(f"Warning: Could not export media file {m.file_path}: {e}")
+                    print(f"Warning: Could not export media file {file_path}: {e}")
 
             # Create manifest
             manifest = {
@@ -227,6 +277,7 @@ async def import_backup(file: UploadFile = File(...), db: Session = Depends(get_
             db.query(Family).delete()
             db.query(Individual).delete()
             db.query(Place).delete()
+            media_blobs.reset_references(db)
             db.commit()
 
             # Import individuals
@@ -277,6 +328,9 @@ async def import_backup(file: UploadFile = File(...), db: Session = Depends(get_
 
             # Import media metadata
             media_json = json.loads(zip_file.read("data/media.json"))
+            media_files_imported = _import_media_blobs(
+                db, media_json, lambda path: zip_file.read(f"media/{path}")
+            )
             id_map_media = {}
             for m_data in media_json:
                 old_id = m_data.pop("id")
@@ -366,24 +420,10 @@ async def import_backup(file: UploadFile = File(...), db: Session = Depends(get_
                         ind.profile_image_id = new_media_id
 
             db.commit()
+            autocomplete.invalidate()
 
-            # Import media files to MinIO
-            media_files_imported = 0
-            for m_data in media_json:
-                file_path = m_data["file_path"]
-                try:
-                    media_content = zip_file.read(f"media/{file_path}")
-                    minio_client.put_object(
-                        "media",
-                        file_path,
-                        io.BytesIO(media_content),
-                        len(media_content),
-                    )
-                    media_files_imported += 1
-                except KeyError:
-                    print(f"Warning: Media file not found in backup: {file_path}")
-                except Exception as e:
-                    print(f"Warning: Could not import media file {file_path}: {e}")
+            # Remove stored files no imported media uses
+            media_blobs.collect_garbage(db)
 
             return {
                 "message": "Backup imported successfully",
@@ -490,6 +530,7 @@ async def export_to_github(config: GitHubBackupRequest, db: Session = Depends(ge
                 "id": m.id,
                 "filename": m.filename,
                 "file_path": m.file_path,
+                "content_hash": m.content_hash,
                 "media_type": m.media_type,
                 "file_size": m.file_size,
                 "media_date": m.media_date.isoformat() if m.media_date else None,
@@ -611,11 +652,11 @@ async def export_to_github(config: GitHubBackupRequest, db: Session = Depends(ge
                 }
             )
 
-        # Create blobs for media files
+        # Create blobs for media files, once per stored file
         media_files_exported = 0
-        for m in media_list:
+        for file_path in {m.file_path for m in media_list}:
             try:
-                response = minio_client.get_object("media", m.file_path)
+                response = minio_client.get_object("media", file_path)
                 file_data = response.read()
 
                 blob_response = requests.post(
@@ -629,7 +670,7 @@ async def export_to_github(config: GitHubBackupRequest, db: Session = Depends(ge
                 if blob_response.status_code == 201:
                     tree_items.append(
                         {
-                            "path": f"media/{m.file_path}",
+                            "path": f"media/{file_path}",
                             "mode": "100644",
                             "type": "blob",
                             "sha": blob_response.json()["sha"],
@@ -637,7 +678,7 @@ async def export_to_github(config: GitHubBackupRequest, db: Session = Depends(ge
                     )
                     media_files_exported += 1
             except Exception as e:
-                print(f"Warning: Could not export media file {m.file_path}: {e}")
+                print(f"Warning: Could not export media file {file_path}: {e}")
 
         # Create new tree
         tree_response = requests.post(
@@ -759,6 +800,7 @@ async def import_from_github(
         db.query(Family).delete()
         db.query(Individual).delete()
         db.query(Place).delete()
+        media_blobs.reset_references(db)
         db.commit()
 
         # Import individuals
@@ -801,6 +843,11 @@ async def import_from_github(
 
         # Import media metadata
         media_json = json.loads(get_file_content("data/media.json"))
+        media_files_imported = _import_media_blobs(
+            db,
+            media_json,
+            lambda path: get_file_content(f"media/{path}", is_binary=True),
+        )
         id_map_media = {}
         for m_data in media_json:
             old_id = m_data.pop("id")
@@ -881,19 +928,10 @@ async def import_from_github(
                 )
 
         db.commit()
+        autocomplete.invalidate()
 
-        # Import media files from GitHub to MinIO
-        media_files_imported = 0
-        for m_data in media_json:
-            file_path = m_data["file_path"]
-            try:
-                media_content = get_file_content(f"media/{file_path}", is_binary=True)
-                minio_client.put_object(
-                    "media", file_path, io.BytesIO(media_content), len(media_content)
-                )
-                media_files_imported += 1
-            except Exception as e:
-                print(f"Warning: Could not import media file {file_path}: {e}")
+        # Remove stored files no imported media uses
+        media_blobs.collect_garbage(db)
 
         return {
             "message": "Backup imported from GitHub successfully",
@@ -0,0 +1,214 @@
+"""API routes for duplicate person detection and review."""
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, aliased
+
+from database import SessionLocal, get_db
+from models import (
+    Individual,
+    Event,
+    DuplicateCandidate,
+    DuplicateScan,
+    individual_event,
+)
+from schemas.duplicates import DuplicateScanRequest
+from services.duplicates import run_duplicate_scan
+
+router = APIRouter(prefix="/duplicates", tags=["duplicates"])
+
+
+def _scan_to_dict(scan: DuplicateScan) -> dict:
+    return {
+        "id": scan.id,
+        "mode": scan.mode,
+        "status": scan.status,
+        "people_scanned": scan.people_scanned,
+        "pairs_compared": scan.pairs_compared,
+        "candidates_found": scan.candidates_found,
+        "error": scan.error,
+        "started_at": scan.started_at.isoformat() if scan.started_at else None,
+        "finished_at": scan.finished_at.isoformat() if scan.finished_at else None,
+    }
+
+
+def _run_scan_task(scan_id: int, incremental: bool) -> None:
+    """Run a scan in the background with its own session."""
+    db = SessionLocal()
+    try:
+        run_duplicate_scan(db, scan_id, incremental=incremental)
+    except Exception as e:
+        db.rollback()
+        print(f"[ERROR] Duplicate scan {scan_id} failed: {str(e)}")
+        import traceback
+
+        traceback.print_exc()
+        scan = db.query(DuplicateScan).filter(DuplicateScan.id == scan_id).first()
+        if scan:
+            scan.status = "failed"
+            scan.error = str(e)
+            scan.finished_at = func.now()
+            db.commit()
+    finally:
+        db.close()
+
+
+def fail_interrupted_scans() -> None:
+    """Mark scans left running by a stopped process as failed (called at startup).
+
+    Scans run as background tasks without checkpoints, so they can't be
+    resumed; left running they would block every later scan.
+    """
+    db = SessionLocal()
+    try:
+        db.query(DuplicateScan).filter(DuplicateScan.status == "running").update(
+            {
+                "status": "failed",
+                "error": "Interrupted by a server restart",
+                "finished_at": func.now(),
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+@router.post("/scan")
+async def start_duplicate_scan(
+    request: DuplicateScanRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    """Start a duplicate detection scan in the background.
+
+    Incremental scans only re-score people changed since the last completed
+    scan; the first scan is always a full one.
+    """
+    running = (
+        db.query(DuplicateScan).filter(DuplicateScan.status == "running").first()
+    )
+    if running:
+        raise HTTPException(
+            status_code=409, detail=f"Duplicate scan {running.id} already in progress"
+        )
+
+    scan = DuplicateScan(
+        mode="incremental" if request.incremental else "full", status="running"
+    )
+    db.add(scan)
+    db.commit()
+    db.refresh(scan)
+
+    background_tasks.add_task(_run_scan_task, scan.id, request.incremental)
+    return _scan_to_dict(scan)
+
+
+@router.get("/scans")
+async def get_duplicate_scans(
+    limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db)
+):
+    """Get the most recent duplicate scans, newest first."""
+    scans = (
+        db.query(DuplicateScan)
+        .order_by(DuplicateScan.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [_scan_to_dict(s) for s in scans]
+
+
+@router.get("/scans/{scan_id}")
+async def get_duplicate_scan(scan_id: int, db: Session = Depends(get_db)):
+    """Get the status of a duplicate scan."""
+    scan = db.query(DuplicateScan).filter(DuplicateScan.id == scan_id).first()
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    return _scan_to_dict(scan)
+
+
+@router.get("")
+async def get_duplicate_candidates(
+    status: str = "pending",
+    min_score: float = Query(0.0, ge=0.0, le=1.0),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    """Get candidate duplicate pairs, highest score first."""
+    person1 = aliased(Individual)
+    person2 = aliased(Individual)
+    births = (
+        select(
+            individual_event.c.individual_id.label("individual_id"),
+            func.min(Event.event_date).label("birth_date"),
+        )
+        .join(Event, Event.id == individual_event.c.event_id)
+        .where(Event.event_type == "BIRT", Event.event_date.isnot(None))
+        .group_by(individual_event.c.individual_id)
+        .subquery()
+    )
+    birth1 = aliased(births)
+    birth2 = aliased(births)
+
+    rows = (
+        db.query(
+            DuplicateCandidate,
+            person1.first_name,
+            person1.last_name,
+            birth1.c.birth_date,
+            person2.first_name,
+            person2.last_name,
+            birth2.c.birth_date,
+        )
+        .join(person1, person1.id == DuplicateCandidate.individual1_id)
+        .join(person2, person2.id == DuplicateCandidate.individual2_id)
+        .outerjoin(birth1, birth1.c.individual_id == person1.id)
+        .outerjoin(birth2, birth2.c.individual_id == person2.id)
+        .filter(
+            DuplicateCandidate.status == status,
+            DuplicateCandidate.score >= min_score,
+        )
+        .order_by(DuplicateCandidate.score.desc(), DuplicateCandidate.id)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+
+    return [
+        {
+            "id": c.id,
+            "score": c.score,
+            "status": c.status,
+            "details": c.details,
+            "individual1": {
+                "id": c.individual1_id,
+                "name": f"{first1} {last1}",
+                "birth_year": b1.year if b1 else None,
+            },
+            "individual2": {
+                "id": c.individual2_id,
+                "name": f"{first2} {last2}",
+                "birth_year": b2.year if b2 else None,
+            },
+        }
+        for c, first1, last1, b1, first2, last2, b2 in rows
+    ]
+
+
+@router.post("/{candidate_id}/dismiss")
+async def dismiss_duplicate_candidate(
+    candidate_id: int, db: Session = Depends(get_db)
+):
+    """Mark a candidate pair as not a duplicate so later scans skip it."""
+    candidate = (
+        db.query(DuplicateCandidate)
+        .filter(DuplicateCandidate.id == candidate_id)
+        .first()
+    )
+    if not candidate:
+        raise HTTPException(status_code=404, detail="Duplicate candidate not found")
+
+    candidate.status = "dismissed"
+    db.commit()
+    return {"id": candidate.id, "message": "Duplicate candidate dismissed"}
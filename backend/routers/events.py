@@ -1,94 +1,313 @@
 """API routes for events (births, deaths, burials, marriages)."""
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import (
+    Integer,
+    case,
+    cast,
+    extract,
+    func,
+    literal_column,
+    or_,
+    select,
+    tuple_,
+    union,
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session, aliased
 
 from database import get_db
-from models import Event
-from utils import get_male_birth_year
+from models import Individual, Family, Event, individual_event, family_event
+from utils import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
 
 router = APIRouter(tags=["events"])
 
+# Same expression as the ix_event_sort_date / ix_event_type_sort_date indexes:
+# events ordered by date, undated events last
+SORT_DATE = func.coalesce(Event.event_date, literal_column("'infinity'::date"))
+EMPTY_JSON_ARRAY = literal_column("'[]'::json")
 
-@router.get("/births")
-async def get_births(db: Session = Depends(get_db)):
-    """Get all birth events."""
-    events = db.query(Event).filter(Event.event_type == "BIRT").all()
+
+def _full_name(person):
+    return func.concat_ws(" ", person.first_name, person.last_name)
+
+
+def _individuals_json():
+    """Correlated subquery: JSON array of the people linked to an event."""
+    person = func.json_build_object("id", Individual.id, "name", _full_name(Individual))
+    return (
+        select(
+            func.coalesce(
+                func.json_agg(aggregate_order_by(person, Individual.id)),
+                EMPTY_JSON_ARRAY,
+            )
+        )
+        .select_from(individual_event)
+        .join(Individual, Individual.id == individual_event.c.individual_id)
+        .where(individual_event.c.event_id == Event.id)
+        .correlate(Event)
+        .scalar_subquery()
+    )
+
+
+def _families_json():
+    """Correlated subquery: JSON array of the families (with spouses) of an event."""
+    spouse1 = aliased(Individual)
+    spouse2 = aliased(Individual)
+
+    def spouse(person):
+        return case(
+            (
+                person.id.isnot(None),
+                func.json_build_object(
+                    "id", person.id, "name", _full_name(person), "sex", person.sex
+                ),
+            )
+        )
+
+    family = func.json_build_object(
+        "id", Family.id, "spouse1", spouse(spouse1), "spouse2", spouse(spouse2)
+    )
+    return (
+        select(
+            func.coalesce(
+                func.json_agg(aggregate_order_by(family, Family.id)),
+                EMPTY_JSON_ARRAY,
+            )
+        )
+        .select_from(family_event)
+        .join(Family, Family.id == family_event.c.family_id)
+        .outerjoin(spouse1, spouse1.id == Family.spouse1_id)
+        .outerjoin(spouse2, spouse2.id == Family.spouse2_id)
+        .where(family_event.c.event_id == Event.id)
+        .correlate(Event)
+        .scalar_subquery()
+    )
+
+
+def query_events(
+    db: Session,
+    event_types: Optional[list[str]] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    place: Optional[str] = None,
+    person_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    with_individuals: bool = True,
+    with_families: bool = True,
+) -> tuple[list[dict], Optional[str]]:
+    """List events with their people and families, ordered by date.
+
+    Returns the events and the cursor for the next page (None on the last
+    page or when no limit is given). Raises ValueError for a bad cursor.
+    Participants that a caller doesn't need can be skipped with the `with_`
+    flags; they are then returned as empty lists.
+    """
+    columns = [Event.id, Event.event_type, Event.event_date, Event.place, Event.description]
+    if with_individuals:
+        columns.append(_individuals_json().label("individuals"))
+    if with_families:
+        columns.append(_families_json().label("families"))
+    query = select(*columns)
+
+    if event_types:
+        query = query.where(Event.event_type.in_(event_types))
+    if date_from:
+        query = query.where(Event.event_date >= date_from)
+    if date_to:
+        query = query.where(Event.event_date <= date_to)
+    if place:
+        # Whole-word match served by the ix_event_place_search GIN index
+        place_vector = func.to_tsvector("simple", func.coalesce(Event.place, ""))
+        query = query.where(
+            place_vector.op("@@")(func.plainto_tsquery("simple", place))
+        )
+    if person_id is not None:
+        own_events = select(individual_event.c.event_id).where(
+            individual_event.c.individual_id == person_id
+        )
+        family_events = (
+            select(family_event.c.event_id)
+            .join(Family, Family.id == family_event.c.family_id)
+            .where(or_(Family.spouse1_id == person_id, Family.spouse2_id == person_id))
+        )
+        # One IN over a UNION lets PostgreSQL probe the few matching IDs
+        # instead of filtering every event against two subqueries
+        query = query.where(Event.id.in_(union(own_events, family_events)))
+
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, (str, type(None)), int)
+        if last_date is None:
+            last_sort = literal_column("'infinity'::date")
+        else:
+            last_sort = date.fromisoformat(last_date)
+        query = query.where(tuple_(SORT_DATE, Event.id) > tuple_(last_sort, last_id))
+
+    query = query.order_by(SORT_DATE, Event.id)
+    if limit:
+        query = query.limit(limit + 1)
+    rows = db.execute(query).all()
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            last.event_date.isoformat() if last.event_date else None, last.id
+        )
+
+    events = []
+    for event_id, event_type, event_date, event_place, description, *participants in rows:
+        individuals = participants.pop(0) if with_individuals else []
+        families = participants.pop(0) if with_families else []
+        events.append(
+            {
+                "id": event_id,
+                "event_type": event_type,
+                "date": event_date,
+                "place": event_place,
+                "description": description,
+                "individuals": individuals,
+                "families": families,
+            }
+        )
+    return events, next_cursor
+
+
+@router.get("/events")
+async def get_events(
+    response: Response,
+    event_type: Optional[str] = Query(
+        None, alias="type", description="Comma-separated event types, e.g. BIRT,DEAT"
+    ),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    place: Optional[str] = None,
+    person_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Get events ordered by date (undated last), one page at a time.
+
+    The cursor for the next page is sent in the X-Next-Cursor header.
+    """
+    event_types = None
+    if event_type:
+        event_types = [t.strip().upper() for t in event_type.split(",") if t.strip()]
+
+    try:
+        events, next_cursor = query_events(
+            db,
+            event_types=event_types,
+            date_from=date_from,
+            date_to=date_to,
+            place=place,
+            person_id=person_id,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return events
+
+
+def _individual_events(db: Session, event_type: str) -> list[dict]:
+    events, _ = query_events(db, event_types=[event_type], with_families=False)
     return [
         {
-            "id": e.id,
-            "individual": (
-                e.individuals[0].first_name + " " + e.individuals[0].last_name
-                if e.individuals
-                else ""
-            ),
-            "date": e.event_date,
-            "place": e.place,
+            "id": e["id"],
+            "individual": e["individuals"][0]["name"] if e["individuals"] else "",
+            "date": e["date"],
+            "place": e["place"],
         }
         for e in events
     ]
 
 
+@router.get("/births")
+async def get_births(db: Session = Depends(get_db)):
+    """Get all birth events."""
+    return _individual_events(db, "BIRT")
+
+
 @router.get("/deaths")
 async def get_deaths(db: Session = Depends(get_db)):
     """Get all death events."""
-    events = db.query(Event).filter(Event.event_type == "DEAT").all()
-    return [
-        {
-            "id": e.id,
-            "individual": (
-                e.individuals[0].first_name + " " + e.individuals[0].last_name
-                if e.individuals
-                else ""
-            ),
-            "date": e.event_date,
-            "place": e.place,
-        }
-        for e in events
-    ]
+    return _individual_events(db, "DEAT")
 
 
 @router.get("/burials")
 async def get_burials(db: Session = Depends(get_db)):
     """Get all burial events."""
-    events = db.query(Event).filter(Event.event_type == "BURI").all()
-    return [
-        {
-            "id": e.id,
-            "individual": (
-                e.individuals[0].first_name + " " + e.individuals[0].last_name
-                if e.individuals
-                else ""
-            ),
-            "date": e.event_date,
-            "place": e.place,
-        }
-        for e in events
-    ]
+    return _individual_events(db, "BURI")
+
+
+def _marriage_male_birth_years(db: Session) -> dict:
+    """Map each marriage event ID to the husband's birth year."""
+    births = (
+        select(
+            individual_event.c.individual_id.label("individual_id"),
+            func.min(Event.event_date).label("birth_date"),
+        )
+        .join(Event, Event.id == individual_event.c.event_id)
+        .where(Event.event_type == "BIRT", Event.event_date.isnot(None))
+        .group_by(individual_event.c.individual_id)
+        .subquery()
+    )
+    spouse1 = aliased(Individual)
+    spouse2 = aliased(Individual)
+    male_id = case(
+        (spouse1.sex == "M", spouse1.id),
+        (spouse2.sex == "M", spouse2.id),
+    )
+    marriage = aliased(Event)
+    rows = (
+        db.query(
+            family_event.c.event_id,
+            cast(extract("year", births.c.birth_date), Integer),
+        )
+        .join(marriage, marriage.id == family_event.c.event_id)
+        .join(Family, Family.id == family_event.c.family_id)
+        .outerjoin(spouse1, spouse1.id == Family.spouse1_id)
+        .outerjoin(spouse2, spouse2.id == Family.spouse2_id)
+        .join(births, births.c.individual_id == male_id)
+        .filter(marriage.event_type == "MARR")
+        .all()
+    )
+    years = {}
+    for event_id, year in rows:
+        years.setdefault(event_id, year)
+    return years
 
 
 @router.get("/marriages")
 async def get_marriages(db: Session = Depends(get_db)):
     """Get all marriage events, sorted by male's birth year (newest first)."""
-    events = db.query(Event).filter(Event.event_type == "MARR").all()
+    events, _ = query_events(db, event_types=["MARR"], with_individuals=False)
+    male_birth_years = _marriage_male_birth_years(db)
 
     marriages_list = []
     for e in events:
-        male_birth_year = None
-        if e.families:
-            male_birth_year = get_male_birth_year(e.families[0])
-
+        family = e["families"][0] if e["families"] else None
         marriages_list.append(
             {
-                "id": e.id,
+                "id": e["id"],
                 "family": (
-                    f"{e.families[0].spouse1.first_name} {e.families[0].spouse1.last_name} and {e.families[0].spouse2.first_name} {e.families[0].spouse2.last_name}"
-                    if e.families and e.families[0].spouse1 and e.families[0].spouse2
+                    f"{family['spouse1']['name']} and {family['spouse2']['name']}"
+                    if family and family["spouse1"] and family["spouse2"]
                     else ""
                 ),
-                "date": e.event_date,
-                "place": e.place,
-                "male_birth_year": male_birth_year,
+                "date": e["date"],
+                "place": e["place"],
+                "male_birth_year": male_birth_years.get(e["id"]),
             }
         )
 
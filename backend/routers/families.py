@@ -1,57 +1,168 @@
 """API routes for families."""
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import Integer, and_, case, cast, extract, func, or_, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session, aliased
 
 from database import get_db
-from models import Individual, Family
-from utils import get_male_birth_year
+from models import (
+    Individual,
+    Family,
+    Event,
+    Media,
+    individual_event,
+    child_in_family,
+    media_individual,
+)
+from utils import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
 
 router = APIRouter(prefix="/families", tags=["families"])
 
 
 @router.get("")
-async def get_families(db: Session = Depends(get_db)):
-    """Get all families with their spouses and children count, sorted by male's birth year (newest first)."""
-    families = db.query(Family).all()
-    families_list = []
-
-    for family in families:
-        spouse1_name = ""
-        spouse2_name = ""
-        if family.spouse1:
-            spouse1_name = f"{family.spouse1.first_name} {family.spouse1.last_name}"
-        if family.spouse2:
-            spouse2_name = f"{family.spouse2.first_name} {family.spouse2.last_name}"
-
-        male_birth_year = get_male_birth_year(family)
-
-        families_list.append(
-            {
-                "id": family.id,
-                "gedcom_id": family.gedcom_id,
-                "spouse1_name": spouse1_name,
-                "spouse2_name": spouse2_name,
-                "spouse1_id": family.spouse1_id,
-                "spouse2_id": family.spouse2_id,
-                "children_count": len(family.children) if family.children else 0,
-                "male_birth_year": male_birth_year,
-            }
+async def get_families(
+    response: Response,
+    surname: Optional[str] = None,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Get families with their spouses and children count, sorted by male's birth year (newest first).
+
+    `surname` matches the start of either spouse's last name and the year
+    filters apply to the male spouse's birth year. Without `limit` every
+    matching family is returned; with it, the cursor for the next page is sent
+    in the X-Next-Cursor header.
+    """
+    spouse1 = aliased(Individual)
+    spouse2 = aliased(Individual)
+
+    births = (
+        select(
+            individual_event.c.individual_id.label("individual_id"),
+            func.min(Event.event_date).label("birth_date"),
+        )
+        .join(Event, Event.id == individual_event.c.event_id)
+        .where(Event.event_type == "BIRT", Event.event_date.isnot(None))
+        .group_by(individual_event.c.individual_id)
+        .subquery()
+    )
+    children = (
+        select(
+            child_in_family.c.family_id.label("family_id"),
+            func.count(child_in_family.c.child_id).label("children_count"),
         )
+        .group_by(child_in_family.c.family_id)
+        .subquery()
+    )
 
-    # Sort by male birth year descending (newest first, None at end)
-    families_list.sort(
-        key=lambda x: (
-            x["male_birth_year"] is None,
-            -x["male_birth_year"] if x["male_birth_year"] else 0,
+    male_id = case(
+        (spouse1.sex == "M", spouse1.id),
+        (spouse2.sex == "M", spouse2.id),
+    )
+    male_birth_year = cast(extract("year", births.c.birth_date), Integer)
+
+    query = (
+        db.query(
+            Family.id,
+            Family.gedcom_id,
+            Family.spouse1_id,
+            Family.spouse2_id,
+            spouse1.first_name,
+            spouse1.last_name,
+            spouse2.first_name,
+            spouse2.last_name,
+            func.coalesce(children.c.children_count, 0),
+            male_birth_year.label("male_birth_year"),
         )
+        .outerjoin(spouse1, spouse1.id == Family.spouse1_id)
+        .outerjoin(spouse2, spouse2.id == Family.spouse2_id)
+        .outerjoin(births, births.c.individual_id == male_id)
+        .outerjoin(children, children.c.family_id == Family.id)
     )
-    return families_list
+
+    if surname:
+        pattern = surname.replace("%", r"\%").replace("_", r"\_") + "%"
+        query = query.filter(
+            or_(spouse1.last_name.ilike(pattern), spouse2.last_name.ilike(pattern))
+        )
+    if year_from is not None:
+        query = query.filter(male_birth_year >= year_from)
+    if year_to is not None:
+        query = query.filter(male_birth_year <= year_to)
+
+    if cursor:
+        try:
+            last_year, last_id = decode_cursor(cursor, (int, type(None)), int)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # Keyset on (year desc nulls last, id); families without a year come last
+        if last_year is None:
+            query = query.filter(male_birth_year.is_(None), Family.id > last_id)
+        else:
+            query = query.filter(
+                or_(
+                    male_birth_year < last_year,
+                    and_(male_birth_year == last_year, Family.id > last_id),
+                    male_birth_year.is_(None),
+                )
+            )
+
+    query = query.order_by(male_birth_year.desc().nulls_last(), Family.id)
+    if limit:
+        query = query.limit(limit + 1)
+    rows = query.all()
+
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            last.male_birth_year, last.id
+        )
+
+    return [
+        {
+            "id": family_id,
+            "gedcom_id": gedcom_id,
+            "spouse1_name": f"{first1} {last1}" if spouse1_id else "",
+            "spouse2_name": f"{first2} {last2}" if spouse2_id else "",
+            "spouse1_id": spouse1_id,
+            "spouse2_id": spouse2_id,
+            "children_count": children_count,
+            "male_birth_year": year,
+        }
+        for (
+            family_id,
+            gedcom_id,
+            spouse1_id,
+            spouse2_id,
+            first1,
+            last1,
+            first2,
+            last2,
+            children_count,
+            year,
+        ) in rows
+    ]
 
 
 @router.get("/{family_id}")
-async def get_family_details(family_id: int, db: Session = Depends(get_db)):
-    """Get detailed information about a specific family."""
+async def get_family_details(
+    family_id: int,
+    media_limit: Optional[int] = Query(None, ge=1, le=500),
+    media_cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Get detailed information about a specific family.
+
+    Media tagged to any member is returned in upload order. Pass `media_limit`
+    to page it; `media_next_cursor` is then set while more media remains.
+    """
     family = db.query(Family).filter(Family.id == family_id).first()
     if not family:
         raise HTTPException(status_code=404, detail="Family not found")
@@ -119,35 +230,71 @@ async def get_family_details(family_id: int, db: Session = Depends(get_db)):
     for child in family.children:
         member_ids.append(child.id)
 
-    # Get media tagged to any family member
-    media_list = []
-    seen_media_ids = set()
-
-    if member_ids:
-        members = db.query(Individual).filter(Individual.id.in_(member_ids)).all()
-        for member in members:
-            for media in member.media:
-                if media.id not in seen_media_ids:
-                    seen_media_ids.add(media.id)
-                    tagged_individuals = [
-                        {"id": ind.id, "name": f"{ind.first_name} {ind.last_name}"}
-                        for ind in media.individuals
-                    ]
-                    media_list.append(
-                        {
-                            "id": media.id,
-                            "filename": media.filename,
-                            "media_type": media.media_type,
-                            "file_size": media.file_size,
-                            "media_date": (
-                                media.media_date.isoformat()
-                                if media.media_date
-                                else None
-                            ),
-                            "description": media.description,
-                            "tagged_individuals": tagged_individuals,
-                        }
-                    )
+    # Get media tagged to any family member, with everyone tagged in each item
+    # aggregated in the same query
+    member_media = select(media_individual.c.media_id).where(
+        media_individual.c.individual_id.in_(member_ids)
+    )
+    tagged_person = func.json_build_object(
+        "id",
+        Individual.id,
+        "name",
+        func.concat_ws(" ", Individual.first_name, Individual.last_name),
+    )
+    tagged_individuals = (
+        select(func.json_agg(aggregate_order_by(tagged_person, Individual.id)))
+        .select_from(media_individual)
+        .join(Individual, Individual.id == media_individual.c.individual_id)
+        .where(media_individual.c.media_id == Media.id)
+        .correlate(Media)
+        .scalar_subquery()
+    )
+
+    media_query = select(
+        Media.id,
+        Media.filename,
+        Media.media_type,
+        Media.file_size,
+        Media.media_date,
+        Media.description,
+        tagged_individuals,
+    ).where(Media.id.in_(member_media))
+    if media_cursor:
+        try:
+            (last_media_id,) = decode_cursor(media_cursor, int)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        media_query = media_query.where(Media.id > last_media_id)
+    media_query = media_query.order_by(Media.id)
+    if media_limit:
+        media_query = media_query.limit(media_limit + 1)
+    media_rows = db.execute(media_query).all() if member_ids else []
+
+    media_next_cursor = None
+    if media_limit and len(media_rows) > media_limit:
+        media_rows = media_rows[:media_limit]
+        media_next_cursor = encode_cursor(media_rows[-1][0])
+
+    media_list = [
+        {
+            "id": media_id,
+            "filename": filename,
+            "media_type": media_type,
+            "file_size": file_size,
+            "media_date": media_date.isoformat() if media_date else None,
+            "description": description,
+            "tagged_individuals": tagged or [],
+        }
+        for (
+            media_id,
+            filename,
+            media_type,
+            file_size,
+            media_date,
+            description,
+            tagged,
+        ) in media_rows
+    ]
 
     return {
         "id": family.id,
@@ -157,4 +304,5 @@ async def get_family_details(family_id: int, db: Session = Depends(get_db)):
         "children": children_data,
         "marriages": marriages,
         "media": media_list,
+        "media_next_cursor": media_next_cursor,
     }
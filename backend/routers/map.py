@@ -1,16 +1,32 @@
 """API routes for map data and geocoding."""
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import threading
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request, Response
+from sqlalchemy import extract, func, select, true
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
-from database import get_db
-from models import Event, Place
+from database import SessionLocal, get_db
+from models import Event, GeocodeJob, Place
 from services.geocoding import (
-    geocode_all_places,
+    geocoding_job_locked,
+    run_geocode_job,
     sync_places_from_events,
     get_geocoding_stats,
 )
+from services.map_tiles import (
+    MAX_ZOOM,
+    event_label,
+    event_name_columns,
+    map_clusters,
+    year_histogram,
+)
+from services.heatmap import heatmap, refresh as refresh_heatmap
+from services.migration_flows import migration_flows
+from services.place_names import canonicalize_places
+from services.vector_tiles import MEDIA_TYPE, get_tile, prewarm_tiles, version_tag
 
 router = APIRouter(prefix="/map", tags=["map"])
 
@@ -20,95 +36,159 @@ async def get_map_events(db: Session = Depends(get_db)):
     """Get all events with location data for map display.
 
     Only returns events that have geocoded coordinates in the Place table.
+    Prefer /map/clusters, which only returns what is in view.
     """
-    # Get all geocoded places
-    places = (
-        db.query(Place)
-        .filter(
+    person, family = event_name_columns()
+    rows = db.execute(
+        select(
+            Event.id,
+            Event.event_type,
+            Event.event_date,
+            Event.place,
+            Place.latitude,
+            Place.longitude,
+            person.c.person_id,
+            person.c.person_name,
+            family.c.family_id,
+            family.c.spouse1_name,
+            family.c.spouse2_name,
+        )
+        .select_from(Event)
+        .join(Place, Place.id == Event.place_id)
+        .outerjoin(person, true())
+        .outerjoin(family, true())
+        .where(
             Place.geocoded == 1, Place.latitude.isnot(None), Place.longitude.isnot(None)
         )
-        .all()
-    )
+        # Sort by year for timeline feature
+        .order_by(Event.event_date.is_(None), extract("year", Event.event_date))
+    ).all()
 
-    place_coords = {p.name: {"lat": p.latitude, "lng": p.longitude} for p in places}
-
-    # Get events with places
-    events = db.query(Event).filter(Event.place.isnot(None)).all()
-
-    events_list = []
-    for event in events:
-        place_name = event.place.strip() if event.place else None
-        coords = place_coords.get(place_name) if place_name else None
-
-        # Skip events without geocoded coordinates
-        if not coords:
-            continue
-
-        # Get associated person or family name
-        name = ""
-        person_id = None
-        family_id = None
-
-        if event.event_type in ["BIRT", "DEAT", "BURI"]:
-            if event.individuals:
-                person = event.individuals[0]
-                name = f"{person.first_name} {person.last_name}"
-                person_id = person.id
-        elif event.event_type == "MARR":
-            if event.families:
-                family = event.families[0]
-                if family.spouse1 and family.spouse2:
-                    name = f"{family.spouse1.first_name} {family.spouse1.last_name} & {family.spouse2.first_name} {family.spouse2.last_name}"
-                elif family.spouse1:
-                    name = f"{family.spouse1.first_name} {family.spouse1.last_name}"
-                elif family.spouse2:
-                    name = f"{family.spouse2.first_name} {family.spouse2.last_name}"
-                family_id = family.id
-
-        events_list.append(
-            {
-                "id": event.id,
-                "event_type": event.event_type,
-                "date": event.event_date.isoformat() if event.event_date else None,
-                "year": event.event_date.year if event.event_date else None,
-                "place": event.place,
-                "name": name,
-                "person_id": person_id,
-                "family_id": family_id,
-                "lat": coords["lat"],
-                "lng": coords["lng"],
-            }
-        )
+    return [
+        {
+            "id": row.id,
+            "event_type": row.event_type,
+            "date": row.event_date.isoformat() if row.event_date else None,
+            "year": row.event_date.year if row.event_date else None,
+            "place": row.place,
+            **event_label(row.event_type, row),
+            "lat": row.latitude,
+            "lng": row.longitude,
+        }
+        for row in rows
+    ]
 
-    # Sort by year for timeline feature
-    events_list.sort(key=lambda x: (x["year"] is None, x["year"] if x["year"] else 0))
 
-    return events_list
+@router.get("/clusters")
+async def get_map_clusters(
+    west: float = Query(..., ge=-180, le=180),
+    south: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    zoom: int = Query(..., ge=0, le=MAX_ZOOM),
+    year_from: Optional[int] = Query(None, ge=1, le=9998),
+    year_to: Optional[int] = Query(None, ge=1, le=9998),
+    type: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Get clustered events inside a bounding box for one map view.
 
+    Below the detail zoom level events are aggregated into grid clusters
+    with counts per event type; from it up individual events are returned.
+    Results are computed and cached per map tile. `type` is a
+    comma-separated list of event types.
+    """
+    if south > north:
+        raise HTTPException(status_code=400, detail="south must not be above north")
+    event_types = [t.strip() for t in type.split(",") if t.strip()] if type else None
+    try:
+        return map_clusters(
+            db, west, south, east, north, zoom, year_from, year_to, event_types
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/heatmap")
+async def get_map_heatmap(
+    west: float = Query(..., ge=-180, le=180),
+    south: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    zoom: int = Query(..., ge=0, le=MAX_ZOOM),
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """Get event density as weighted grid cells for a map view and year window."""
+    if south > north:
+        raise HTTPException(status_code=400, detail="south must not be above north")
+    try:
+        return heatmap(db, west, south, east, north, zoom, year_from, year_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/years")
-async def get_event_years(db: Session = Depends(get_db)):
-    """Get min and max years for timeline slider."""
-    # Only count events that have geocoded places
-    places = db.query(Place).filter(Place.geocoded == 1).all()
-    place_names = {p.name for p in places}
-
-    events = (
-        db.query(Event)
-        .filter(Event.place.isnot(None), Event.event_date.isnot(None))
-        .all()
-    )
 
-    years = [
-        e.event_date.year
-        for e in events
-        if e.event_date and e.place and e.place.strip() in place_names
-    ]
+@router.get("/tiles/{z}/{x}/{y}")
+async def get_map_tile(
+    z: int, x: int, y: int, request: Request, db: Session = Depends(get_db)
+):
+    """Get a Mapbox Vector Tile of map events.
 
-    if not years:
-        return {"min_year": None, "max_year": None, "years": []}
+    Tiles below the detail zoom level have a "clusters" layer; from it up
+    an "events" layer with one point per event.
+    """
+    version = version_tag(db)
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    try:
+        data = get_tile(db, z, x, y, version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(content=data, media_type=MEDIA_TYPE, headers=headers)
+
+
+def prewarm_map_caches() -> None:
+    """Build the heatmap grids and low-zoom vector tiles in the background."""
+
+    def run():
+        db = SessionLocal()
+        try:
+            refresh_heatmap(db)
+            prewarm_tiles(db)
+        except Exception as e:
+            print(f"[ERROR] Map cache prewarm failed: {str(e)}")
+        finally:
+            db.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+@router.get("/migrations")
+async def get_migration_flows(
+    level: str = "country",
+    bucket: int = Query(10, ge=1, le=500),
+    period_by: str = "birth",
+    min_count: int = Query(1, ge=1),
+    db: Session = Depends(get_db),
+):
+    """Get birthplace -> deathplace flows between regions, by period.
 
-    return {"min_year": min(years), "max_year": max(years), "years": sorted(set(years))}
+    `level` is the place level regions are taken at (country, state, county
+    or locality); periods are `bucket` years of the birth or death date.
+    """
+    try:
+        return migration_flows(db, level, bucket, period_by, min_count)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/years")
+async def get_event_years(db: Session = Depends(get_db)):
+    """Get the year range and per-year event counts for the timeline slider."""
+    return year_histogram(db)
 
 
 @router.get("/places/stats")
@@ -129,12 +209,78 @@ async def sync_places(db: Session = Depends(get_db)):
     }
 
 
+@router.post("/places/normalize")
+async def normalize_places(db: Session = Depends(get_db)):
+    """Group spelling variants of places under one canonical place."""
+    results = canonicalize_places(db)
+    db.commit()
+    return results
+
+
 class GeocodeRequest(BaseModel):
     force: bool = False
 
 
-# Track geocoding status
-geocoding_status = {"running": False, "progress": 0, "total": 0, "results": None}
+def _job_to_dict(job: GeocodeJob) -> dict:
+    return {
+        "id": job.id,
+        "mode": job.mode,
+        "status": job.status,
+        "running": job.status == "running",
+        "total": job.total,
+        "processed": job.processed,
+        "success": job.success,
+        "failed": job.failed,
+        "gazetteer": job.gazetteer,
+        "cached": job.cached,
+        "remote": job.remote,
+        "new_places": job.new_places,
+        "variants": job.variants,
+        "error": job.error,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _run_geocode_task(job_id: int) -> None:
+    """Run a geocoding job in the background with its own session."""
+    db = SessionLocal()
+    try:
+        run_geocode_job(db, job_id)
+        prewarm_map_caches()
+    except Exception as e:
+        db.rollback()
+        print(f"[ERROR] Geocoding job {job_id} failed: {str(e)}")
+        import traceback
+
+        traceback.print_exc()
+        job = db.query(GeocodeJob).filter(GeocodeJob.id == job_id).first()
+        if job:
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = func.now()
+            db.commit()
+    finally:
+        db.close()
+
+
+def resume_geocode_jobs() -> None:
+    """Resume jobs left running by a stopped process (called at startup)."""
+    db = SessionLocal()
+    try:
+        job_ids = [
+            job_id
+            for (job_id,) in db.query(GeocodeJob.id)
+            .filter(GeocodeJob.status == "running")
+            .all()
+        ]
+    finally:
+        db.close()
+    for job_id in job_ids:
+        threading.Thread(
+            target=_run_geocode_task, args=(job_id,), daemon=True
+        ).start()
 
 
 @router.post("/places/geocode")
@@ -143,40 +289,47 @@ async def start_geocoding(
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
-    """Start geocoding all places.
+    """Start geocoding places in the background.
 
-    This runs synchronously since we need to respect rate limits.
-    For large datasets, consider running as a background task.
+    If an earlier job was interrupted it is resumed instead of starting a
+    new one. Poll the returned job for progress.
     """
-    global geocoding_status
+    running = (
+        db.query(GeocodeJob)
+        .filter(GeocodeJob.status == "running")
+        .order_by(GeocodeJob.id.desc())
+        .first()
+    )
+    if running and geocoding_job_locked(db):
+        raise HTTPException(
+            status_code=409, detail=f"Geocoding job {running.id} already in progress"
+        )
 
-    if geocoding_status["running"]:
-        raise HTTPException(status_code=409, detail="Geocoding already in progress")
+    job = running
+    if job is None:
+        job = GeocodeJob(mode="force" if request.force else "pending", status="running")
+        db.add(job)
+        db.commit()
+        db.refresh(job)
 
-    # Sync places first
-    sync_places_from_events(db)
+    background_tasks.add_task(_run_geocode_task, job.id)
+    return _job_to_dict(job)
 
-    # Run geocoding
-    geocoding_status["running"] = True
-    geocoding_status["progress"] = 0
-    geocoding_status["results"] = None
 
-    try:
-        results = geocode_all_places(db, force=request.force)
-        geocoding_status["results"] = results
-        return {
-            "message": "Geocoding complete",
-            "results": results,
-            "stats": get_geocoding_stats(db),
-        }
-    finally:
-        geocoding_status["running"] = False
+@router.get("/places/geocode/status")
+async def get_geocoding_status(db: Session = Depends(get_db)):
+    """Get the most recent geocoding job, or null if there has been none."""
+    job = db.query(GeocodeJob).order_by(GeocodeJob.id.desc()).first()
+    return _job_to_dict(job) if job else None
 
 
-@router.get("/places/geocode/status")
-async def get_geocoding_status():
-    """Get current geocoding status."""
-    return geocoding_status
+@router.get("/places/geocode/jobs/{job_id}")
+async def get_geocoding_job(job_id: int, db: Session = Depends(get_db)):
+    """Get the progress of a geocoding job."""
+    job = db.query(GeocodeJob).filter(GeocodeJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Geocoding job not found")
+    return _job_to_dict(job)
 
 
 @router.get("/places")
@@ -191,6 +344,7 @@ async def get_all_places(db: Session = Depends(get_db)):
             "latitude": p.latitude,
             "longitude": p.longitude,
             "geocoded": p.geocoded,
+            "canonical_id": p.canonical_id,
         }
         for p in places
     ]
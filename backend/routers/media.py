@@ -1,11 +1,18 @@
 """API routes for media files."""
 
-import io
+import asyncio
+import hashlib
 import json
 import mimetypes
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from PIL import UnidentifiedImageError
 from sqlalchemy.orm import Session
 
 from database import get_db
@@ -14,9 +21,10 @@ from schemas.media import MediaUpdateRequest
 from services.storage import (
     minio_client,
     get_presigned_url,
-    generate_thumbnail,
-    upload_thumbnail,
+    get_object_cache,
 )
+from services import derivatives, media_blobs
+from services.derivatives import DERIVATIVE_SIZES, FORMATS, THUMBNAIL_SIZE
 from services.text_extraction import extract_text
 
 router = APIRouter(prefix="/media", tags=["media"])
@@ -36,9 +44,6 @@ async def upload_media(
         event_id = metadata_dict.get("event_id")
         individual_ids = metadata_dict.get("individual_ids", [])
 
-        contents = await file.read()
-        file_size = len(contents)
-
         filename = file.filename
         mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
 
@@ -49,29 +54,20 @@ async def upload_media(
         else:
             media_type = "document"
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_path = f"{timestamp}_{filename}"
-
-        minio_client.put_object(
-            "media", file_path, io.BytesIO(contents), file_size, content_type=mime_type
+        # The upload is spooled to a temp file. It is hashed there and only
+        # streamed to MinIO if no media has the same content yet
+        file_path, file_size, content_hash, uploaded = await run_in_threadpool(
+            media_blobs.store, db, file.file, mime_type
         )
 
-        # Generate thumbnail for images
-        thumbnail_path = None
-        if media_type == "image":
-            thumb_result = generate_thumbnail(contents, file_path)
-            if thumb_result:
-                thumb_data, thumb_filename = thumb_result
-                thumbnail_path = upload_thumbnail(
-                    minio_client, "media", thumb_data, thumb_filename
-                )
-
         media = Media(
             filename=filename,
             file_path=file_path,
-            thumbnail_path=thumbnail_path,
             media_type=media_type,
             file_size=file_size,
+            content_hash=content_hash,
+            # Thumbnails and other sizes are made in the background
+            derivatives_status="pending" if media_type == "image" else None,
             media_date=(
                 datetime.strptime(media_date, "%Y-%m-%d").date() if media_date else None
             ),
@@ -100,14 +96,22 @@ async def upload_media(
             media.individuals = individuals
 
         db.add(media)
+        db.flush()
+        if media.derivatives_status == "pending" and not uploaded:
+            derivatives.copy_from_duplicate(db, media)
         db.commit()
         db.refresh(media)
+        if media.derivatives_status == "pending":
+            derivatives.enqueue(media.id, media.file_path)
 
         return {
             "id": media.id,
             "filename": media.filename,
             "media_type": media.media_type,
             "file_size": media.file_size,
+            "content_hash": media.content_hash,
+            "deduplicated": not uploaded,
+            "derivatives_status": media.derivatives_status,
             "message": "Media uploaded successfully",
         }
     except Exception as e:
@@ -147,6 +151,7 @@ async def get_all_media(db: Session = Depends(get_db)):
                 "filename": media.filename,
                 "media_type": media.media_type,
                 "file_size": media.file_size,
+                "derivatives_status": media.derivatives_status,
                 "media_date": (
                     media.media_date.isoformat() if media.media_date else None
                 ),
@@ -163,30 +168,207 @@ async def get_all_media(db: Session = Depends(get_db)):
     return result
 
 
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def _iter_object(response):
+    """Yield a MinIO object in chunks, releasing the connection at the end."""
+    try:
+        yield from response.stream(STREAM_CHUNK_SIZE)
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def _http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header with an ETag."""
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    return etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in tags]
+
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """Whether the client's cached copy is current (If-None-Match wins)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    since = request.headers.get("if-modified-since")
+    if since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def _byte_range(header: Optional[str], size: int):
+    """Parse a single "bytes=" range into (start, end), inclusive.
+
+    Returns None to serve the whole object (no header, several ranges or a
+    unit other than bytes) and raises ValueError if it cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not first:
+        # Suffix range: the last N bytes
+        if not last.isdigit():
+            return None
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(0, size - length), size - 1
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def _iter_file(f, start: int, length: int):
+    """Yield part of an open local file in chunks, then close it.
+
+    This is a copy through user space, not sendfile: uvicorn gives ASGI
+    apps no way to hand it a file, and FileResponse would reopen the cache
+    path, which an eviction may have removed since it was opened here.
+    """
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _object_response(
+    request: Request,
+    object_name: str,
+    version: str,
+    content_type: str,
+    etag: str,
+    last_modified: Optional[datetime],
+    size: Optional[int],
+    headers: dict,
+):
+    """Serve a MinIO object with conditional GET and single-range support.
+
+    Answers 304 when the client's copy is current, 206 for a satisfiable
+    Range and 416 for an unsatisfiable one. Objects are served from the
+    local object cache (keyed by `version`) when they fit in it, otherwise
+    streamed from MinIO with ranged get_object calls. Cached files are read
+    and sent in chunks from the handle the cache opened (see _iter_file),
+    not with a zero-copy sendfile.
+    """
+    headers = {**headers, "ETag": etag, "Accept-Ranges": "bytes"}
+    if last_modified is not None:
+        headers["Last-Modified"] = _http_date(last_modified)
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    # An open file stays readable even if the cache evicts it meanwhile
+    cached = get_object_cache().open("media", object_name, version, size)
+    if cached is not None:
+        size = os.fstat(cached.fileno()).st_size
+    elif size is None:
+        size = minio_client.stat_object("media", object_name).size
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range:
+        # A Range only applies to the representation the client already has
+        if if_range.startswith(('"', "W/")):
+            # If-Range needs a strong match: weak tags never match (RFC 9110)
+            current = not etag.startswith("W/") and if_range.strip() == etag
+        else:
+            current = last_modified is not None and if_range == headers.get("Last-Modified")
+        if not current:
+            range_header = None
+    try:
+        byte_range = _byte_range(range_header, size)
+    except ValueError:
+        if cached is not None:
+            cached.close()
+        return Response(
+            status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"}
+        )
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        if cached is not None:
+            body = _iter_file(cached, 0, size)
+        else:
+            body = _iter_object(minio_client.get_object("media", object_name))
+        return StreamingResponse(body, media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if cached is not None:
+        body = _iter_file(cached, start, length)
+    else:
+        body = _iter_object(
+            minio_client.get_object("media", object_name, offset=start, length=length)
+        )
+    return StreamingResponse(
+        body, status_code=206, media_type=content_type, headers=headers
+    )
+
+
+@router.get("/cache/stats")
+async def get_media_cache_stats():
+    """Hit rate and size of the local media object cache."""
+    return get_object_cache().stats()
+
+
 @router.get("/{media_id}/file")
-async def get_media_file(media_id: int, db: Session = Depends(get_db)):
-    """Retrieve media file from MinIO."""
+async def get_media_file(media_id: int, request: Request, db: Session = Depends(get_db)):
+    """Retrieve media file from MinIO.
+
+    Supports Range requests (for seeking in video and audio) and conditional
+    GET with If-None-Match or If-Modified-Since.
+    """
     media = db.query(Media).filter(Media.id == media_id).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
-    try:
-        response = minio_client.get_object("media", media.file_path)
-        content_type = (
-            mimetypes.guess_type(media.filename)[0] or "application/octet-stream"
-        )
-
-        # Generate ETag from media id and updated_at timestamp
-        etag = f'"{media.id}-{int(media.updated_at.timestamp()) if media.updated_at else 0}"'
+    content_type = (
+        mimetypes.guess_type(media.filename)[0] or "application/octet-stream"
+    )
+    # Stored files never change, so the content hash (or path) identifies them
+    etag = f'"{media.content_hash or hashlib.sha1(media.file_path.encode()).hexdigest()}"'
 
-        return StreamingResponse(
-            response,
-            media_type=content_type,
-            headers={
+    try:
+        return await run_in_threadpool(
+            _object_response,
+            request,
+            media.file_path,
+            media.content_hash or "",
+            content_type,
+            etag,
+            media.created_at,
+            media.file_size,
+            {
                 "Content-Disposition": f'inline; filename="{media.filename}"',
                 "Cache-Control": "public, max-age=31536000, immutable",
-                "ETag": etag,
-                "Content-Length": str(media.file_size) if media.file_size else None,
             },
         )
     except Exception as e:
@@ -195,31 +377,72 @@ async def get_media_file(media_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/{media_id}/thumbnail")
-async def get_media_thumbnail(media_id: int, db: Session = Depends(get_db)):
-    """Retrieve thumbnail for media file (smaller, faster loading)."""
+async def get_media_thumbnail(
+    media_id: int,
+    request: Request,
+    size: str = THUMBNAIL_SIZE,
+    format: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Retrieve a resized copy of a media file (smaller, faster loading).
+
+    `size` is one of avatar, grid (default) or preview. WebP is served when
+    `format=webp` is given or the Accept header allows it, JPEG otherwise.
+    """
+    if size not in DERIVATIVE_SIZES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"size must be one of: {', '.join(DERIVATIVE_SIZES)}",
+        )
+    if format is not None and format not in FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}"
+        )
     media = db.query(Media).filter(Media.id == media_id).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
-    # If no thumbnail exists, fall back to original file
-    file_to_serve = media.thumbnail_path or media.file_path
-    content_type = (
-        "image/jpeg"
-        if media.thumbnail_path
-        else (mimetypes.guess_type(media.filename)[0] or "application/octet-stream")
-    )
+    if format is None:
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    derivative = (media.derivatives or {}).get(size, {}).get(format)
+
+    # Until derivatives exist, fall back to the old thumbnail or the original
+    # file, without letting the browser cache it for good. Derivatives are
+    # rewritten in place when regenerated, so their timestamp versions them;
+    # the original never changes
+    cache_control = "public, max-age=31536000, immutable"
+    last_modified = media.derivatives_updated_at
+    version = last_modified.isoformat() if last_modified else ""
+    file_size = None
+    if derivative:
+        file_to_serve = derivative
+        content_type = FORMATS[format][1]
+    elif media.thumbnail_path:
+        file_to_serve = media.thumbnail_path
+        content_type = "image/jpeg"
+    else:
+        file_to_serve = media.file_path
+        content_type = mimetypes.guess_type(media.filename)[0] or "application/octet-stream"
+        cache_control = "no-cache"
+        last_modified = media.created_at
+        version = media.content_hash or ""
+        file_size = media.file_size
 
     try:
-        response = minio_client.get_object("media", file_to_serve)
-        etag = f'"{media.id}-thumb-{int(media.updated_at.timestamp()) if media.updated_at else 0}"'
-
-        return StreamingResponse(
-            response,
-            media_type=content_type,
-            headers={
+        etag = f'"{hashlib.sha1(f"{file_to_serve}@{version}".encode()).hexdigest()[:16]}"'
+        return await run_in_threadpool(
+            _object_response,
+            request,
+            file_to_serve,
+            version,
+            content_type,
+            etag,
+            last_modified,
+            file_size,
+            {
                 "Content-Disposition": f'inline; filename="thumb_{media.filename}"',
-                "Cache-Control": "public, max-age=31536000, immutable",
-                "ETag": etag,
+                "Cache-Control": cache_control,
+                "Vary": "Accept",
             },
         )
     except Exception as e:
@@ -229,6 +452,62 @@ async def get_media_thumbnail(media_id: int, db: Session = Depends(get_db)):
         )
 
 
+@router.get("/{media_id}/image")
+async def get_resized_image(
+    media_id: int,
+    request: Request,
+    w: Optional[int] = None,
+    h: Optional[int] = None,
+    fit: str = "contain",
+    format: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Retrieve an image resized on demand.
+
+    `w` and `h` come from a fixed list of sizes; with `fit=cover` the image is
+    cropped to fill the box. WebP is served when `format=webp` is given or
+    the Accept header allows it, JPEG otherwise. Renderings are cached.
+    """
+    media = db.query(Media).filter(Media.id == media_id).first()
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+    if media.media_type != "image":
+        raise HTTPException(status_code=400, detail="Media is not an image")
+
+    if format is None:
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    try:
+        derivatives.check_resize(w, h, fit, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    path = derivatives.resized_path(media.file_path, w, h, fit, format)
+    etag = f'"{hashlib.sha1(path.encode()).hexdigest()[:16]}"'
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag, "Vary": "Accept"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        # Resizing is CPU-bound, so it runs in the derivative process pool
+        data = await asyncio.wrap_future(
+            derivatives.resized_image(media.file_path, w, h, fit, format)
+        )
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Media is not a readable image")
+    except Exception as e:
+        print(f"Error resizing image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error resizing image: {str(e)}")
+
+    return Response(content=data, media_type=FORMATS[format][1], headers=headers)
+
+
+def resume_derivative_jobs() -> None:
+    """Requeue derivative generation cut off by a restart (called at startup)."""
+    try:
+        derivatives.resume_pending()
+    except Exception as e:
+        print(f"[ERROR] Could not resume derivative jobs: {str(e)}")
+
+
 @router.get("/{media_id}/url")
 async def get_media_url(media_id: int, db: Session = Depends(get_db)):
     """Get a presigned URL for direct MinIO access (faster, bypasses API)."""
@@ -1,8 +1,8 @@
 """API routes for people/individuals."""
 
-import io
 from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from database import get_db
@@ -11,8 +11,12 @@ from schemas.people import (
     CreatePersonRequest,
     UpdatePersonRequest,
     AddRelationshipRequest,
+    MergePeopleRequest,
+    BulkPeopleRequest,
 )
-from services.storage import minio_client
+from services import autocomplete, derivatives, media_blobs
+from services.bulk_people import bulk_upsert_people
+from services.merge import merge_people
 
 router = APIRouter(prefix="/people", tags=["people"])
 
@@ -384,33 +388,32 @@ async def upload_profile_image(
         raise HTTPException(status_code=404, detail="Person not found")
 
     try:
-        file_content = await file.read()
-        file_size = len(file_content)
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"profile_{person_id}_{timestamp}_{file.filename}"
-
-        minio_client.put_object(
-            "media",
-            filename,
-            io.BytesIO(file_content),
-            file_size,
-            content_type=file.content_type,
+        file_path, file_size, content_hash, uploaded = await run_in_threadpool(
+            media_blobs.store,
+            db,
+            file.file,
+            file.content_type or "application/octet-stream",
         )
 
         new_media = Media(
             filename=file.filename,
-            file_path=filename,
+            file_path=file_path,
             media_type="image",
             file_size=file_size,
+            content_hash=content_hash,
+            derivatives_status="pending",
         )
         db.add(new_media)
         db.flush()
+        if not uploaded:
+            derivatives.copy_from_duplicate(db, new_media)
 
         person.profile_image_id = new_media.id
         person.media.append(new_media)
 
         db.commit()
+        if new_media.derivatives_status == "pending":
+            derivatives.enqueue(new_media.id, new_media.file_path)
 
         return {
             "id": new_media.id,
@@ -525,3 +528,108 @@ async def add_child(
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/merge")
+async def merge_people_endpoint(
+    data: MergePeopleRequest, db: Session = Depends(get_db)
+):
+    """Merge duplicate people into target people in a single transaction.
+
+    Every reference to a source person (events, families, sources, notes,
+    media tags, profile image) is moved to its target, then the source is
+    deleted.
+    """
+    pairs = []
+    seen = set()
+    targets = {m.target_id for m in data.merges}
+    for merge in data.merges:
+        for source_id in merge.source_ids:
+            if source_id == merge.target_id:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Person {source_id} cannot be merged into itself",
+                )
+            if source_id in targets:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Person {source_id} is both a merge source and a target",
+                )
+            if source_id in seen:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Person {source_id} appears in more than one merge",
+                )
+            seen.add(source_id)
+            pairs.append((source_id, merge.target_id))
+
+    if not pairs:
+        raise HTTPException(status_code=400, detail="No people to merge")
+
+    all_ids = seen | targets
+    found = {
+        r[0] for r in db.query(Individual.id).filter(Individual.id.in_(all_ids)).all()
+    }
+    missing = sorted(all_ids - found)
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"People not found: {', '.join(str(i) for i in missing)}",
+        )
+
+    # A family can't have the same person in both spouse slots
+    merged_into = dict(pairs)
+    couples = db.query(Family.id, Family.spouse1_id, Family.spouse2_id).filter(
+        Family.spouse1_id.in_(all_ids), Family.spouse2_id.in_(all_ids)
+    )
+    for family_id, spouse1_id, spouse2_id in couples:
+        if merged_into.get(spouse1_id, spouse1_id) == merged_into.get(
+            spouse2_id, spouse2_id
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Spouses {spouse1_id} and {spouse2_id} of family "
+                f"{family_id} cannot be merged into one person",
+            )
+
+    try:
+        counts = merge_people(db, pairs)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    autocomplete.mark_stale(people_ids=all_ids)
+
+    return {
+        "merged": len(pairs),
+        "targets": sorted(targets),
+        "updated": counts,
+        "message": f"Merged {len(pairs)} people into {len(targets)} targets",
+    }
+
+
+@router.post("/bulk")
+async def bulk_create_people(data: BulkPeopleRequest, db: Session = Depends(get_db)):
+    """Create or update many people and families in a single transaction.
+
+    New people are given a client-side `temp_id` that families can reference
+    before the database IDs exist; the response maps each temp_id to its ID.
+    """
+    try:
+        result = bulk_upsert_people(db, data)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    autocomplete.mark_stale(
+        people_ids=result.pop("person_ids"), place_names=result.pop("places")
+    )
+    result["message"] = (
+        f"Created {result['created']} and updated {result['updated']} people"
+    )
+    return result
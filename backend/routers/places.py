@@ -1,100 +1,214 @@
 """API routes for places."""
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select, tuple_, union
+from sqlalchemy.orm import Session, aliased
 
 from database import get_db
-from models import Individual, Event
+from models import Individual, Family, Event, Place, individual_event, family_event
+from services.places import subtree_place_ids
+from utils import encode_cursor, decode_cursor
 
 router = APIRouter(prefix="/places", tags=["places"])
 
+# Person event types listed on the place detail page, and their response keys
+PERSON_EVENT_LISTS = {"BIRT": "births", "DEAT": "deaths", "BURI": "burials"}
+
+
+def _full_name(person):
+    return func.concat_ws(" ", person.first_name, person.last_name)
+
 
 @router.get("")
-async def get_places(db: Session = Depends(get_db)):
-    """Get all unique places from events."""
-    events = db.query(Event).filter(Event.place.isnot(None)).all()
-    places = {}
+async def get_places(
+    level: Optional[str] = None,
+    parent_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """Get places with their event counts.
 
-    for event in events:
-        if event.place:
-            place = event.place.strip()
-            if place not in places:
-                places[place] = {"name": place, "count": 0}
-            places[place]["count"] += 1
+    By default lists every place events were recorded at. Filtering by
+    `level` (e.g. country) or `parent_id` browses the place hierarchy instead,
+    including places whose events are all recorded at sub-places.
+    """
+    query = db.query(Place)
+    if level or parent_id is not None:
+        if level:
+            query = query.filter(Place.level == level)
+        if parent_id is not None:
+            query = query.filter(Place.parent_id == parent_id)
+        query = query.filter(Place.total_event_count > 0)
+    else:
+        query = query.filter(Place.event_count > 0)
 
-    sorted_places = sorted(places.values(), key=lambda x: x["name"])
-    return sorted_places
+    return [
+        {
+            "id": p.id,
+            "name": p.name,
+            "level": p.level,
+            "parent_id": p.parent_id,
+            "count": p.event_count,
+            "total_count": p.total_event_count,
+        }
+        for p in query.order_by(Place.name).all()
+    ]
 
 
 @router.get("/{place_name}")
-async def get_place_details(place_name: str, db: Session = Depends(get_db)):
-    """Get all events and people associated with a specific place."""
-    events = db.query(Event).filter(Event.place == place_name).all()
+async def get_place_details(
+    place_name: str,
+    include_subplaces: bool = False,
+    people_limit: Optional[int] = Query(None, ge=1, le=1000),
+    people_cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Get all events and people associated with a specific place.
+
+    With `include_subplaces`, events at every place below it are included
+    too, e.g. everyone born anywhere in a country. People are sorted by name;
+    pass `people_limit` to page them, with `people_next_cursor` set while
+    more remain.
+    """
+    place = db.query(Place).filter(Place.name == place_name).first()
+    if not place:
+        raise HTTPException(status_code=404, detail="Place not found")
 
-    if not events:
+    if include_subplaces:
+        place_filter = Event.place_id.in_(subtree_place_ids(place.id))
+        event_count = place.total_event_count
+    else:
+        place_filter = Event.place_id == place.id
+        event_count = place.event_count
+    if not event_count:
         raise HTTPException(status_code=404, detail="Place not found")
 
-    births = []
-    deaths = []
+    # Births, deaths and burials with the (first) person each belongs to
+    person_events = (
+        db.query(
+            Event.id,
+            Event.event_type,
+            Event.event_date,
+            Event.place,
+            Individual.id,
+            _full_name(Individual),
+        )
+        .join(individual_event, individual_event.c.event_id == Event.id)
+        .join(Individual, Individual.id == individual_event.c.individual_id)
+        .filter(place_filter, Event.event_type.in_(list(PERSON_EVENT_LISTS)))
+        .order_by(Event.id, Individual.id)
+        .distinct(Event.id)
+        .all()
+    )
+    lists = {key: [] for key in PERSON_EVENT_LISTS.values()}
+    for event_id, event_type, event_date, event_place, person_id, name in person_events:
+        lists[PERSON_EVENT_LISTS[event_type]].append(
+            {
+                "id": event_id,
+                "date": event_date,
+                "place": event_place,
+                "individual_id": person_id,
+                "individual_name": name,
+            }
+        )
+
+    # Marriages are linked to families, so take the names from the spouses
+    spouse1 = aliased(Individual)
+    spouse2 = aliased(Individual)
+    marriage_rows = (
+        db.query(
+            Event.id,
+            Event.event_date,
+            Event.place,
+            Family.id,
+            spouse1.id,
+            _full_name(spouse1),
+            spouse2.id,
+            _full_name(spouse2),
+        )
+        .join(family_event, family_event.c.event_id == Event.id)
+        .join(Family, Family.id == family_event.c.family_id)
+        .outerjoin(spouse1, spouse1.id == Family.spouse1_id)
+        .outerjoin(spouse2, spouse2.id == Family.spouse2_id)
+        .filter(place_filter, Event.event_type == "MARR")
+        .order_by(Event.id, Family.id)
+        .distinct(Event.id)
+        .all()
+    )
     marriages = []
-    people_ids = set()
-
-    for event in events:
-        event_data = {"id": event.id, "date": event.event_date, "place": event.place}
-
-        if event.event_type == "BIRT":
-            if event.individuals:
-                person = event.individuals[0]
-                people_ids.add(person.id)
-                births.append(
-                    {
-                        **event_data,
-                        "individual_id": person.id,
-                        "individual_name": f"{person.first_name} {person.last_name}",
-                    }
-                )
-        elif event.event_type == "DEAT":
-            if event.individuals:
-                person = event.individuals[0]
-                people_ids.add(person.id)
-                deaths.append(
-                    {
-                        **event_data,
-                        "individual_id": person.id,
-                        "individual_name": f"{person.first_name} {person.last_name}",
-                    }
-                )
-        elif event.event_type == "MARR":
-            if event.individuals:
-                person = event.individuals[0]
-                people_ids.add(person.id)
-                marriages.append(
-                    {
-                        **event_data,
-                        "individual_id": person.id,
-                        "individual_name": f"{person.first_name} {person.last_name}",
-                    }
-                )
-
-    # Get unique people associated with this place
-    people = []
-    for person_id in people_ids:
-        person = db.query(Individual).filter(Individual.id == person_id).first()
-        if person:
-            people.append(
-                {
-                    "id": person.id,
-                    "name": f"{person.first_name} {person.last_name}",
-                    "sex": person.sex,
-                }
-            )
+    for row in marriage_rows:
+        event_id, event_date, event_place, family_id = row[:4]
+        spouses = [
+            {"id": spouse_id, "name": name}
+            for spouse_id, name in (row[4:6], row[6:8])
+            if spouse_id
+        ]
+        marriages.append(
+            {
+                "id": event_id,
+                "date": event_date,
+                "place": event_place,
+                "family_id": family_id,
+                "spouses": spouses,
+                # First spouse, for clients that link a single person
+                "individual_id": spouses[0]["id"] if spouses else None,
+                "individual_name": spouses[0]["name"] if spouses else "",
+            }
+        )
+
+    # Everyone with an event here, directly or as a spouse in a marriage
+    direct_people = (
+        select(individual_event.c.individual_id.label("person_id"))
+        .join(Event, Event.id == individual_event.c.event_id)
+        .where(place_filter)
+    )
+    spouse_people = [
+        select(getattr(Family, column).label("person_id"))
+        .join(family_event, family_event.c.family_id == Family.id)
+        .join(Event, Event.id == family_event.c.event_id)
+        .where(place_filter, Event.event_type == "MARR")
+        for column in ("spouse1_id", "spouse2_id")
+    ]
+    people_ids = union(direct_people, *spouse_people).subquery()
+    people_count = db.query(func.count()).select_from(people_ids).scalar()
+
+    name = _full_name(Individual)
+    people_query = db.query(Individual.id, name, Individual.sex).filter(
+        Individual.id.in_(select(people_ids.c.person_id))
+    )
+    if people_cursor:
+        try:
+            last_name, last_id = decode_cursor(people_cursor, str, int)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        people_query = people_query.filter(
+            tuple_(name, Individual.id) > tuple_(last_name, last_id)
+        )
+    people_query = people_query.order_by(name, Individual.id)
+    if people_limit:
+        people_query = people_query.limit(people_limit + 1)
+    people_rows = people_query.all()
+
+    people_next_cursor = None
+    if people_limit and len(people_rows) > people_limit:
+        people_rows = people_rows[:people_limit]
+        people_next_cursor = encode_cursor(people_rows[-1][1], people_rows[-1][0])
 
     return {
         "place_name": place_name,
-        "event_count": len(events),
-        "people_count": len(people),
-        "births": births,
-        "deaths": deaths,
+        "place_id": place.id,
+        "level": place.level,
+        "parent_id": place.parent_id,
+        "event_count": event_count,
+        "people_count": people_count,
+        "births": lists["births"],
+        "deaths": lists["deaths"],
+        "burials": lists["burials"],
         "marriages": marriages,
-        "people": sorted(people, key=lambda x: x["name"]),
+        "people": [
+            {"id": person_id, "name": person_name, "sex": sex}
+            for person_id, person_name, sex in people_rows
+        ],
+        "people_next_cursor": people_next_cursor,
     }
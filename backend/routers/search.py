@@ -0,0 +1,36 @@
+"""API routes for unified full-text search."""
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from database import get_db
+from services.search import SEARCH_TYPES, search_all
+
+router = APIRouter(tags=["search"])
+
+
+@router.get("/search")
+async def search(
+    q: str = Query(..., min_length=1),
+    types: Optional[str] = Query(None, description="Comma-separated hit types"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Search people, places, events, notes and media text in one ranked list."""
+    type_list = None
+    if types:
+        type_list = [t.strip() for t in types.split(",") if t.strip()]
+        unknown = [t for t in type_list if t not in SEARCH_TYPES]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown search types: {', '.join(unknown)}",
+            )
+
+    try:
+        return search_all(db, q, type_list, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -6,6 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from fastapi.responses import Response
 
 from database import SessionLocal, get_db
+from routers.map import prewarm_map_caches
 from services.storage import minio_client
 from services.gedcom import import_gedcom, export_gedcom
 
@@ -41,6 +42,8 @@ async def upload_file(file: UploadFile = File(...)):
     finally:
         db.close()
 
+    # Imported events may land on places that are already geocoded
+    prewarm_map_caches()
     return {"message": "GEDCOM uploaded and parsed successfully"}
 
 
@@ -1,13 +1,29 @@
 """Pydantic schemas package."""
 
-from .people import CreatePersonRequest, UpdatePersonRequest, AddRelationshipRequest
+from .people import (
+    CreatePersonRequest,
+    UpdatePersonRequest,
+    AddRelationshipRequest,
+    PersonMerge,
+    MergePeopleRequest,
+    BulkPerson,
+    BulkFamily,
+    BulkPeopleRequest,
+)
 from .media import MediaUpdateRequest
 from .backup import GitHubBackupRequest
+from .duplicates import DuplicateScanRequest
 
 __all__ = [
     "CreatePersonRequest",
     "UpdatePersonRequest",
     "AddRelationshipRequest",
+    "PersonMerge",
+    "MergePeopleRequest",
+    "BulkPerson",
+    "BulkFamily",
+    "BulkPeopleRequest",
     "MediaUpdateRequest",
     "GitHubBackupRequest",
+    "DuplicateScanRequest",
 ]
@@ -0,0 +1,7 @@
+"""Pydantic schemas for duplicate detection endpoints."""
+
+from pydantic import BaseModel
+
+
+class DuplicateScanRequest(BaseModel):
+    incremental: bool = False
@@ -1,7 +1,7 @@
 """Pydantic schemas for people-related endpoints."""
 
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List, Union
 
 
 class CreatePersonRequest(BaseModel):
@@ -31,3 +31,41 @@ class UpdatePersonRequest(BaseModel):
 
 class AddRelationshipRequest(BaseModel):
     related_person_id: int
+
+
+class PersonMerge(BaseModel):
+    target_id: int
+    source_ids: List[int]
+
+
+class MergePeopleRequest(BaseModel):
+    merges: List[PersonMerge]
+
+
+class BulkPerson(BaseModel):
+    temp_id: Optional[str] = None  # Client-side reference for new people
+    id: Optional[int] = None  # Existing person to update
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    sex: Optional[str] = None
+    birth_date: Optional[str] = None
+    birth_place: Optional[str] = None
+    death_date: Optional[str] = None
+    death_place: Optional[str] = None
+    burial_date: Optional[str] = None
+    burial_place: Optional[str] = None
+
+
+class BulkFamily(BaseModel):
+    temp_id: Optional[str] = None
+    # References are a person temp_id (str) or an existing person id (int)
+    spouse1: Optional[Union[int, str]] = None
+    spouse2: Optional[Union[int, str]] = None
+    children: List[Union[int, str]] = []
+    marriage_date: Optional[str] = None
+    marriage_place: Optional[str] = None
+
+
+class BulkPeopleRequest(BaseModel):
+    people: List[BulkPerson] = []
+    families: List[BulkFamily] = []
@@ -1,10 +1,28 @@
 """Services package."""
 
-from . import storage, text_extraction, gedcom, geocoding
+from . import (
+    storage, text_extraction, gedcom, geocoding, autocomplete, search, duplicates,
+    merge, bulk_people, places, place_names, gazetteer, map_tiles,
+    vector_tiles, migration_flows, heatmap, derivatives, media_blobs,
+)
 
 __all__ = [
     "storage",
     "text_extraction",
     "gedcom",
     "geocoding",
+    "autocomplete",
+    "search",
+    "duplicates",
+    "merge",
+    "bulk_people",
+    "places",
+    "place_names",
+    "gazetteer",
+    "map_tiles",
+    "vector_tiles",
+    "migration_flows",
+    "heatmap",
+    "derivatives",
+    "media_blobs",
 ]
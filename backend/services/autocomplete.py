@@ -0,0 +1,284 @@
+"""In-memory prefix index for person and place typeahead.
+
+The index is built lazily from the database on first use and kept current by
+SQLAlchemy session hooks: every committed flush that touches an Individual or
+Event marks the affected entries as stale, and the next lookup refreshes just
+those entries with a single query before searching.
+"""
+
+import heapq
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+
+from sqlalchemy import event as sa_event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from models import Individual, Event, individual_event
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def normalize_tokens(text: str) -> list[str]:
+    """Split text into lowercase, accent-free word tokens."""
+    if not text:
+        return []
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(stripped.casefold())
+
+
+class PrefixIndex:
+    """Sorted list of (token, key) pairs searched by bisection."""
+
+    def __init__(self):
+        self._entries = []
+        self._tokens = {}
+        self.records = {}
+
+    def load(self, items) -> None:
+        """Replace the index contents with (key, tokens, record) items."""
+        entries = []
+        self._tokens = {}
+        self.records = {}
+        for key, tokens, record in items:
+            tokens = sorted(set(tokens))
+            self._tokens[key] = tokens
+            self.records[key] = record
+            entries.extend((t, key) for t in tokens)
+        entries.sort()
+        self._entries = entries
+
+    def put(self, key, tokens, record) -> None:
+        """Insert or replace a single entry."""
+        self.remove(key)
+        tokens = sorted(set(tokens))
+        self._tokens[key] = tokens
+        self.records[key] = record
+        for t in tokens:
+            pos = bisect_left(self._entries, (t, key))
+            self._entries.insert(pos, (t, key))
+
+    def remove(self, key) -> None:
+        """Drop an entry if present."""
+        tokens = self._tokens.pop(key, None)
+        self.records.pop(key, None)
+        for t in tokens or []:
+            pos = bisect_left(self._entries, (t, key))
+            if pos < len(self._entries) and self._entries[pos] == (t, key):
+                del self._entries[pos]
+
+    def search(self, query: str, limit: int, rank) -> list:
+        """Return up to `limit` records whose tokens prefix-match every query token.
+
+        `rank(record, exact_matches)` returns a sort key; lower sorts first.
+        """
+        terms = normalize_tokens(query)
+        if not terms:
+            return []
+
+        # Scan the whole range of the most selective (longest) term; the
+        # entries are in token order, so any cut-off would drop by name, not rank
+        lead = max(terms, key=len)
+        lo = bisect_left(self._entries, (lead,))
+        hi = bisect_left(self._entries, (lead + "\uffff",))
+
+        def scored():
+            seen = set()
+            for i in range(lo, hi):
+                key = self._entries[i][1]
+                if key in seen:
+                    continue
+                seen.add(key)
+                tokens = self._tokens[key]
+                if not all(any(t.startswith(term) for t in tokens) for term in terms):
+                    continue
+                exact = sum(1 for term in terms if term in tokens)
+                yield rank(self.records[key], exact), key
+
+        # A heap of `limit` entries, not a sort of every match
+        return [self.records[key] for _, key in heapq.nsmallest(limit, scored())]
+
+
+_lock = threading.Lock()
+_people = PrefixIndex()
+_places = PrefixIndex()
+_state = {
+    "loaded": False,
+    "stale_people": set(),
+    "stale_events": set(),
+    "stale_places": set(),
+}
+
+
+def _birth_dates():
+    """Subquery of earliest dated birth per individual."""
+    return (
+        select(
+            individual_event.c.individual_id.label("individual_id"),
+            func.min(Event.event_date).label("birth_date"),
+        )
+        .join(Event, Event.id == individual_event.c.event_id)
+        .where(Event.event_type == "BIRT", Event.event_date.isnot(None))
+        .group_by(individual_event.c.individual_id)
+        .subquery()
+    )
+
+
+def _query_people(db: Session, ids=None):
+    births = _birth_dates()
+    query = db.query(
+        Individual.id,
+        Individual.first_name,
+        Individual.last_name,
+        Individual.sex,
+        Individual.profile_image_id,
+        births.c.birth_date,
+    ).outerjoin(births, births.c.individual_id == Individual.id)
+    if ids is not None:
+        query = query.filter(Individual.id.in_(ids))
+    return query.all()
+
+
+def _person_item(row):
+    record = {
+        "id": row.id,
+        "first_name": row.first_name,
+        "last_name": row.last_name,
+        "sex": row.sex,
+        "birth_year": row.birth_date.year if row.birth_date else None,
+        "profile_image_id": row.profile_image_id,
+    }
+    tokens = normalize_tokens(row.first_name) + normalize_tokens(row.last_name)
+    return row.id, tokens, record
+
+
+def _query_places(db: Session, names=None):
+    name = func.trim(Event.place)
+    query = db.query(name.label("name"), func.count(Event.id).label("count")).filter(
+        Event.place.isnot(None), name != ""
+    )
+    if names is not None:
+        query = query.filter(name.in_(names))
+    return query.group_by(name).all()
+
+
+def _place_item(row):
+    return row.name, normalize_tokens(row.name), {"name": row.name, "count": row.count}
+
+
+def _refresh(db: Session) -> None:
+    """Build the index on first use, then apply any pending changes."""
+    if not _state["loaded"]:
+        _people.load(_person_item(r) for r in _query_people(db))
+        _places.load(_place_item(r) for r in _query_places(db))
+        _state["loaded"] = True
+        _state["stale_people"].clear()
+        _state["stale_events"].clear()
+        _state["stale_places"].clear()
+        return
+
+    people_ids = set(_state["stale_people"])
+    event_ids = _state["stale_events"]
+    if event_ids:
+        rows = (
+            db.query(individual_event.c.individual_id)
+            .filter(individual_event.c.event_id.in_(event_ids))
+            .all()
+        )
+        people_ids.update(r[0] for r in rows)
+    if people_ids:
+        found = set()
+        for row in _query_people(db, people_ids):
+            found.add(row.id)
+            _people.put(*_person_item(row))
+        for missing in people_ids - found:
+            _people.remove(missing)
+
+    place_names = _state["stale_places"]
+    if place_names:
+        found = set()
+        for row in _query_places(db, place_names):
+            found.add(row.name)
+            _places.put(*_place_item(row))
+        for missing in place_names - found:
+            _places.remove(missing)
+
+    _state["stale_people"].clear()
+    _state["stale_events"].clear()
+    _state["stale_places"].clear()
+
+
+def search_people(db: Session, query: str, limit: int = 10) -> list[dict]:
+    """Return people whose given names or surname start with the query terms."""
+    with _lock:
+        _refresh(db)
+        return _people.search(
+            query,
+            limit,
+            lambda r, exact: (
+                -exact,
+                (r["last_name"] or "").casefold(),
+                (r["first_name"] or "").casefold(),
+                r["birth_year"] or 0,
+            ),
+        )
+
+
+def search_places(db: Session, query: str, limit: int = 10) -> list[dict]:
+    """Return place names matching the query terms, most used first."""
+    with _lock:
+        _refresh(db)
+        return _places.search(
+            query, limit, lambda r, exact: (-exact, -r["count"], r["name"])
+        )
+
+
+def mark_stale(people_ids=(), place_names=()) -> None:
+    """Refresh the given people and places on next use (after Core-level writes)."""
+    with _lock:
+        _state["stale_people"].update(people_ids)
+        _state["stale_places"].update(n.strip() for n in place_names if n and n.strip())
+
+
+def invalidate() -> None:
+    """Force a full rebuild on next use (after bulk Core-level writes)."""
+    with _lock:
+        _state["loaded"] = False
+
+
+@sa_event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault(
+        "autocomplete_pending", {"people": set(), "events": set(), "places": set()}
+    )
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Individual):
+            pending["people"].add(obj.id)
+        elif isinstance(obj, Event):
+            pending["events"].add(obj.id)
+            # Link rows of a deleted event are gone before _refresh looks, so
+            # note its people now (the flush loaded them to delete the links)
+            people = inspect(obj).attrs.individuals.history
+            pending["people"].update(p.id for p in people.sum())
+            history = inspect(obj).attrs.place.history
+            for name in [obj.place] + list(history.deleted or []):
+                if name and name.strip():
+                    pending["places"].add(name.strip())
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    pending = session.info.pop("autocomplete_pending", None)
+    if not pending:
+        return
+    with _lock:
+        _state["stale_people"].update(pending["people"])
+        _state["stale_events"].update(pending["events"])
+        _state["stale_places"].update(pending["places"])
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("autocomplete_pending", None)
@@ -0,0 +1,250 @@
+"""Batched creation and update of people, their events and families.
+
+Rows of each kind are written with one multi-row INSERT ... RETURNING (or one
+executemany UPDATE) per table, so the number of round trips does not grow
+with the number of records in a request.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from models import (
+    Individual,
+    Family,
+    Event,
+    individual_event,
+    family_event,
+    child_in_family,
+)
+from schemas.people import BulkPeopleRequest
+from services.places import link_event_places
+
+# Event type -> (date field, place field) on BulkPerson
+PERSON_EVENTS = {
+    "BIRT": ("birth_date", "birth_place"),
+    "DEAT": ("death_date", "death_place"),
+    "BURI": ("burial_date", "burial_place"),
+}
+
+
+def _parse_date(value):
+    """Parse YYYY-MM-DD, ignoring invalid dates like the single-person endpoints."""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def _normalize_sex(sex):
+    return sex if sex in ["M", "F"] else None
+
+
+def _insert_returning_ids(db: Session, model, rows: list[dict]) -> list[int]:
+    """Insert rows in batches and return their new IDs in input order."""
+    if not rows:
+        return []
+    # Core table insert: the ORM-level bulk insert falls back to one statement
+    # per row for tables with server-generated columns
+    table = model.__table__
+    result = db.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+    )
+    return [r[0] for r in result]
+
+
+def bulk_upsert_people(db: Session, request: BulkPeopleRequest) -> dict:
+    """Create and update people and families from one request. Does not commit.
+
+    People with an `id` are updated (only fields that are provided); others
+    are created and may be referenced by their `temp_id` from families.
+    Raises ValueError for invalid or unresolvable references.
+    """
+    to_create = [p for p in request.people if p.id is None]
+    to_update = [p for p in request.people if p.id is not None]
+
+    temp_ids = [p.temp_id for p in to_create if p.temp_id]
+    if len(temp_ids) != len(set(temp_ids)):
+        raise ValueError("Duplicate person temp_id in request")
+    for p in to_create:
+        if not p.first_name or not p.last_name:
+            label = f" {p.temp_id}" if p.temp_id else ""
+            raise ValueError(f"New person{label} requires first_name and last_name")
+
+    # Collect existing IDs referenced anywhere so they can be checked at once
+    existing_refs = {p.id for p in to_update}
+    for fam in request.families:
+        for ref in [fam.spouse1, fam.spouse2, *fam.children]:
+            if isinstance(ref, int):
+                existing_refs.add(ref)
+    found = {
+        r[0]
+        for r in db.query(Individual.id).filter(Individual.id.in_(existing_refs)).all()
+    }
+    missing = existing_refs - found
+    if missing:
+        raise ValueError(
+            f"People not found: {', '.join(str(i) for i in sorted(missing))}"
+        )
+
+    # New people
+    new_ids = _insert_returning_ids(
+        db,
+        Individual,
+        [
+            {
+                "first_name": p.first_name,
+                "last_name": p.last_name,
+                "sex": _normalize_sex(p.sex),
+            }
+            for p in to_create
+        ],
+    )
+    people_map = {
+        p.temp_id: new_id for p, new_id in zip(to_create, new_ids) if p.temp_id
+    }
+
+    # Updated people: one executemany per distinct set of changed columns
+    updates_by_keys = {}
+    for p in to_update:
+        values = {"id": p.id}
+        if p.first_name is not None:
+            values["first_name"] = p.first_name
+        if p.last_name is not None:
+            values["last_name"] = p.last_name
+        if p.sex is not None and p.sex in ["M", "F", ""]:
+            values["sex"] = p.sex if p.sex else None
+        if len(values) > 1:
+            updates_by_keys.setdefault(tuple(sorted(values)), []).append(values)
+    for rows in updates_by_keys.values():
+        db.execute(update(Individual), rows)
+
+    # Existing events of the updated people, so updates don't create duplicates
+    existing_events = {}
+    if to_update:
+        rows = (
+            db.query(individual_event.c.individual_id, Event.event_type, Event.id)
+            .join(Event, Event.id == individual_event.c.event_id)
+            .filter(
+                individual_event.c.individual_id.in_([p.id for p in to_update]),
+                Event.event_type.in_(list(PERSON_EVENTS)),
+            )
+            .order_by(Event.id)
+            .all()
+        )
+        for individual_id, event_type, event_id in rows:
+            existing_events.setdefault((individual_id, event_type), event_id)
+
+    new_events = []  # (person_id, row)
+    event_updates_by_keys = {}
+    places = set()
+    people_with_ids = list(zip(to_create, new_ids)) + [(p, p.id) for p in to_update]
+    for p, person_id in people_with_ids:
+        for event_type, (date_field, place_field) in PERSON_EVENTS.items():
+            date_value = getattr(p, date_field)
+            place_value = getattr(p, place_field)
+            if date_value is None and place_value is None:
+                continue
+            values = {}
+            if date_value:
+                parsed = _parse_date(date_value)
+                if parsed:
+                    values["event_date"] = parsed
+            if place_value:
+                values["place"] = place_value
+                places.add(place_value)
+
+            event_id = existing_events.get((person_id, event_type))
+            if event_id:
+                if values:
+                    values["id"] = event_id
+                    event_updates_by_keys.setdefault(
+                        tuple(sorted(values)), []
+                    ).append(values)
+            else:
+                new_events.append((person_id, {"event_type": event_type, **values}))
+
+    # insertmanyvalues needs every row to have the same keys
+    for _, row in new_events:
+        row.setdefault("event_date", None)
+        row.setdefault("place", None)
+    event_ids = _insert_returning_ids(db, Event, [row for _, row in new_events])
+    if event_ids:
+        db.execute(
+            insert(individual_event),
+            [
+                {"individual_id": person_id, "event_id": event_id}
+                for (person_id, _), event_id in zip(new_events, event_ids)
+            ],
+        )
+    for rows in event_updates_by_keys.values():
+        db.execute(update(Event), rows)
+
+    # Families
+    def resolve(ref):
+        if ref is None or isinstance(ref, int):
+            return ref
+        if ref not in people_map:
+            raise ValueError(f"Unknown person temp_id: {ref}")
+        return people_map[ref]
+
+    family_rows = []
+    children_rows = []
+    marriages = []
+    for fam in request.families:
+        family_rows.append(
+            {"spouse1_id": resolve(fam.spouse1), "spouse2_id": resolve(fam.spouse2)}
+        )
+    family_ids = _insert_returning_ids(db, Family, family_rows)
+
+    families_map = {}
+    for fam, family_id in zip(request.families, family_ids):
+        if fam.temp_id:
+            families_map[fam.temp_id] = family_id
+        for child_id in {resolve(c) for c in fam.children}:
+            children_rows.append({"child_id": child_id, "family_id": family_id})
+        if fam.marriage_date or fam.marriage_place:
+            marriages.append(
+                (
+                    family_id,
+                    {
+                        "event_type": "MARR",
+                        "event_date": _parse_date(fam.marriage_date),
+                        "place": fam.marriage_place,
+                    },
+                )
+            )
+            if fam.marriage_place:
+                places.add(fam.marriage_place)
+
+    if children_rows:
+        db.execute(insert(child_in_family), children_rows)
+    marriage_ids = _insert_returning_ids(db, Event, [row for _, row in marriages])
+    if marriage_ids:
+        db.execute(
+            insert(family_event),
+            [
+                {"family_id": family_id, "event_id": event_id}
+                for (family_id, _), event_id in zip(marriages, marriage_ids)
+            ],
+        )
+
+    # Core inserts bypass the session hooks that link events to places
+    updated_event_ids = [
+        row["id"] for rows in event_updates_by_keys.values() for row in rows
+    ]
+    link_event_places(db, event_ids + marriage_ids + updated_event_ids)
+
+    return {
+        "people": people_map,
+        "families": families_map,
+        "created": len(new_ids),
+        "updated": len(to_update),
+        "families_created": len(family_ids),
+        "events_created": len(event_ids) + len(marriage_ids),
+        "person_ids": new_ids + [p.id for p in to_update],
+        "places": places,
+    }
@@ -0,0 +1,355 @@
+"""Resized copies of uploaded images, generated in worker processes.
+
+Each image gets a derivative per size in DERIVATIVE_SIZES, in both JPEG and
+WebP, stored in MinIO next to the original under
+"derivatives/<file path>/<size>.<ext>". Resizing is CPU-bound, so it runs in
+a process pool: uploads only enqueue the media and return. When a job
+finishes its paths are saved on the Media row, and the JPEG grid size also
+becomes `thumbnail_path`.
+
+Media waiting for derivatives have `derivatives_status` "pending" and are
+requeued at startup. Existing media without thumbnails (for example from a
+restored backup) are processed with:
+
+    python -m services.derivatives [--all]
+
+Other sizes are rendered on demand by `resized_image`, in the same process
+pool, for a width and height from IMAGE_DIMENSIONS. Each rendering is stored
+in the DERIVATIVE_BUCKET and kept in an in-memory LRU of IMAGE_CACHE_MB, so
+it is only made once.
+"""
+
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from minio.error import S3Error
+from PIL import Image, ImageOps
+from sqlalchemy import func
+
+from database import SessionLocal
+from models import Media
+
+# Longest edge in pixels of each derivative, largest first
+DERIVATIVE_SIZES = {"preview": 1200, "grid": 300, "avatar": 96}
+THUMBNAIL_SIZE = "grid"
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+}
+WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+# Originals up to this size are buffered in memory, larger ones on disk
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# Widths and heights accepted for on-demand renderings
+IMAGE_DIMENSIONS = (40, 80, 120, 160, 240, 320, 480, 640, 960, 1280, 1600)
+FITS = ("contain", "cover")
+DERIVATIVE_BUCKET = "derivatives"
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_MB", "64")) * 1024 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_image_cache = OrderedDict()
+_image_cache_bytes = 0
+_image_cache_lock = threading.Lock()
+
+
+def derivative_path(file_path: str, size: str, fmt: str) -> str:
+    return f"derivatives/{file_path}/{size}.{fmt}"
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """Convert to RGB, compositing transparency onto white."""
+    if img.mode in ("RGBA", "LA", "P"):
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def _fetch(client, bucket: str, path: str, target) -> None:
+    response = client.get_object(bucket, path)
+    try:
+        shutil.copyfileobj(response, target, 1024 * 1024)
+    finally:
+        response.close()
+        response.release_conn()
+    target.seek(0)
+
+
+def _open_scaled(fileobj, width: int, height: int) -> Image.Image:
+    """Open an image as RGB, applying its EXIF orientation.
+
+    JPEGs are decoded at a reduced scale that still covers width x height,
+    which keeps memory small.
+    """
+    img = Image.open(fileobj)
+    img.draft("RGB", (width, height))
+    img = ImageOps.exif_transpose(img)
+    return _flatten(img)
+
+
+def render_derivatives(file_path: str) -> dict:
+    """Create and store every derivative of an image (runs in a worker process).
+
+    Returns {size: {format: path}}. Raises if the file is not an image.
+    """
+    from services.storage import minio_client
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as original:
+        _fetch(minio_client, "media", file_path, original)
+        largest = max(DERIVATIVE_SIZES.values())
+        img = _open_scaled(original, largest, largest)
+
+        paths = {}
+        # Each size is resized from the previous, larger one
+        for size, edge in DERIVATIVE_SIZES.items():
+            img.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            paths[size] = {}
+            for fmt, (pil_format, content_type, options) in FORMATS.items():
+                buffer = io.BytesIO()
+                img.save(buffer, format=pil_format, **options)
+                path = derivative_path(file_path, size, fmt)
+                minio_client.put_object(
+                    "media",
+                    path,
+                    io.BytesIO(buffer.getvalue()),
+                    buffer.tell(),
+                    content_type=content_type,
+                )
+                paths[size][fmt] = path
+    return paths
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned rather than forked: the API process has threads and
+            # open database connections
+            _executor = ProcessPoolExecutor(
+                max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _save_result(media_id: int, future) -> None:
+    """Store a finished job's derivative paths, or mark it failed."""
+    db = SessionLocal()
+    try:
+        media = db.query(Media).filter(Media.id == media_id).first()
+        if not media:
+            return
+        try:
+            paths = future.result()
+        except Exception as e:
+            print(f"[ERROR] Derivatives for media {media_id} failed: {str(e)}")
+            media.derivatives_status = "failed"
+        else:
+            media.derivatives = paths
+            media.thumbnail_path = paths[THUMBNAIL_SIZE]["jpeg"]
+            media.derivatives_status = "ready"
+            media.derivatives_updated_at = func.now()
+        db.commit()
+    finally:
+        db.close()
+
+
+def enqueue(media_id: int, file_path: str):
+    """Generate a media item's derivatives in the background."""
+    future = _pool().submit(render_derivatives, file_path)
+    future.add_done_callback(lambda f: _save_result(media_id, f))
+    return future
+
+
+def copy_from_duplicate(db, media) -> bool:
+    """Give media the finished derivatives of another row with the same file.
+
+    Derivatives are stored by file path, which duplicates share (see
+    services/media_blobs.py). Returns False if there are none yet.
+    """
+    source = (
+        db.query(Media)
+        .filter(
+            Media.file_path == media.file_path,
+            Media.derivatives_status == "ready",
+            Media.id != media.id,
+        )
+        .first()
+    )
+    if source is None:
+        return False
+    media.derivatives = source.derivatives
+    media.thumbnail_path = source.thumbnail_path
+    media.derivatives_status = "ready"
+    media.derivatives_updated_at = source.derivatives_updated_at
+    return True
+
+
+def resume_pending() -> int:
+    """Requeue media whose derivatives were not finished (called at startup)."""
+    db = SessionLocal()
+    try:
+        pending = (
+            db.query(Media.id, Media.file_path)
+            .filter(Media.derivatives_status == "pending")
+            .all()
+        )
+    finally:
+        db.close()
+    for media_id, file_path in pending:
+        enqueue(media_id, file_path)
+    return len(pending)
+
+
+def regenerate(all_images: bool = False) -> dict:
+    """Generate derivatives for images without a thumbnail (or all images).
+
+    Waits for every job to finish. Returns counts of done and failed media.
+    """
+    global _executor
+    db = SessionLocal()
+    try:
+        conditions = [Media.media_type == "image"]
+        if not all_images:
+            conditions.append(Media.thumbnail_path.is_(None))
+        media = (
+            db.query(Media.id, Media.file_path)
+            .filter(*conditions)
+            .order_by(Media.id)
+            .all()
+        )
+        db.query(Media).filter(*conditions).update(
+            {"derivatives_status": "pending"}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    futures = [enqueue(media_id, file_path) for media_id, file_path in media]
+    failed = sum(1 for f in futures if f.exception() is not None)
+    # Shutting down waits for the callbacks that save the results
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+    return {"media": len(futures), "done": len(futures) - failed, "failed": failed}
+
+
+def _cache_lookup(key):
+    with _image_cache_lock:
+        data = _image_cache.get(key)
+        if data is not None:
+            _image_cache.move_to_end(key)
+        return data
+
+
+def _cache_store(key, data: bytes) -> None:
+    global _image_cache_bytes
+    if len(data) > IMAGE_CACHE_SIZE:
+        return
+    with _image_cache_lock:
+        if key in _image_cache:
+            return
+        _image_cache[key] = data
+        _image_cache_bytes += len(data)
+        while _image_cache_bytes > IMAGE_CACHE_SIZE:
+            _, evicted = _image_cache.popitem(last=False)
+            _image_cache_bytes -= len(evicted)
+
+
+def resized_path(file_path: str, width, height, fit: str, fmt: str) -> str:
+    return f"{file_path}/{width or 0}x{height or 0}-{fit}.{fmt}"
+
+
+def _resize(img: Image.Image, width, height, fit: str) -> Image.Image:
+    if fit == "cover" and width and height:
+        # Crop to the exact box, but never enlarge
+        scale = min(1.0, img.width / width, img.height / height)
+        box = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return ImageOps.fit(img, box, Image.Resampling.LANCZOS)
+    img.thumbnail((width or img.width, height or img.height), Image.Resampling.LANCZOS)
+    return img
+
+
+def check_resize(width, height, fit: str, fmt: str) -> None:
+    """Raise ValueError for dimensions, fits or formats outside the allowlists."""
+    if width is None and height is None:
+        raise ValueError("width or height is required")
+    for value in (width, height):
+        if value is not None and value not in IMAGE_DIMENSIONS:
+            raise ValueError(
+                f"width and height must be one of: {', '.join(map(str, IMAGE_DIMENSIONS))}"
+            )
+    if fit not in FITS:
+        raise ValueError(f"fit must be one of: {', '.join(FITS)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+
+
+def render_resized(file_path: str, width, height, fit: str, fmt: str) -> bytes:
+    """Fetch a stored rendering, or make and store it (runs in a worker process)."""
+    from services.storage import minio_client
+
+    path = resized_path(file_path, width, height, fit, fmt)
+    try:
+        with io.BytesIO() as stored:
+            _fetch(minio_client, DERIVATIVE_BUCKET, path, stored)
+            return stored.getvalue()
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as original:
+        _fetch(minio_client, "media", file_path, original)
+        img = _open_scaled(original, width or height, height or width)
+        img = _resize(img, width, height, fit)
+        pil_format, content_type, options = FORMATS[fmt]
+        buffer = io.BytesIO()
+        img.save(buffer, format=pil_format, **options)
+    data = buffer.getvalue()
+    minio_client.put_object(
+        DERIVATIVE_BUCKET, path, io.BytesIO(data), len(data), content_type=content_type
+    )
+    return data
+
+
+def resized_image(
+    file_path: str, width=None, height=None, fit: str = "contain", fmt: str = "jpeg"
+) -> Future:
+    """Resize an image to fit (or, with fit="cover", fill) width x height.
+
+    Either dimension may be None to keep the aspect ratio. Images are never
+    enlarged. Returns a future of the encoded bytes, rendered in the process
+    pool unless cached; it raises PIL's UnidentifiedImageError if the file is
+    not an image. Raises ValueError for arguments `check_resize` rejects.
+    """
+    check_resize(width, height, fit, fmt)
+    path = resized_path(file_path, width, height, fit, fmt)
+    data = _cache_lookup(path)
+    if data is not None:
+        future = Future()
+        future.set_result(data)
+        return future
+
+    def store(done):
+        if done.exception() is None:
+            _cache_store(path, done.result())
+
+    future = _pool().submit(render_resized, file_path, width, height, fit, fmt)
+    future.add_done_callback(store)
+    return future
+
+
+if __name__ == "__main__":
+    print(regenerate(all_images="--all" in sys.argv[1:]))
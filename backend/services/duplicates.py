@@ -0,0 +1,433 @@
+"""Duplicate person detection with phonetic blocking and pairwise scoring.
+
+People are grouped into blocks by the Soundex code of their surname plus the
+initial of their given name. Within a block, dated people are only compared to
+others born within BIRTH_YEAR_WINDOW years; undated people are compared to
+those sharing their first given name. Every person takes part in at most
+MAX_UNDATED_COMPARISONS such pairs, counted on both sides, so a large block
+of undated namesakes stays linear. Blocks are scored in a process pool and
+pairs above MIN_SCORE are stored in the duplicate_candidate table for review.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from models import (
+    Individual,
+    Family,
+    Event,
+    DuplicateCandidate,
+    DuplicateScan,
+    individual_event,
+    child_in_family,
+)
+from services.autocomplete import normalize_tokens
+
+MIN_SCORE = 0.75
+BIRTH_YEAR_WINDOW = 10
+MAX_UNDATED_COMPARISONS = 200
+INSERT_BATCH_SIZE = 5000
+
+# Feature weights; they sum to 1.0
+WEIGHTS = {
+    "given_name": 0.35,
+    "surname": 0.15,
+    "birth_year": 0.2,
+    "death_year": 0.1,
+    "birth_place": 0.1,
+    "relatives": 0.1,
+}
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(name: str) -> str:
+    """American Soundex code of the first word of a name ('' if none)."""
+    tokens = normalize_tokens(name)
+    word = "".join(c for c in (tokens[0] if tokens else "") if "a" <= c <= "z")
+    if not word:
+        return ""
+
+    code = word[0].upper()
+    last = _SOUNDEX_CODES.get(word[0], "")
+    for c in word[1:]:
+        digit = _SOUNDEX_CODES.get(c, "")
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        # 'h' and 'w' do not separate letters with the same code
+        if c not in "hw":
+            last = digit
+    return code.ljust(4, "0")
+
+
+def jaro_winkler(a: str, b: str) -> float:
+    """Jaro-Winkler similarity between two strings, 0.0 to 1.0."""
+    if a == b:
+        return 1.0 if a else 0.0
+    if not a or not b:
+        return 0.0
+
+    window = max(max(len(a), len(b)) // 2 - 1, 0)
+    a_matched = [False] * len(a)
+    b_matched = [False] * len(b)
+    matches = 0
+    for i, ca in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not b_matched[j] and b[j] == ca:
+                a_matched[i] = b_matched[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+
+    transpositions = 0
+    j = 0
+    for i, ca in enumerate(a):
+        if a_matched[i]:
+            while not b_matched[j]:
+                j += 1
+            if ca != b[j]:
+                transpositions += 1
+            j += 1
+
+    jaro = (
+        matches / len(a) + matches / len(b) + (matches - transpositions / 2) / matches
+    ) / 3
+
+    prefix = 0
+    for ca, cb in zip(a[:4], b[:4]):
+        if ca != cb:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def _year_score(a, b):
+    """1.0 for equal years, falling off with distance; None if either unknown."""
+    if a is None or b is None:
+        return None
+    diff = abs(a - b)
+    if diff == 0:
+        return 1.0
+    if diff == 1:
+        return 0.8
+    if diff <= 2:
+        return 0.5
+    if diff <= 5:
+        return 0.2
+    return 0.0
+
+
+def _overlap_score(a, b):
+    """Jaccard overlap of two token sets; None if either is empty."""
+    if not a or not b:
+        return None
+    return len(a & b) / len(a | b)
+
+
+def score_pair(p, q):
+    """Score two person feature tuples. Returns (score, details) or None.
+
+    Feature tuples are (id, given, surname, sex, birth_year, death_year,
+    birth_place_tokens, relative_names) as built by load_features.
+    """
+    _, given1, surname1, sex1, birth1, death1, place1, relatives1 = p
+    _, given2, surname2, sex2, birth2, death2, place2, relatives2 = q
+
+    if sex1 and sex2 and sex1 in "MF" and sex2 in "MF" and sex1 != sex2:
+        return None
+
+    details = {
+        "given_name": jaro_winkler(given1, given2),
+        "surname": jaro_winkler(surname1, surname2),
+        "birth_year": _year_score(birth1, birth2),
+        "death_year": _year_score(death1, death2),
+        "birth_place": _overlap_score(place1, place2),
+        "relatives": _overlap_score(relatives1, relatives2),
+    }
+
+    # Far-apart known dates rule a pair out regardless of names
+    if details["birth_year"] == 0.0 or details["death_year"] == 0.0:
+        return None
+
+    # Unknown features count as neutral evidence
+    score = sum(
+        WEIGHTS[k] * (0.5 if v is None else v) for k, v in details.items()
+    )
+    # Shared relatives are strong evidence on their own
+    if details["relatives"]:
+        score = min(1.0, score + 0.1 * details["relatives"])
+    return round(score, 4), details
+
+
+def _candidate_pairs(block):
+    """Yield index pairs within a block worth scoring."""
+    dated = sorted(
+        (i for i, p in enumerate(block) if p[4] is not None),
+        key=lambda i: block[i][4],
+    )
+    for pos, i in enumerate(dated):
+        year = block[i][4]
+        for j in dated[pos + 1:]:
+            if block[j][4] - year > BIRTH_YEAR_WINDOW:
+                break
+            yield i, j
+
+    by_given = {}
+    for i, p in enumerate(block):
+        by_given.setdefault(p[1].split(" ")[0], []).append(i)
+    # Undated pairs each person takes part in, on either side
+    compared = [0] * len(block)
+    for i, p in enumerate(block):
+        if p[4] is not None:
+            continue
+        for j in by_given[p[1].split(" ")[0]]:
+            if compared[i] >= MAX_UNDATED_COMPARISONS:
+                break
+            # Undated pairs are yielded once, from the lower index
+            if j == i or (block[j][4] is None and j < i):
+                continue
+            if compared[j] >= MAX_UNDATED_COMPARISONS:
+                continue
+            yield i, j
+            compared[i] += 1
+            compared[j] += 1
+
+
+def score_blocks(blocks, changed_ids=None):
+    """Score candidate pairs in a list of blocks (runs in a worker process).
+
+    If changed_ids is given, only pairs involving at least one of them are
+    scored. Returns (pairs_compared, [(id1, id2, score, details), ...]).
+    """
+    compared = 0
+    results = []
+    for block in blocks:
+        for i, j in _candidate_pairs(block):
+            p, q = block[i], block[j]
+            if changed_ids is not None and (
+                p[0] not in changed_ids and q[0] not in changed_ids
+            ):
+                continue
+            compared += 1
+            scored = score_pair(p, q)
+            if scored and scored[0] >= MIN_SCORE:
+                id1, id2 = sorted((p[0], q[0]))
+                results.append((id1, id2, scored[0], scored[1]))
+    return compared, results
+
+
+def _event_years(db: Session, event_type: str) -> dict:
+    rows = (
+        db.query(individual_event.c.individual_id, func.min(Event.event_date))
+        .join(Event, Event.id == individual_event.c.event_id)
+        .filter(Event.event_type == event_type, Event.event_date.isnot(None))
+        .group_by(individual_event.c.individual_id)
+        .all()
+    )
+    return {r[0]: r[1].year for r in rows}
+
+
+def load_features(db: Session) -> list[tuple]:
+    """Load a compact feature tuple for every individual in a few queries."""
+    people = db.query(
+        Individual.id, Individual.first_name, Individual.last_name, Individual.sex
+    ).all()
+    names = {
+        p.id: " ".join(normalize_tokens(f"{p.first_name or ''} {p.last_name or ''}"))
+        for p in people
+    }
+
+    births = _event_years(db, "BIRT")
+    deaths = _event_years(db, "DEAT")
+
+    birth_places = {}
+    place_rows = (
+        db.query(individual_event.c.individual_id, Event.place)
+        .join(Event, Event.id == individual_event.c.event_id)
+        .filter(Event.event_type == "BIRT", Event.place.isnot(None))
+        .all()
+    )
+    for individual_id, place in place_rows:
+        birth_places.setdefault(individual_id, frozenset(normalize_tokens(place)))
+
+    # Relatives: parents, spouses and children, compared by normalised name
+    relatives = {}
+    families = db.query(Family.id, Family.spouse1_id, Family.spouse2_id).all()
+    spouses_by_family = {}
+    for family_id, s1, s2 in families:
+        spouses_by_family[family_id] = [s for s in (s1, s2) if s]
+        if s1 and s2:
+            relatives.setdefault(s1, set()).add(s2)
+            relatives.setdefault(s2, set()).add(s1)
+    for child_id, family_id in db.query(
+        child_in_family.c.child_id, child_in_family.c.family_id
+    ).all():
+        for parent_id in spouses_by_family.get(family_id, []):
+            relatives.setdefault(child_id, set()).add(parent_id)
+            relatives.setdefault(parent_id, set()).add(child_id)
+
+    features = []
+    for p in people:
+        relative_names = frozenset(
+            names[r] for r in relatives.get(p.id, ()) if names.get(r)
+        )
+        features.append(
+            (
+                p.id,
+                " ".join(normalize_tokens(p.first_name)),
+                " ".join(normalize_tokens(p.last_name)),
+                p.sex,
+                births.get(p.id),
+                deaths.get(p.id),
+                birth_places.get(p.id, frozenset()),
+                relative_names,
+            )
+        )
+    return features
+
+
+def build_blocks(features: list[tuple]) -> list[list[tuple]]:
+    """Group feature tuples by surname Soundex code and given-name initial."""
+    blocks = {}
+    for f in features:
+        key = soundex(f[2])
+        if key:
+            blocks.setdefault((key, f[1][:1]), []).append(f)
+    return [b for b in blocks.values() if len(b) > 1]
+
+
+def _changed_since(db: Session, since) -> set:
+    """IDs of people whose own row or any of whose events changed since `since`."""
+    changed = {
+        r[0]
+        for r in db.query(Individual.id)
+        .filter(or_(Individual.updated_at >= since, Individual.created_at >= since))
+        .all()
+    }
+    changed.update(
+        r[0]
+        for r in db.query(individual_event.c.individual_id)
+        .join(Event, Event.id == individual_event.c.event_id)
+        .filter(Event.updated_at >= since)
+        .all()
+    )
+    return changed
+
+
+def _chunk_blocks(blocks, workers):
+    """Split blocks into roughly equal-work chunks for the process pool."""
+    chunks = [[] for _ in range(workers * 4)]
+    loads = [0] * len(chunks)
+    for block in sorted(blocks, key=len, reverse=True):
+        i = loads.index(min(loads))
+        chunks[i].append(block)
+        loads[i] += len(block) ** 2
+    return [c for c in chunks if c]
+
+
+def run_duplicate_scan(db: Session, scan_id: int, incremental: bool = False) -> dict:
+    """Run a duplicate scan and store candidate pairs.
+
+    A full scan replaces all pending candidates. An incremental scan only
+    re-scores pairs involving people changed since the last completed scan.
+    Pairs a reviewer has dismissed are never re-suggested.
+    """
+    scan = db.query(DuplicateScan).filter(DuplicateScan.id == scan_id).first()
+
+    changed_ids = None
+    if incremental:
+        last = (
+            db.query(DuplicateScan)
+            .filter(
+                DuplicateScan.status == "completed", DuplicateScan.id != scan_id
+            )
+            .order_by(DuplicateScan.started_at.desc())
+            .first()
+        )
+        if last:
+            changed_ids = _changed_since(db, last.started_at)
+
+    features = load_features(db)
+    blocks = build_blocks(features)
+    if changed_ids is not None:
+        blocks = [b for b in blocks if any(p[0] in changed_ids for p in b)]
+
+    workers = int(os.getenv("DUPLICATE_SCAN_WORKERS", os.cpu_count() or 1))
+    chunks = _chunk_blocks(blocks, workers)
+    compared = 0
+    results = []
+    if chunks:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            futures = [pool.submit(score_blocks, c, changed_ids) for c in chunks]
+            for future in futures:
+                chunk_compared, chunk_results = future.result()
+                compared += chunk_compared
+                results.extend(chunk_results)
+
+    # Replace pending candidates in scope, keeping reviewer decisions
+    stale = db.query(DuplicateCandidate).filter(
+        DuplicateCandidate.status == "pending"
+    )
+    if changed_ids is not None:
+        ids = list(changed_ids)
+        stale = stale.filter(
+            or_(
+                DuplicateCandidate.individual1_id.in_(ids),
+                DuplicateCandidate.individual2_id.in_(ids),
+            )
+        )
+    stale.delete(synchronize_session=False)
+
+    reviewed = {
+        (r[0], r[1])
+        for r in db.query(
+            DuplicateCandidate.individual1_id, DuplicateCandidate.individual2_id
+        ).all()
+    }
+    rows = [
+        {
+            "individual1_id": id1,
+            "individual2_id": id2,
+            "score": score,
+            "details": details,
+            "status": "pending",
+        }
+        for id1, id2, score, details in results
+        if (id1, id2) not in reviewed
+    ]
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.execute(
+            DuplicateCandidate.__table__.insert(), rows[start:start + INSERT_BATCH_SIZE]
+        )
+
+    scan.status = "completed"
+    scan.people_scanned = (
+        len(changed_ids) if changed_ids is not None else len(features)
+    )
+    scan.pairs_compared = compared
+    scan.candidates_found = len(rows)
+    scan.finished_at = datetime.now(timezone.utc)
+    db.commit()
+
+    return {
+        "people_scanned": scan.people_scanned,
+        "pairs_compared": compared,
+        "candidates_found": len(rows),
+    }
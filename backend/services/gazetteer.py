@@ -0,0 +1,285 @@
+"""Offline geocoding from a local GeoNames-style gazetteer.
+
+The gazetteer is a tab-separated dump in the GeoNames format (for example
+allCountries.txt or cities500.txt from download.geonames.org). It is
+converted once into a compact binary index that is memory-mapped and
+searched in place, so lookups need no network and little memory:
+
+- name section: sorted 64-bit hashes of normalised names, and the record
+  each hash belongs to, searched by bisection
+- record section: latitude, longitude, population and region per record
+- region section: the normalised country, state and county names of each
+  distinct admin hierarchy, used to score a match against the rest of a
+  place name
+
+A place such as "Boston, Suffolk, Massachusetts, USA" is looked up by its
+first part; candidates score one point for each later part found in their
+region, and population breaks ties. If the first part is unknown the next
+one is tried, so "Old Church, Boston, Massachusetts" still resolves to
+Boston. Admin names are read from ADM1/ADM2/PCL rows of the dump, and from
+admin1CodesASCII.txt, admin2Codes.txt and countryInfo.txt if they are
+present next to it.
+
+Build an index with:
+
+    python -m services.gazetteer allCountries.txt [allCountries.txt.idx]
+"""
+
+import csv
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from hashlib import blake2b
+
+from services.place_names import normalize_place_name, strip_level_words
+from services.places import split_place
+
+MAGIC = b"YGGGAZ02"
+HEADER = struct.Struct("<8sQQQQ")
+
+# GeoNames feature classes kept: administrative areas and populated places
+FEATURE_CLASSES = {"A", "P"}
+
+# Columns of a GeoNames dump row
+NAME, ASCII_NAME, ALTERNATE_NAMES = 1, 2, 3
+LATITUDE, LONGITUDE, FEATURE_CLASS, FEATURE_CODE = 4, 5, 6, 7
+COUNTRY, ADMIN1, ADMIN2, POPULATION = 8, 10, 11, 14
+
+
+def name_hash(key: str) -> int:
+    return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+def _read_tsv(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if row and not row[0].startswith("#"):
+                yield row
+
+
+def _admin_names(tsv_path: str) -> dict:
+    """Admin names by code tuple from the GeoNames side files, if present."""
+    names = {}
+    folder = os.path.dirname(os.path.abspath(tsv_path))
+    side_files = [
+        ("countryInfo.txt", lambda r: ((r[0],), r[4])),
+        ("admin1CodesASCII.txt", lambda r: (tuple(r[0].split(".")), r[1])),
+        ("admin2Codes.txt", lambda r: (tuple(r[0].split(".")), r[1])),
+    ]
+    for filename, parse in side_files:
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            for row in _read_tsv(path):
+                code, name = parse(row)
+                names[code] = name
+    return names
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 8)
+
+
+def build_index(tsv_path: str, index_path: str) -> dict:
+    """Convert a GeoNames dump into a binary index file.
+
+    Returns counts of records, names and regions written.
+    """
+    hashes = array("Q")
+    name_records = array("I")
+    lats = array("f")
+    lngs = array("f")
+    populations = array("I")
+    record_regions = []
+    admin_names = _admin_names(tsv_path)
+
+    for row in _read_tsv(tsv_path):
+        if len(row) <= POPULATION or row[FEATURE_CLASS] not in FEATURE_CLASSES:
+            continue
+        country, admin1, admin2 = row[COUNTRY], row[ADMIN1], row[ADMIN2]
+        code = row[FEATURE_CODE]
+        if code.startswith("PCL"):
+            admin_names.setdefault((country,), row[NAME])
+        elif code == "ADM1":
+            admin_names.setdefault((country, admin1), row[NAME])
+        elif code == "ADM2":
+            admin_names.setdefault((country, admin1, admin2), row[NAME])
+
+        record = len(lats)
+        keys = {normalize_place_name(row[NAME]), normalize_place_name(row[ASCII_NAME])}
+        # Alternate names are mostly translations; keep the Latin-script ones
+        for name in row[ALTERNATE_NAMES].split(","):
+            key = normalize_place_name(name)
+            if key.isascii():
+                keys.add(key)
+        for key in keys:
+            if key:
+                hashes.append(name_hash(key))
+                name_records.append(record)
+        lats.append(float(row[LATITUDE]))
+        lngs.append(float(row[LONGITUDE]))
+        populations.append(min(int(row[POPULATION] or 0), 2**32 - 1))
+        record_regions.append((country, admin1, admin2))
+
+    # Each distinct hierarchy is stored once as its "|"-joined name keys
+    region_ids = {}
+    regions = array("I")
+    for country, admin1, admin2 in record_regions:
+        codes = (country, admin1, admin2)
+        if codes not in region_ids:
+            region_ids[codes] = len(region_ids)
+        regions.append(region_ids[codes])
+    region_offsets = array("I", [0])
+    blob = bytearray()
+    for country, admin1, admin2 in region_ids:
+        names = [
+            admin_names.get(code)
+            for code in ((country,), (country, admin1), (country, admin1, admin2))
+        ]
+        # Admin names are matched with or without level words ("Suffolk
+        # County" and "Suffolk")
+        keys = [normalize_place_name(n) for n in names if n]
+        keys += [strip_level_words(k) for k in keys]
+        blob += "|".join(dict.fromkeys(keys)).encode()
+        region_offsets.append(len(blob))
+
+    order = sorted(range(len(hashes)), key=hashes.__getitem__)
+    sorted_hashes = array("Q", (hashes[i] for i in order))
+    sorted_records = array("I", (name_records[i] for i in order))
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(MAGIC, len(sorted_hashes), len(lats), len(region_ids), len(blob))
+        )
+        for section in (
+            sorted_hashes, sorted_records, lats, lngs, populations, regions,
+            region_offsets,
+        ):
+            f.write(_pad(section.tobytes()))
+        f.write(bytes(blob))
+    os.replace(tmp_path, index_path)
+    return {"records": len(lats), "names": len(sorted_hashes), "regions": len(region_ids)}
+
+
+class GazetteerIndex:
+    """Read-only view of a memory-mapped gazetteer index."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, names, records, regions, blob_size = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a gazetteer index")
+        self.size = records
+
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+
+        def section(fmt, count):
+            nonlocal offset
+            size = struct.calcsize(fmt) * count
+            part = view[offset:offset + size].cast(fmt)
+            offset += size + (-size % 8)
+            return part
+
+        self._hashes = section("Q", names)
+        self._name_records = section("I", names)
+        self._lats = section("f", records)
+        self._lngs = section("f", records)
+        self._populations = section("I", records)
+        self._regions = section("I", records)
+        self._region_offsets = section("I", regions + 1)
+        self._blob = view[offset:offset + blob_size]
+        self._region_keys = lru_cache(maxsize=65536)(self._read_region)
+
+    def _read_region(self, region: int) -> frozenset:
+        start, end = self._region_offsets[region], self._region_offsets[region + 1]
+        return frozenset(bytes(self._blob[start:end]).decode().split("|"))
+
+    def _records(self, key: str):
+        h = name_hash(key)
+        i = bisect_left(self._hashes, h)
+        while i < len(self._hashes) and self._hashes[i] == h:
+            yield self._name_records[i]
+            i += 1
+
+    def lookup(self, place_name: str):
+        """Return {"lat", "lng"} for the best match of a place name, or None.
+
+        When the name has several parts, at least one of the later parts
+        must match the candidate's country, state or county.
+        """
+        keys = [normalize_place_name(part) for part in split_place(place_name)]
+        for start, key in enumerate(keys):
+            context = [k for k in keys[start + 1:] if k]
+            if not key:
+                continue
+            best = None
+            for record in set(self._records(key)):
+                region = self._region_keys(self._regions[record])
+                matched = sum(
+                    1 for k in context if k in region or strip_level_words(k) in region
+                )
+                if context and not matched:
+                    continue
+                score = matched + math.log10(self._populations[record] + 1) / 10
+                if best is None or score > best[0]:
+                    best = (score, record)
+            if best:
+                record = best[1]
+                return {
+                    "lat": round(self._lats[record], 5),
+                    "lng": round(self._lngs[record], 5),
+                }
+        return None
+
+
+_index_cache = {}
+
+
+def _current_format(index_path: str) -> bool:
+    """Whether an index was written with the current format and name keys."""
+    with open(index_path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def get_gazetteer():
+    """Open the index configured by GAZETTEER_PATH, building it if stale.
+
+    GAZETTEER_PATH points at a GeoNames dump; the index is kept next to it
+    (or at GAZETTEER_INDEX). Returns None if no gazetteer is configured.
+    """
+    tsv_path = os.getenv("GAZETTEER_PATH", "")
+    index_path = os.getenv("GAZETTEER_INDEX", "") or (
+        f"{tsv_path}.idx" if tsv_path else ""
+    )
+    if not index_path:
+        return None
+
+    if tsv_path and os.path.exists(tsv_path) and (
+        not os.path.exists(index_path)
+        or os.path.getmtime(index_path) < os.path.getmtime(tsv_path)
+        or not _current_format(index_path)
+    ):
+        print(f"Building gazetteer index {index_path} from {tsv_path}")
+        build_index(tsv_path, index_path)
+        _index_cache.pop(index_path, None)
+    if not os.path.exists(index_path):
+        return None
+
+    if index_path not in _index_cache:
+        _index_cache[index_path] = GazetteerIndex(index_path)
+    return _index_cache[index_path]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        sys.exit("Usage: python -m services.gazetteer <geonames.txt> [index path]")
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) == 3 else f"{source}.idx"
+    print(build_index(source, target))
@@ -1,112 +1,524 @@
-"""Geocoding service for converting place names to coordinates."""
-
+"""Geocoding service for converting place names to coordinates.
+
+Geocoding runs as a persistent background job (a GeocodeJob row). Places are
+first looked up in the local gazetteer (see services/gazetteer.py); the
+misses are then sent to the remote providers listed in GEOCODE_PROVIDERS,
+concurrently, each throttled by its own token bucket and sharing one
+pooled async HTTP client. Results are saved and the job checkpointed after
+every chunk of places, so a job interrupted by a restart resumes where it
+stopped. A PostgreSQL advisory lock ensures only one process runs it.
+Places that only exist as ancestors of other places ("Massachusetts, USA")
+are never sent to the remote providers; unless the gazetteer knows them,
+they are placed at the centre of their geocoded sub-places.
+
+GEOCODER selects the backends: "auto" (default) uses the gazetteer and the
+remote providers, "offline" only the gazetteer and "remote" (formerly
+"nominatim", still accepted) only the remote providers. Any other value is
+an error rather than a silent fallback.
+"""
+
+import asyncio
+import os
 import time
+from datetime import datetime, timedelta, timezone
+
 import httpx
-from sqlalchemy.orm import Session
+from sqlalchemy import Float, and_, any_, exists, false, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, aliased
+
+from models import GeocodeCache, GeocodeJob, Place, Event
+from services.gazetteer import get_gazetteer
+from services.places import array_param, link_event_places
+from services.place_names import canonicalize_places, propagate_coordinates
+
+# Places looked up remotely between checkpoints
+CHUNK_SIZE = 50
+# Advisory lock key held by the process running a geocoding job
+JOB_LOCK_KEY = 0x79676763
+# Days before a cached "not found" is retried; found places are kept forever
+NEGATIVE_TTL_DAYS = int(os.getenv("GEOCODE_NEGATIVE_TTL_DAYS", "30"))
+
+# Former GEOCODER values that are still accepted
+GEOCODER_ALIASES = {"nominatim": "remote"}
+
+USER_AGENT = "YggdrasilGenealogy/1.0"
+
+
+def _parse_nominatim(data):
+    if data:
+        return {"lat": float(data[0]["lat"]), "lng": float(data[0]["lon"])}
+    return None
 
-from models import Place, Event
 
+def _parse_photon(data):
+    features = data.get("features") or []
+    if features:
+        lng, lat = features[0]["geometry"]["coordinates"][:2]
+        return {"lat": float(lat), "lng": float(lng)}
+    return None
 
-def geocode_place_nominatim(place_name: str) -> dict:
-    """Geocode a place name using OpenStreetMap Nominatim API.
 
-    Returns dict with lat/lng or None if not found.
+# Remote providers: (URL, query parameters, response parser)
+PROVIDERS = {
+    "nominatim": (
+        os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search"),
+        lambda q: {"format": "json", "q": q, "limit": 1},
+        _parse_nominatim,
+    ),
+    "photon": (
+        os.getenv("PHOTON_URL", "https://photon.komoot.io/api/"),
+        lambda q: {"q": q, "limit": 1},
+        _parse_photon,
+    ),
+}
+
+
+class TokenBucket:
+    """Async rate limiter allowing `rate` requests per second, `burst` at once."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def configured_providers() -> list[tuple[str, float]]:
+    """Remote providers and their request rates from GEOCODE_PROVIDERS.
+
+    The format is "name:rate,..." with rate in requests per second, e.g.
+    "nominatim:1,photon:2". The default is the public Nominatim at 1/s.
     """
-    try:
-        response = httpx.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={"format": "json", "q": place_name, "limit": 1},
-            headers={"User-Agent": "YggdrasilGenealogy/1.0"},
-            timeout=10.0,
+    providers = []
+    for item in os.getenv("GEOCODE_PROVIDERS", "nominatim:1").split(","):
+        name, _, rate = item.strip().partition(":")
+        if name in PROVIDERS:
+            providers.append((name, float(rate) if rate else 1.0))
+    return providers
+
+
+def _geocoder_mode() -> str:
+    mode = os.getenv("GEOCODER", "auto").strip().lower()
+    mode = GEOCODER_ALIASES.get(mode, mode)
+    if mode not in ("auto", "offline", "remote"):
+        raise ValueError(
+            f"Unknown GEOCODER {mode!r}, expected auto, offline or remote"
         )
-        response.raise_for_status()
-        data = response.json()
+    return mode
 
-        if data and len(data) > 0:
-            return {"lat": float(data[0]["lat"]), "lng": float(data[0]["lon"])}
-    except Exception as e:
-        print(f"Geocoding error for '{place_name}': {e}")
 
-    return None
+async def _geocode_remote(client, name: str, place_name: str):
+    """Look a place up with one provider.
+
+    Returns {"lat", "lng"}, None if the provider found nothing, or False if
+    the request failed (so the place is retried by a later job).
+    """
+    url, params, parse = PROVIDERS[name]
+    try:
+        response = await client.get(url, params=params(place_name))
+        response.raise_for_status()
+        return parse(response.json())
+    except Exception as e:
+        print(f"Geocoding error for '{place_name}' from {name}: {e}")
+        return False
 
 
-def sync_places_from_events(db: Session) -> int:
-    """Scan all events and create Place records for unique place names.
+async def _geocode_chunk(client, buckets, places) -> dict:
+    """Geocode (id, name, key, missed) rows across all providers.
 
-    Returns number of new places added.
+    A place is not sent to a provider listed in its `missed` (providers
+    with a cached "not found"). Returns place ID -> (provider, result).
     """
-    # Get all unique place names from events
-    events_with_places = (
-        db.query(Event.place).filter(Event.place.isnot(None)).distinct().all()
+    queue = list(places)
+    results = {}
+
+    async def worker(name, bucket):
+        while True:
+            # Workers share the list; no await between choosing and removing
+            index = next(
+                (i for i, place in enumerate(queue) if name not in (place.missed or ())),
+                None,
+            )
+            if index is None:
+                return
+            place = queue.pop(index)
+            await bucket.acquire()
+            results[place.id] = (
+                name,
+                await _geocode_remote(client, name, place.name),
+            )
+
+    await asyncio.gather(
+        *(
+            worker(name, bucket)
+            for name, bucket in buckets.items()
+            for _ in range(bucket.capacity)
+        )
     )
-    place_names = {e[0].strip() for e in events_with_places if e[0] and e[0].strip()}
+    return results
+
+
+def _save_results(db: Session, found: list, failed_ids: list) -> None:
+    """Store (id, lat, lng) matches and failures, and copy them to variants."""
+    if found:
+        matched = (
+            func.unnest(
+                array_param([place_id for place_id, _, _ in found]),
+                array_param([lat for _, lat, _ in found], Float),
+                array_param([lng for _, _, lng in found], Float),
+            )
+            .table_valued("place_id", "lat", "lng")
+            .render_derived()
+        )
+        db.execute(
+            update(Place)
+            .where(Place.id == matched.c.place_id)
+            .values(latitude=matched.c.lat, longitude=matched.c.lng, geocoded=1)
+            .execution_options(synchronize_session=False)
+        )
+    if failed_ids:
+        db.execute(
+            update(Place)
+            .where(Place.id.in_(failed_ids))
+            .values(geocoded=-1)
+            .execution_options(synchronize_session=False)
+        )
+    propagate_coordinates(db, [place_id for place_id, _, _ in found] + failed_ids)
 
-    # Get existing places
-    existing_places = db.query(Place.name).all()
-    existing_names = {p[0] for p in existing_places}
 
-    # Add new places
-    new_count = 0
-    for name in place_names:
-        if name not in existing_names:
-            place = Place(name=name, geocoded=0)
-            db.add(place)
-            new_count += 1
+def _cache_valid():
+    return GeocodeCache.expires_at.is_(None) | (GeocodeCache.expires_at > func.now())
 
-    db.commit()
-    return new_count
+
+def _miss_conditions():
+    return (
+        GeocodeCache.query == Place.normalized_name,
+        GeocodeCache.latitude.is_(None),
+        _cache_valid(),
+    )
 
 
-def geocode_all_places(db: Session, force: bool = False) -> dict:
-    """Geocode all places that haven't been geocoded yet.
+def _cached_miss():
+    """Whether every remote provider has an unexpired "not found" for a place."""
+    providers = [name for name, _ in configured_providers()]
+    if not providers:
+        return false()
+    return and_(
+        *(
+            exists().where(*_miss_conditions(), GeocodeCache.provider == name)
+            for name in providers
+        )
+    )
 
-    Args:
-        db: Database session
-        force: If True, re-geocode all places including previously failed ones
 
-    Returns dict with counts of success, failed, skipped.
+def _missed_providers():
+    """Providers with an unexpired "not found" cached for a place's name."""
+    return (
+        select(func.array_agg(GeocodeCache.provider))
+        .where(*_miss_conditions())
+        .scalar_subquery()
+        .label("missed")
+    )
+
+
+def _store_in_cache(db: Session, results: list) -> None:
+    """Save (key, provider, result) lookups; failed requests are not cached."""
+    expires_at = datetime.now(timezone.utc) + timedelta(days=NEGATIVE_TTL_DAYS)
+    rows = {}
+    for key, provider, coords in results:
+        if key and coords is not False:
+            rows[(key, provider)] = {
+                "query": key,
+                "provider": provider,
+                "latitude": coords["lat"] if coords else None,
+                "longitude": coords["lng"] if coords else None,
+                "expires_at": None if coords else expires_at,
+            }
+    if not rows:
+        return
+    stmt = insert(GeocodeCache).values(list(rows.values()))
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["query", "provider"],
+            set_={
+                "latitude": stmt.excluded.latitude,
+                "longitude": stmt.excluded.longitude,
+                "expires_at": stmt.excluded.expires_at,
+                "updated_at": func.now(),
+            },
+        )
+    )
+
+
+def apply_cached_results(db: Session) -> int:
+    """Geocode pending places from cached results, without any requests.
+
+    Places with a cached location are marked geocoded, and places with an
+    unexpired cached miss are marked failed. Does not commit. Returns the
+    number of places resolved.
     """
-    # First sync places from events
-    new_places = sync_places_from_events(db)
+    # A hit for any spelling in a cluster counts, since the canonical place
+    # of a cluster can change when its places are re-created
+    cluster_id = func.coalesce(Place.canonical_id, Place.id)
+    hits = (
+        select(
+            cluster_id.label("place_id"),
+            GeocodeCache.latitude,
+            GeocodeCache.longitude,
+        )
+        .join(GeocodeCache, GeocodeCache.query == Place.normalized_name)
+        .where(GeocodeCache.latitude.isnot(None))
+        .distinct(cluster_id)
+        .order_by(cluster_id, Place.canonical_id.isnot(None), GeocodeCache.provider)
+        .subquery()
+    )
+    pending = (Place.geocoded == 0) & Place.canonical_id.is_(None)
+    found = db.execute(
+        update(Place)
+        .where(pending, Place.id == hits.c.place_id)
+        .values(latitude=hits.c.latitude, longitude=hits.c.longitude, geocoded=1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    missed = db.execute(
+        update(Place)
+        .where(pending, _cached_miss())
+        .values(geocoded=-1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if found or missed:
+        propagate_coordinates(db)
+    return found + missed
+
+
+def _has_events():
+    """Whether the place or one of its variants has events of its own."""
+    member = aliased(Place)
+    return exists().where(
+        func.coalesce(member.canonical_id, member.id) == Place.id,
+        member.event_count > 0,
+    )
+
 
-    # Get places to geocode
+def _unresolved_places(force: bool):
+    """Canonical places a job still has to find coordinates for."""
+    query = select(
+        Place.id, Place.name, Place.normalized_name, _missed_providers()
+    ).where(Place.canonical_id.is_(None), ~_cached_miss())
     if force:
-        places = db.query(Place).all()
-    else:
-        # Only geocode places that haven't been attempted
-        places = db.query(Place).filter(Place.geocoded == 0).all()
-
-    results = {
-        "total": len(places),
-        "success": 0,
-        "failed": 0,
-        "skipped": 0,
-        "new_places": new_places,
-    }
+        return query.where(Place.geocoded != 1)
+    return query.where(Place.geocoded == 0)
 
-    for place in places:
-        # Skip if already geocoded successfully and not forcing
-        if place.geocoded == 1 and not force:
-            results["skipped"] += 1
-            continue
 
-        coords = geocode_place_nominatim(place.name)
+def _pending_places(force: bool):
+    """Canonical places a job still has to look up remotely.
 
-        if coords:
-            place.latitude = coords["lat"]
-            place.longitude = coords["lng"]
-            place.geocoded = 1
-            results["success"] += 1
-        else:
-            place.geocoded = -1  # Mark as failed
-            results["failed"] += 1
+    Places that only exist as ancestors of other places are left to
+    resolve_ancestor_places instead.
+    """
+    return _unresolved_places(force).where(_has_events())
 
-        db.commit()
 
-        # Rate limit: Nominatim requests max 1 per second
-        time.sleep(1.1)
+def resolve_ancestor_places(db: Session, force: bool = False) -> int:
+    """Place ancestors without events of their own at their sub-places.
+
+    Each pending canonical place with no events in its cluster gets the
+    mean coordinates of its geocoded sub-places, weighted by their events;
+    those with none geocoded yet are marked failed until the next job.
+    Does not commit. Returns the number of places resolved.
+    """
+    pending = Place.canonical_id.is_(None) & ~_has_events()
+    if not force:
+        pending &= Place.geocoded != 1
+    sub = aliased(Place)
+    weight = func.sum(sub.event_count)
+    centres = (
+        select(
+            Place.id.label("place_id"),
+            (func.sum(sub.latitude * sub.event_count) / weight).label("lat"),
+            (func.sum(sub.longitude * sub.event_count) / weight).label("lng"),
+        )
+        .join(sub, Place.id == any_(sub.ancestor_ids))
+        .where(pending, sub.geocoded == 1, sub.event_count > 0)
+        .group_by(Place.id)
+        .subquery()
+    )
+    found = db.execute(
+        update(Place)
+        .where(Place.id == centres.c.place_id)
+        .values(latitude=centres.c.lat, longitude=centres.c.lng, geocoded=1)
+        .returning(Place.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    failed = db.execute(
+        update(Place)
+        .where(pending, Place.geocoded == 0)
+        .values(geocoded=-1)
+        .returning(Place.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    propagate_coordinates(db, found + failed)
+    return len(found)
+
+
+def _sync_places(db: Session) -> dict:
+    """Link events to places, group spelling variants and apply cached results."""
+    new_places = link_event_places(db)
+    variants = canonicalize_places(db)["variants"]
+    cached = apply_cached_results(db)
+    db.commit()
+    return {"new_places": new_places, "variants": variants, "cached": cached}
+
+
+def _geocode_offline(db: Session, job: GeocodeJob) -> None:
+    """Sync places and apply cached results, then geocode from the gazetteer."""
+    synced = _sync_places(db)
+    job.new_places = synced["new_places"]
+    job.variants = synced["variants"]
+    job.cached = synced["cached"]
+    force = job.mode == "force"
+
+    gazetteer = get_gazetteer() if _geocoder_mode() != "remote" else None
+    # A forced run refreshes every canonical place the gazetteer knows
+    candidates = (
+        select(Place.id, Place.name).where(Place.canonical_id.is_(None))
+        if force and gazetteer
+        else _unresolved_places(force)
+    )
+    places = db.execute(candidates).all()
+    found = []
+    if gazetteer:
+        for place_id, name, *_ in places:
+            coords = gazetteer.lookup(name)
+            if coords:
+                found.append((place_id, coords["lat"], coords["lng"]))
+    _save_results(db, found, [])
+
+    job.gazetteer = len(found)
+    job.success = len(found)
+    job.total = len(found)
+    if _geocoder_mode() != "offline":
+        job.total += db.execute(
+            select(func.count()).select_from(_pending_places(force).subquery())
+        ).scalar()
+    job.processed = len(found)
+    job.last_place_id = 0
+    db.commit()
 
-    return results
+
+async def _geocode_pending(db: Session, job: GeocodeJob) -> None:
+    """Look up the remaining places remotely, checkpointing every chunk."""
+    buckets = {
+        name: TokenBucket(rate, burst=max(1, int(rate)))
+        for name, rate in configured_providers()
+    }
+    if not buckets:
+        return
+    force = job.mode == "force"
+
+    async with httpx.AsyncClient(
+        headers={"User-Agent": USER_AGENT}, timeout=10.0
+    ) as client:
+        while True:
+            places = db.execute(
+                _pending_places(force)
+                .where(Place.id > job.last_place_id)
+                .order_by(Place.id)
+                .limit(CHUNK_SIZE)
+            ).all()
+            if not places:
+                return
+
+            results = await _geocode_chunk(client, buckets, places)
+            found = [
+                (place_id, coords["lat"], coords["lng"])
+                for place_id, (_, coords) in results.items()
+                if coords
+            ]
+            failed_ids = [
+                place_id
+                for place_id, (_, coords) in results.items()
+                if coords is None
+            ]
+            _save_results(db, found, failed_ids)
+            _store_in_cache(
+                db,
+                [
+                    (place.normalized_name, *results[place.id])
+                    for place in places
+                    if place.id in results
+                ],
+            )
+
+            job.last_place_id = places[-1].id
+            job.processed += len(places)
+            job.remote += len(places)
+            job.success += len(found)
+            job.failed += len(failed_ids)
+            db.commit()
+
+
+def run_geocode_job(db: Session, job_id: int) -> bool:
+    """Run or resume a geocoding job until it completes.
+
+    Returns False without doing anything if another process holds the job
+    lock. Progress is committed after every step, so an interrupted job can
+    be resumed by calling this again.
+    """
+    with db.get_bind().connect() as lock_conn:
+        if not lock_conn.execute(
+            select(func.pg_try_advisory_lock(JOB_LOCK_KEY))
+        ).scalar():
+            return False
+        # The lock outlives the transaction; don't keep a snapshot open for hours
+        lock_conn.commit()
+        try:
+            job = db.get(GeocodeJob, job_id)
+            if job is None or job.status != "running":
+                return True
+            if job.last_place_id is None:
+                _geocode_offline(db, job)
+            if _geocoder_mode() != "offline":
+                asyncio.run(_geocode_pending(db, job))
+            resolve_ancestor_places(db, force=job.mode == "force")
+            job.status = "completed"
+            job.finished_at = func.now()
+            db.commit()
+            return True
+        finally:
+            lock_conn.execute(select(func.pg_advisory_unlock(JOB_LOCK_KEY)))
+            lock_conn.commit()
+
+
+def geocoding_job_locked(db: Session) -> bool:
+    """Whether some process is currently running a geocoding job."""
+    acquired = db.execute(select(func.pg_try_advisory_lock(JOB_LOCK_KEY))).scalar()
+    if acquired:
+        db.execute(select(func.pg_advisory_unlock(JOB_LOCK_KEY)))
+    return not acquired
+
+
+def sync_places_from_events(db: Session) -> int:
+    """Link every event to a Place record, creating places for new names.
+
+    New places are geocoded from the geocode cache where possible. Returns
+    number of new places added (including parent places).
+    """
+    return _sync_places(db)["new_places"]
 
 
 def get_place_coordinates(db: Session, place_name: str) -> dict:
@@ -128,19 +540,24 @@ def get_geocoding_stats(db: Session) -> dict:
     success = db.query(Place).filter(Place.geocoded == 1).count()
     failed = db.query(Place).filter(Place.geocoded == -1).count()
     pending = db.query(Place).filter(Place.geocoded == 0).count()
-
-    # Count unique places in events that aren't in Place table yet
-    events_with_places = (
-        db.query(Event.place).filter(Event.place.isnot(None)).distinct().all()
+    variants = db.query(Place).filter(Place.canonical_id.isnot(None)).count()
+    cached = db.query(GeocodeCache).count()
+
+    # Count unique place names on events not yet linked to a Place
+    place_name = func.trim(Event.place)
+    unsynced = (
+        db.query(func.count(func.distinct(place_name)))
+        .filter(Event.place_id.is_(None), place_name != "")
+        .scalar()
     )
-    event_places = {e[0].strip() for e in events_with_places if e[0] and e[0].strip()}
-    existing_places = {p[0] for p in db.query(Place.name).all()}
-    unsynced = len(event_places - existing_places)
 
     return {
         "total": total,
         "success": success,
         "failed": failed,
         "pending": pending,
+        "variants": variants,
+        "cached": cached,
         "unsynced": unsynced,
+        "geocoder": _geocoder_mode(),
     }
@@ -0,0 +1,185 @@
+"""Event density heatmap on a Web Mercator grid.
+
+Geocoded events are loaded once per data version (see services/map_tiles.py)
+as NumPy arrays of weighted points: one point per place, year and count of
+events. From them a grid is precomputed for every decade at GRID_BITS
+resolution (1024 x 1024 cells over the world). A heatmap request for a
+zoom level and year window adds up the grids of the decades fully inside the
+window, coarsened to CELL_SIZE pixel cells of that zoom, and bins the points
+of the remaining years directly. Zoom levels finer than the precomputed
+grids bin the points of the whole window.
+"""
+
+import math
+import threading
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import Session
+
+from models import Event, Place
+from services.map_tiles import MAX_LATITUDE, data_version, event_filters, tiles_for_bbox
+
+# Heatmap cell size in pixels at the requested zoom
+CELL_SIZE = 16
+CELL_BITS = 4  # log2(256 / CELL_SIZE)
+# Resolution of the precomputed decade grids: 2**GRID_BITS cells per axis
+GRID_BITS = 10
+# Year stored for undated events
+UNDATED = -1
+
+_state = {"version": None, "points": None, "grids": {}}
+_lock = threading.Lock()
+
+
+def _mercator(lat, lng):
+    """Fractional world position (0..1) of coordinate arrays."""
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (lng + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(lat)) / math.pi) / 2.0
+    return np.clip(x, 0.0, 1.0 - 1e-12), np.clip(y, 0.0, 1.0 - 1e-12)
+
+
+def _load_points(db: Session) -> dict:
+    """Event counts per place and year as arrays."""
+    year = func.coalesce(
+        cast(func.extract("year", Event.event_date), Integer), UNDATED
+    ).label("year")
+    rows = db.execute(
+        select(Place.latitude, Place.longitude, year, func.count().label("n"))
+        .select_from(Event)
+        .join(Place, Place.id == Event.place_id)
+        .where(*event_filters(None, None, None))
+        .group_by(Place.latitude, Place.longitude, year)
+    ).all()
+    lat = np.fromiter((r.latitude for r in rows), dtype=np.float64, count=len(rows))
+    lng = np.fromiter((r.longitude for r in rows), dtype=np.float64, count=len(rows))
+    x, y = _mercator(lat, lng)
+    return {
+        "x": x,
+        "y": y,
+        "year": np.fromiter((r.year for r in rows), dtype=np.int32, count=len(rows)),
+        "weight": np.fromiter((r.n for r in rows), dtype=np.int64, count=len(rows)),
+    }
+
+
+def _bin(x, y, weight, bits: int):
+    """Sum weights per cell of a 2**bits grid: (cell x, cell y, weight) arrays."""
+    n = 1 << bits
+    keys = (x * n).astype(np.int64) * n + (y * n).astype(np.int64)
+    return _sum_cells(keys, weight, bits)
+
+
+def _sum_cells(keys, weight, bits: int):
+    cells, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=weight, minlength=len(cells)).astype(np.int64)
+    return cells >> bits, cells & ((1 << bits) - 1), sums
+
+
+def _build(points) -> dict:
+    """Grid of each decade (and of undated events) at GRID_BITS resolution."""
+    decades = np.where(points["year"] == UNDATED, UNDATED, points["year"] // 10 * 10)
+    grids = {}
+    for decade in np.unique(decades):
+        mask = decades == decade
+        grids[int(decade)] = _bin(
+            points["x"][mask], points["y"][mask], points["weight"][mask], GRID_BITS
+        )
+    return grids
+
+
+def refresh(db: Session) -> dict:
+    """Reload the points and decade grids if events or places have changed."""
+    version = data_version(db)
+    with _lock:
+        if _state["version"] != version:
+            points = _load_points(db)
+            _state.update(version=version, points=points, grids=_build(points))
+        return dict(_state)
+
+
+def _cell_ranges(west, south, east, north, bits: int):
+    n = 1 << bits
+    x0, y0 = _mercator(np.array([north]), np.array([west]))
+    x1, y1 = _mercator(np.array([south]), np.array([east]))
+    x0, x1 = int(x0[0] * n), int(x1[0] * n)
+    y_range = (int(y0[0] * n), int(y1[0] * n))
+    x_ranges = [(x0, x1)] if west <= east else [(x0, n - 1), (0, x1)]
+    return x_ranges, y_range
+
+
+def heatmap(
+    db: Session,
+    west: float,
+    south: float,
+    east: float,
+    north: float,
+    zoom: int,
+    year_from=None,
+    year_to=None,
+) -> dict:
+    """Weighted grid cells inside a bounding box for a zoom and year window.
+
+    Raises ValueError if the box covers more than MAX_TILES tiles.
+    """
+    tiles_for_bbox(west, south, east, north, zoom)
+    state = refresh(db)
+    points, grids = state["points"], state["grids"]
+    bits = zoom + CELL_BITS
+
+    dated = year_from is not None or year_to is not None
+    low = year_from if year_from is not None else -(10 ** 6)
+    high = year_to if year_to is not None else 10 ** 6
+
+    # Decades fully inside the window come from the precomputed grids
+    whole = []
+    if bits <= GRID_BITS:
+        whole = [
+            decade for decade in grids
+            if (decade == UNDATED and not dated)
+            or (decade != UNDATED and low <= decade and decade + 9 <= high)
+        ]
+    parts_x, parts_y, parts_w = [], [], []
+    shift = GRID_BITS - bits
+    for decade in whole:
+        cx, cy, w = grids[decade]
+        parts_x.append(cx >> shift)
+        parts_y.append(cy >> shift)
+        parts_w.append(w)
+
+    # Remaining years are binned from the points
+    years = points["year"]
+    decades = np.where(years == UNDATED, UNDATED, years // 10 * 10)
+    mask = ~np.isin(decades, whole)
+    if dated:
+        mask &= (years != UNDATED) & (years >= low) & (years <= high)
+    if mask.any():
+        cx, cy, w = _bin(points["x"][mask], points["y"][mask], points["weight"][mask], bits)
+        parts_x.append(cx)
+        parts_y.append(cy)
+        parts_w.append(w)
+
+    cells = []
+    if parts_x:
+        cx = np.concatenate(parts_x)
+        cy = np.concatenate(parts_y)
+        w = np.concatenate(parts_w)
+        x_ranges, (y0, y1) = _cell_ranges(west, south, east, north, bits)
+        inside = (cy >= y0) & (cy <= y1)
+        inside &= np.logical_or.reduce([(cx >= a) & (cx <= b) for a, b in x_ranges])
+        if inside.any():
+            cx, cy, w = _sum_cells((cx[inside] << bits) | cy[inside], w[inside], bits)
+            n = 1 << bits
+            lng = (cx + 0.5) / n * 360.0 - 180.0
+            lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * (cy + 0.5) / n))))
+            cells = [
+                {"lat": round(float(a), 5), "lng": round(float(b), 5), "weight": int(c)}
+                for a, b, c in zip(lat, lng, w)
+            ]
+
+    return {
+        "zoom": zoom,
+        "cell_size": CELL_SIZE,
+        "max_weight": max((c["weight"] for c in cells), default=0),
+        "cells": cells,
+    }
@@ -0,0 +1,424 @@
+"""Server-side clustering of map events by Web Mercator tile.
+
+The map asks for a bounding box at a zoom level. The box is split into the
+standard 256px slippy-map tiles of that zoom, and each tile is answered on
+its own so it can be cached: a pan only computes the tiles that came into
+view.
+
+Below DETAIL_ZOOM a tile holds clusters: events are grouped in SQL into
+CELL_SIZE pixel grid cells, each with its event count, mean position and
+count per event type. From DETAIL_ZOOM up a tile holds the individual
+events, and names are looked up only for the events returned.
+
+Cached tiles are keyed by the data version, a counter that database
+triggers bump once per committed transaction touching events, places or
+person-event links (see DataVersion in models.py). Event edits and deletes,
+place relinking (which adjusts place counts) and geocoding all bump it, so a
+change invalidates every tile at once without any bookkeeping. The
+timeline's year histogram is cached the same way.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from sqlalchemy import Integer, String, any_, case, cast, func, select, true
+from sqlalchemy.orm import Session, aliased
+
+from models import (
+    DataVersion,
+    Event,
+    Family,
+    Individual,
+    Place,
+    family_event,
+    individual_event,
+)
+from services.places import array_param
+
+TILE_SIZE = 256
+# Grid cell size in pixels, so each tile has up to 4 x 4 clusters
+CELL_SIZE = 64
+# Zoom level from which individual events are returned instead of clusters
+DETAIL_ZOOM = 12
+MAX_ZOOM = 20
+# Largest number of tiles one request may cover
+MAX_TILES = 256
+# Events kept per tile at detail zoom
+MAX_TILE_EVENTS = 500
+CACHE_SIZE = 4096
+
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.05112878
+
+PERSON_EVENT_TYPES = ("BIRT", "DEAT", "BURI")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def tile_x(lng: float, zoom: int) -> int:
+    n = 2 ** zoom
+    return min(n - 1, max(0, int((lng + 180.0) / 360.0 * n)))
+
+
+def tile_y(lat: float, zoom: int) -> int:
+    n = 2 ** zoom
+    lat = math.radians(min(MAX_LATITUDE, max(-MAX_LATITUDE, lat)))
+    y = (1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n
+    return min(n - 1, max(0, int(y)))
+
+
+def _tile_lng(x: int, zoom: int) -> float:
+    return x / 2 ** zoom * 360.0 - 180.0
+
+
+def _tile_lat(y: int, zoom: int) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2 ** zoom))))
+
+
+def tiles_for_bbox(west: float, south: float, east: float, north: float, zoom: int):
+    """List the (x, y) tiles covering a bounding box.
+
+    A box with west > east crosses the antimeridian. Raises ValueError if
+    the box covers more than MAX_TILES tiles.
+    """
+    x0, x1 = tile_x(west, zoom), tile_x(east, zoom)
+    if west <= east:
+        xs = list(range(x0, x1 + 1))
+    else:
+        xs = list(range(x0, 2 ** zoom)) + list(range(0, x1 + 1))
+    ys = range(tile_y(north, zoom), tile_y(south, zoom) + 1)
+    if len(xs) * len(ys) > MAX_TILES:
+        raise ValueError("Bounding box covers too many tiles for this zoom level")
+    return [(x, y) for x in xs for y in ys]
+
+
+def data_version(db: Session) -> int:
+    """Current version of the events, places and person-event links."""
+    return db.execute(select(DataVersion.version)).scalar()
+
+
+def event_filters(year_from, year_to, event_types):
+    conditions = [
+        Place.geocoded == 1,
+        Place.latitude.isnot(None),
+        Place.longitude.isnot(None),
+    ]
+    if year_from is not None:
+        conditions.append(Event.event_date >= date(year_from, 1, 1))
+    if year_to is not None:
+        conditions.append(Event.event_date < date(year_to + 1, 1, 1))
+    if event_types:
+        conditions.append(Event.event_type == any_(array_param(event_types, String)))
+    return conditions
+
+
+def tiles_bounds(tiles, zoom: int):
+    """Latitude/longitude conditions covering a set of tiles.
+
+    Uses the coordinate index on Place. Longitude is only bounded when the
+    tiles form one contiguous column range.
+    """
+    xs = sorted({x for x, _ in tiles})
+    ys = [y for _, y in tiles]
+    # Pad slightly so points on a tile edge are not lost to rounding
+    pad = 1e-9
+    conditions = [
+        Place.latitude.between(
+            _tile_lat(max(ys) + 1, zoom) - pad, _tile_lat(min(ys), zoom) + pad
+        )
+    ]
+    if xs[-1] - xs[0] + 1 == len(xs):
+        conditions.append(
+            Place.longitude.between(
+                _tile_lng(xs[0], zoom) - pad, _tile_lng(xs[-1] + 1, zoom) + pad
+            )
+        )
+    return conditions
+
+
+def _pixel_columns(zoom: int):
+    """World pixel x and y of a place's coordinates at a zoom level."""
+    scale = TILE_SIZE * 2 ** zoom
+    lat = func.radians(func.least(func.greatest(Place.latitude, -MAX_LATITUDE), MAX_LATITUDE))
+    px = (Place.longitude + 180.0) / 360.0 * scale
+    py = (1.0 - func.ln(func.tan(lat) + 1.0 / func.cos(lat)) / math.pi) / 2.0 * scale
+    return px, py
+
+
+def cluster_tiles(
+    db: Session, tiles, zoom: int, conditions, cell_size: int = CELL_SIZE
+) -> dict:
+    """Compute the clusters of each tile with one grouped query."""
+    px, py = _pixel_columns(zoom)
+    cell_x = cast(func.floor(px / cell_size), Integer).label("cell_x")
+    cell_y = cast(func.floor(py / cell_size), Integer).label("cell_y")
+    rows = db.execute(
+        select(
+            cell_x,
+            cell_y,
+            Event.event_type,
+            func.count().label("n"),
+            func.sum(Place.latitude).label("lat_sum"),
+            func.sum(Place.longitude).label("lng_sum"),
+        )
+        .select_from(Event)
+        .join(Place, Place.id == Event.place_id)
+        .where(*conditions, *tiles_bounds(tiles, zoom))
+        .group_by(cell_x, cell_y, Event.event_type)
+    ).all()
+
+    cells = {}
+    for row in rows:
+        cell = cells.setdefault(
+            (row.cell_x, row.cell_y), {"count": 0, "lat": 0.0, "lng": 0.0, "types": {}}
+        )
+        cell["count"] += row.n
+        cell["lat"] += row.lat_sum
+        cell["lng"] += row.lng_sum
+        event_type = row.event_type or "OTHER"
+        cell["types"][event_type] = cell["types"].get(event_type, 0) + row.n
+
+    results = {tile: [] for tile in tiles}
+    cells_per_tile = TILE_SIZE // cell_size
+    for (cx, cy), cell in sorted(cells.items()):
+        tile = (cx // cells_per_tile, cy // cells_per_tile)
+        if tile in results:
+            results[tile].append(
+                {
+                    "lat": round(cell["lat"] / cell["count"], 5),
+                    "lng": round(cell["lng"] / cell["count"], 5),
+                    "count": cell["count"],
+                    "types": cell["types"],
+                }
+            )
+    return results
+
+
+def _event_tiles(db: Session, tiles, zoom: int, conditions) -> dict:
+    """Compute the events of each tile, capped at MAX_TILE_EVENTS per tile."""
+    rows = db.execute(
+        select(
+            Event.id,
+            Event.event_type,
+            Event.event_date,
+            Event.place,
+            Place.latitude,
+            Place.longitude,
+        )
+        .select_from(Event)
+        .join(Place, Place.id == Event.place_id)
+        .where(*conditions, *tiles_bounds(tiles, zoom))
+        .order_by(Event.id)
+    ).all()
+
+    results = {tile: [] for tile in tiles}
+    for row in rows:
+        events = results.get((tile_x(row.longitude, zoom), tile_y(row.latitude, zoom)))
+        if events is not None and len(events) <= MAX_TILE_EVENTS:
+            events.append(
+                {
+                    "id": row.id,
+                    "event_type": row.event_type,
+                    "date": row.event_date.isoformat() if row.event_date else None,
+                    "year": row.event_date.year if row.event_date else None,
+                    "place": row.place,
+                    "lat": row.latitude,
+                    "lng": row.longitude,
+                }
+            )
+    return results
+
+
+def cache_get(key):
+    """A value from the shared map result cache, or None.
+
+    Keys should include the data version, so changed data is never served.
+    """
+    with _cache_lock:
+        value = _cache.get(key)
+        if value is not None:
+            _cache.move_to_end(key)
+        return value
+
+
+def cache_put(key, value) -> None:
+    """Store a value in the shared map result cache, evicting the oldest."""
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _full_name(person):
+    return func.concat_ws(" ", person.first_name, person.last_name)
+
+
+def event_name_columns():
+    """Lateral subqueries with the first person and family of an event.
+
+    Join them to a query on Event with `outerjoin(..., true())`; together
+    they provide person_id, person_name, family_id, spouse1_name and
+    spouse2_name without loading any relationships.
+    """
+    person = (
+        select(
+            Individual.id.label("person_id"),
+            _full_name(Individual).label("person_name"),
+        )
+        .select_from(individual_event)
+        .join(Individual, Individual.id == individual_event.c.individual_id)
+        .where(individual_event.c.event_id == Event.id)
+        .order_by(Individual.id)
+        .limit(1)
+        .lateral("event_person")
+    )
+    spouse1 = aliased(Individual)
+    spouse2 = aliased(Individual)
+    family = (
+        select(
+            Family.id.label("family_id"),
+            case((spouse1.id.isnot(None), _full_name(spouse1))).label("spouse1_name"),
+            case((spouse2.id.isnot(None), _full_name(spouse2))).label("spouse2_name"),
+        )
+        .select_from(family_event)
+        .join(Family, Family.id == family_event.c.family_id)
+        .outerjoin(spouse1, spouse1.id == Family.spouse1_id)
+        .outerjoin(spouse2, spouse2.id == Family.spouse2_id)
+        .where(family_event.c.event_id == Event.id)
+        .order_by(Family.id)
+        .limit(1)
+        .lateral("event_family")
+    )
+    return person, family
+
+
+def event_label(event_type, row) -> dict:
+    """Name and person or family ID shown for an event on the map."""
+    if event_type in PERSON_EVENT_TYPES and row.person_id:
+        return {"name": row.person_name, "person_id": row.person_id, "family_id": None}
+    if event_type == "MARR" and row.family_id:
+        names = [n for n in (row.spouse1_name, row.spouse2_name) if n]
+        return {"name": " & ".join(names), "person_id": None, "family_id": row.family_id}
+    return {"name": "", "person_id": None, "family_id": None}
+
+
+def _add_names(db: Session, events: list[dict]) -> None:
+    if not events:
+        return
+    person, family = event_name_columns()
+    rows = db.execute(
+        select(
+            Event.id,
+            person.c.person_id,
+            person.c.person_name,
+            family.c.family_id,
+            family.c.spouse1_name,
+            family.c.spouse2_name,
+        )
+        .select_from(Event)
+        .outerjoin(person, true())
+        .outerjoin(family, true())
+        .where(Event.id == any_(array_param([e["id"] for e in events])))
+    ).all()
+    by_id = {row.id: row for row in rows}
+    for event in events:
+        event.update(event_label(event["event_type"], by_id[event["id"]]))
+
+
+def map_clusters(
+    db: Session,
+    west: float,
+    south: float,
+    east: float,
+    north: float,
+    zoom: int,
+    year_from=None,
+    year_to=None,
+    event_types=None,
+) -> dict:
+    """Clusters or events inside a bounding box, computed and cached per tile.
+
+    Raises ValueError if the box covers more than MAX_TILES tiles.
+    """
+    tiles = tiles_for_bbox(west, south, east, north, zoom)
+    event_types = sorted(set(event_types)) if event_types else None
+    detail = zoom >= DETAIL_ZOOM
+    version = data_version(db)
+    filters = (year_from, year_to, tuple(event_types) if event_types else None)
+
+    found = {}
+    missing = []
+    for tile in tiles:
+        cached = cache_get((version, zoom, tile, filters))
+        if cached is None:
+            missing.append(tile)
+        else:
+            found[tile] = cached
+    if missing:
+        compute = _event_tiles if detail else cluster_tiles
+        computed = compute(db, missing, zoom, event_filters(year_from, year_to, event_types))
+        for tile, items in computed.items():
+            cache_put((version, zoom, tile, filters), items)
+            found[tile] = items
+
+    clusters = []
+    events = []
+    truncated = False
+    for tile in tiles:
+        if detail:
+            tile_events = found[tile]
+            if len(tile_events) > MAX_TILE_EVENTS:
+                tile_events = tile_events[:MAX_TILE_EVENTS]
+                truncated = True
+            events.extend(dict(e) for e in tile_events)
+        else:
+            clusters.extend(found[tile])
+    _add_names(db, events)
+
+    return {
+        "zoom": zoom,
+        "detail": detail,
+        "tiles": len(tiles),
+        "cached_tiles": len(tiles) - len(missing),
+        "clusters": clusters,
+        "events": events,
+        "truncated": truncated,
+    }
+
+
+def year_histogram(db: Session) -> dict:
+    """Events per year and type at geocoded places, for the timeline slider."""
+    version = data_version(db)
+    cached = cache_get(("years", version))
+    if cached is not None:
+        return cached
+
+    year = cast(func.extract("year", Event.event_date), Integer).label("year")
+    rows = db.execute(
+        select(year, Event.event_type, func.count().label("n"))
+        .select_from(Event)
+        .join(Place, Place.id == Event.place_id)
+        .where(*event_filters(None, None, None), Event.event_date.isnot(None))
+        .group_by(year, Event.event_type)
+        .order_by(year)
+    ).all()
+
+    histogram = {}
+    for row in rows:
+        bucket = histogram.setdefault(row.year, {"year": row.year, "count": 0, "types": {}})
+        bucket["count"] += row.n
+        event_type = row.event_type or "OTHER"
+        bucket["types"][event_type] = bucket["types"].get(event_type, 0) + row.n
+    years = list(histogram)
+    result = {
+        "min_year": years[0] if years else None,
+        "max_year": years[-1] if years else None,
+        "years": years,
+        "histogram": list(histogram.values()),
+    }
+    cache_put(("years", version), result)
+    return result
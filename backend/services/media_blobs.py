@@ -0,0 +1,145 @@
+"""Content-addressed storage of media files.
+
+Files are stored once per SHA-256 digest, under "blobs/<2 hex>/<digest>" in
+the media bucket, and every Media row with that content points at the same
+object. A MediaBlob row per digest counts the Media rows using it. Uploads
+are hashed from the local spooled copy first, so a duplicate is linked
+without sending its bytes to MinIO again. Blobs no longer referenced are
+removed, with their derivatives, by `collect_garbage`.
+
+A new blob's row is committed, unreferenced, as soon as its file is in
+MinIO, before the caller's transaction counts the reference. If that
+transaction rolls back, the row is left at zero references and the file is
+collected like any other unused blob instead of being orphaned. Blobs
+younger than GARBAGE_GRACE are skipped, so an upload in progress is never
+collected.
+"""
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import MediaBlob
+from services.derivatives import DERIVATIVE_BUCKET
+from services.storage import minio_client, upload_stream
+
+HASH_CHUNK_SIZE = 1024 * 1024
+GARBAGE_GRACE = timedelta(hours=1)
+
+
+def blob_path(content_hash: str) -> str:
+    return f"blobs/{content_hash[:2]}/{content_hash}"
+
+
+def hash_file(fileobj) -> tuple[int, str]:
+    """Size and SHA-256 hex digest of a file object, rewound afterwards."""
+    digest = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return size, digest.hexdigest()
+
+
+def add_reference(
+    db: Session,
+    content_hash: str,
+    size: int = None,
+    fileobj=None,
+    content_type: str = "application/octet-stream",
+) -> tuple[str, bool]:
+    """Count one more Media row using a blob, uploading `fileobj` if it is new.
+
+    Returns the blob's path and whether it was uploaded. Raises ValueError
+    for an unknown blob without a file object.
+    """
+    path = blob_path(content_hash)
+    uploaded = False
+    if db.get(MediaBlob, content_hash) is None:
+        if fileobj is None:
+            raise ValueError(f"No stored blob {content_hash}")
+        # Two uploads of the same new file both write identical bytes here;
+        # the upsert below then counts both references
+        fileobj.seek(0)
+        upload_stream(minio_client, "media", path, fileobj, content_type)
+        uploaded = True
+        # Record the file outside the caller's transaction, so a rollback
+        # leaves it to collect_garbage
+        with SessionLocal() as recorder:
+            recorder.execute(
+                insert(MediaBlob)
+                .values(content_hash=content_hash, file_path=path, size=size, ref_count=0)
+                .on_conflict_do_nothing()
+            )
+            recorder.commit()
+    db.execute(
+        insert(MediaBlob)
+        .values(content_hash=content_hash, file_path=path, size=size, ref_count=1)
+        .on_conflict_do_update(
+            index_elements=["content_hash"],
+            set_={"ref_count": MediaBlob.ref_count + 1},
+        )
+    )
+    return path, uploaded
+
+
+def store(
+    db: Session, fileobj, content_type: str = "application/octet-stream"
+) -> tuple[str, int, str, bool]:
+    """Reference the blob holding a file's content, uploading it only if new.
+
+    Returns (path, size, content hash, whether it was uploaded).
+    """
+    size, content_hash = hash_file(fileobj)
+    path, uploaded = add_reference(db, content_hash, size, fileobj, content_type)
+    return path, size, content_hash, uploaded
+
+
+def reset_references(db: Session) -> None:
+    """Zero every reference count (before the Media rows are replaced)."""
+    db.execute(update(MediaBlob).values(ref_count=0))
+
+
+def _remove_prefix(bucket: str, prefix: str) -> None:
+    for obj in minio_client.list_objects(bucket, prefix=prefix, recursive=True):
+        minio_client.remove_object(bucket, obj.object_name)
+
+
+def collect_garbage(db: Session) -> int:
+    """Delete unreferenced blobs and their derivatives. Returns the count.
+
+    Blobs stored less than GARBAGE_GRACE ago are kept for a later run. Each
+    row is deleted only if it is still unreferenced, and its files are
+    removed only then, so a blob referenced again since the scan is kept.
+    """
+    removed = 0
+    cutoff = datetime.now(timezone.utc) - GARBAGE_GRACE
+    unused = (MediaBlob.ref_count <= 0) & (MediaBlob.created_at < cutoff)
+    candidates = db.execute(select(MediaBlob.content_hash).where(unused)).scalars().all()
+    db.commit()
+    for content_hash in candidates:
+        file_path = db.execute(
+            delete(MediaBlob)
+            .where(MediaBlob.content_hash == content_hash, unused)
+            .returning(MediaBlob.file_path)
+        ).scalar()
+        if file_path is None:
+            continue
+        try:
+            minio_client.remove_object("media", file_path)
+            _remove_prefix("media", f"derivatives/{file_path}/")
+            _remove_prefix(DERIVATIVE_BUCKET, f"{file_path}/")
+        except Exception as e:
+            # Keep the row so the next collection retries
+            db.rollback()
+            print(f"Warning: Could not remove media blob {file_path}: {e}")
+            continue
+        db.commit()
+        removed += 1
+    return removed
@@ -0,0 +1,107 @@
+"""Set-based merging of duplicate individuals.
+
+All merges in a batch are expressed as one (source_id, target_id) VALUES
+list, and every table that references an individual is rewritten with a
+single statement (or an insert/delete pair for link tables) joined to it.
+The cost is therefore a fixed number of statements per batch, not per pair.
+"""
+
+from sqlalchemy import Integer, and_, column, delete, exists, insert, select, update, values
+from sqlalchemy.orm import Session
+
+from models import (
+    Individual,
+    Family,
+    individual_event,
+    child_in_family,
+    individual_source,
+    individual_note,
+    media_individual,
+)
+
+# Link tables as (table, individual column, other column)
+LINK_TABLES = [
+    (individual_event, "individual_id", "event_id"),
+    (child_in_family, "child_id", "family_id"),
+    (individual_source, "individual_id", "source_id"),
+    (individual_note, "individual_id", "note_id"),
+    (media_individual, "individual_id", "media_id"),
+]
+
+
+def _repoint_links(db: Session, merge_map, table, person_col: str, other_col: str):
+    """Move a link table's source rows to the target, skipping existing links."""
+    person = table.c[person_col]
+    other = table.c[other_col]
+    existing = table.alias("existing")
+
+    moved = (
+        select(merge_map.c.target_id, other)
+        .join(merge_map, person == merge_map.c.source_id)
+        .where(
+            ~exists().where(
+                and_(
+                    existing.c[person_col] == merge_map.c.target_id,
+                    existing.c[other_col] == other,
+                )
+            )
+        )
+        .distinct()
+    )
+    inserted = db.execute(insert(table).from_select([person_col, other_col], moved))
+    db.execute(delete(table).where(person == merge_map.c.source_id))
+    return inserted.rowcount
+
+
+def merge_people(db: Session, pairs: list[tuple[int, int]]) -> dict:
+    """Fold each source individual into its target and delete the source.
+
+    `pairs` is a list of (source_id, target_id). Callers must ensure no ID is
+    both a source and a target. Events, family memberships, spouse slots,
+    sources, notes, media tags and profile images are all moved to the
+    target. Does not commit.
+    """
+    merge_map = values(
+        column("source_id", Integer), column("target_id", Integer), name="merge_map"
+    ).data(pairs)
+
+    counts = {}
+    for table, person_col, other_col in LINK_TABLES:
+        counts[table.name] = _repoint_links(
+            db, merge_map, table, person_col, other_col
+        )
+
+    spouse_rows = 0
+    for spouse_col in ("spouse1_id", "spouse2_id"):
+        result = db.execute(
+            update(Family)
+            .where(getattr(Family, spouse_col) == merge_map.c.source_id)
+            .values({spouse_col: merge_map.c.target_id})
+            .execution_options(synchronize_session=False)
+        )
+        spouse_rows += result.rowcount
+    counts["family"] = spouse_rows
+
+    # Keep a source's profile image when the target has none
+    source = Individual.__table__.alias("source")
+    result = db.execute(
+        update(Individual)
+        .where(
+            Individual.id == merge_map.c.target_id,
+            source.c.id == merge_map.c.source_id,
+            Individual.profile_image_id.is_(None),
+            source.c.profile_image_id.isnot(None),
+        )
+        .values(profile_image_id=source.c.profile_image_id)
+        .execution_options(synchronize_session=False)
+    )
+    counts["profile_image"] = result.rowcount
+
+    result = db.execute(
+        delete(Individual)
+        .where(Individual.id == merge_map.c.source_id)
+        .execution_options(synchronize_session=False)
+    )
+    counts["individual"] = result.rowcount
+
+    return counts
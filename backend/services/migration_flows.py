@@ -0,0 +1,154 @@
+"""Birthplace to deathplace migration flows.
+
+Each person's first birth place and first death place are mapped to the
+enclosing place at a chosen level of the place hierarchy (country, state,
+county or locality) and counted per origin -> destination pair and period.
+Spelling variants are counted under their canonical place. Everything is
+aggregated by one grouped query; the result is cached until events, places
+or event links change (see data_version in services/map_tiles.py).
+"""
+
+from sqlalchemy import Integer, any_, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session, aliased
+
+from models import Event, Place, individual_event
+from services.map_tiles import cache_get, cache_put, data_version
+from services.places import array_param
+
+LEVELS = ("country", "state", "county", "locality")
+PERIOD_EVENTS = {"birth": "BIRT", "death": "DEAT"}
+
+
+def _first_events(event_type: str):
+    """Each person's first event of a type that has a place."""
+    return (
+        select(
+            individual_event.c.individual_id,
+            Event.place_id,
+            Event.event_date,
+        )
+        .join(Event, Event.id == individual_event.c.event_id)
+        .where(Event.event_type == event_type, Event.place_id.isnot(None))
+        .distinct(individual_event.c.individual_id)
+        .order_by(individual_event.c.individual_id, Event.id)
+        .subquery(event_type.lower())
+    )
+
+
+def _region_id(place, level: str):
+    """ID of the place at `level` in a place's chain (itself or an ancestor).
+
+    NULL if no place in the chain has that level. The shallowest wins, so a
+    ward below a town counts under the town.
+    """
+    region = aliased(Place)
+    chain = func.array_append(
+        func.coalesce(place.ancestor_ids, literal_column("'{}'::int[]")),
+        place.id,
+        type_=ARRAY(Integer),
+    )
+    return (
+        select(region.id)
+        .where(region.id == any_(chain), region.level == level)
+        .order_by(func.coalesce(func.cardinality(region.ancestor_ids), 0))
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def migration_flows(
+    db: Session,
+    level: str = "country",
+    bucket: int = 10,
+    period_by: str = "birth",
+    min_count: int = 1,
+) -> dict:
+    """Count people per origin -> destination region and period.
+
+    Periods start at multiples of `bucket` years of the birth or death date
+    (`period_by`); people without that date are counted with period None.
+    People born and dying in the same region are only counted in the
+    totals. Raises ValueError for an unknown level or period event.
+    """
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of: {', '.join(LEVELS)}")
+    if period_by not in PERIOD_EVENTS:
+        raise ValueError(f"period_by must be one of: {', '.join(PERIOD_EVENTS)}")
+
+    key = ("migrations", data_version(db), level, bucket, period_by, min_count)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+
+    birth = _first_events("BIRT")
+    death = _first_events("DEAT")
+    birth_place = aliased(Place)
+    death_place = aliased(Place)
+    origin = aliased(Place)
+    destination = aliased(Place)
+
+    dated = birth if period_by == "birth" else death
+    year = func.extract("year", dated.c.event_date)
+    period = cast(func.floor(year / bucket) * bucket, Integer).label("period")
+    origin_id = func.coalesce(origin.canonical_id, origin.id).label("origin_id")
+    destination_id = func.coalesce(
+        destination.canonical_id, destination.id
+    ).label("destination_id")
+
+    rows = db.execute(
+        select(period, origin_id, destination_id, func.count().label("n"))
+        .select_from(birth)
+        .join(death, death.c.individual_id == birth.c.individual_id)
+        .join(birth_place, birth_place.id == birth.c.place_id)
+        .join(death_place, death_place.id == death.c.place_id)
+        .join(origin, origin.id == _region_id(birth_place, level))
+        .join(destination, destination.id == _region_id(death_place, level))
+        .group_by(period, origin_id, destination_id)
+    ).all()
+
+    moved = stayed = 0
+    flows = []
+    for row in rows:
+        if row.origin_id == row.destination_id:
+            stayed += row.n
+            continue
+        moved += row.n
+        if row.n >= min_count:
+            flows.append(row)
+
+    place_ids = {r.origin_id for r in flows} | {r.destination_id for r in flows}
+    places = {}
+    if place_ids:
+        for place in db.execute(
+            select(Place.id, Place.name, Place.latitude, Place.longitude, Place.geocoded)
+            .where(Place.id == any_(array_param(list(place_ids))))
+        ):
+            geocoded = place.geocoded == 1
+            places[place.id] = {
+                "id": place.id,
+                "name": place.name,
+                "lat": place.latitude if geocoded else None,
+                "lng": place.longitude if geocoded else None,
+            }
+
+    flows.sort(key=lambda r: (r.period is None, r.period or 0, -r.n, r.origin_id))
+    result = {
+        "level": level,
+        "bucket": bucket,
+        "period_by": period_by,
+        "people": moved + stayed,
+        "moved": moved,
+        "stayed": stayed,
+        "flows": [
+            {
+                "period": row.period,
+                "origin": places[row.origin_id],
+                "destination": places[row.destination_id],
+                "count": row.n,
+            }
+            for row in flows
+        ],
+    }
+    cache_put(key, result)
+    return result
@@ -0,0 +1,340 @@
+"""Place-name normalisation and near-duplicate clustering.
+
+The same place is often recorded with different case, punctuation or
+abbreviations ("Suffolk Co., MA" and "suffolk county, Massachusetts"). Each
+name is reduced to a normalised key: its comma-separated parts in order,
+each as accent-free lowercase words with abbreviations and region codes
+expanded. Two-letter US state codes are only expanded as the last part or
+before the country, so the "Co." of "Cork, Co., Ireland" stays a county.
+Level words such as "county" are kept and so is each part's position, so
+"Jackson County, Missouri" and "Jackson, Missouri" stay apart. The key is
+also the geocoding query.
+
+Places are clustered by the key with the words of each part sorted, so word
+order variants ("Co. Cork" and "Cork Co.") are variants of each other.
+Clustering keys that differ by a single typo in one word are merged too,
+which catches misspellings such as "Springfeld, Illinois": the word must be
+in a part below another (the parts after it, its parents, are shared), and
+the two spellings must differ by one inserted, deleted or swapped letter.
+Candidates are found through deletion signatures, so only keys sharing
+every other word are compared. Finally, under the same parent, first parts
+of at least MIN_SIMILAR_LENGTH letters are merged when difflib rates them
+SIMILARITY_THRESHOLD alike; shorter names differing by a substituted letter
+are mostly different places ("Bristol" and "Bristow").
+
+Each cluster has one canonical place, preferring one already geocoded, then
+the one with the most events. Only canonical places are geocoded; their
+coordinates are copied to the variants.
+"""
+
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from sqlalchemy import Integer, String, any_, func, select, update
+from sqlalchemy.orm import Session, aliased
+
+from models import Place
+from services.autocomplete import normalize_tokens
+from services.places import array_param, split_place
+
+# Shortest word considered for typo matching
+MIN_TYPO_WORD_LENGTH = 5
+# Shortest first part, and the difflib ratio, for merging near-misses
+MIN_SIMILAR_LENGTH = 8
+SIMILARITY_THRESHOLD = 0.9
+
+ABBREVIATIONS = {
+    "co": "county",
+    "cnty": "county",
+    "cty": "county",
+    "twp": "township",
+    "par": "parish",
+    "prov": "province",
+    "dist": "district",
+    "st": "saint",
+    "ste": "sainte",
+    "mt": "mount",
+    "ft": "fort",
+    "pt": "point",
+}
+
+# Words naming an admin level, ignored when comparing a part with a region
+LEVEL_WORDS = {"county", "parish", "township", "province", "district"}
+
+# Whole comma-separated parts that name a country
+COUNTRIES = {
+    "us": "usa",
+    "u s": "usa",
+    "usa": "usa",
+    "u s a": "usa",
+    "united states": "usa",
+    "united states of america": "usa",
+    "uk": "united kingdom",
+    "u k": "united kingdom",
+}
+
+# Whole parts that name a US state. Codes are only read as states as the last
+# part or before the US, since some are also abbreviations ("co", "par")
+US_STATES = {
+    "al": "alabama", "ak": "alaska", "az": "arizona", "ar": "arkansas",
+    "ca": "california", "co": "colorado", "ct": "connecticut",
+    "de": "delaware", "dc": "district of columbia", "fl": "florida",
+    "ga": "georgia", "hi": "hawaii", "id": "idaho", "il": "illinois",
+    "in": "indiana", "ia": "iowa", "ks": "kansas", "ky": "kentucky",
+    "la": "louisiana", "me": "maine", "md": "maryland",
+    "ma": "massachusetts", "mass": "massachusetts", "mi": "michigan",
+    "mn": "minnesota", "ms": "mississippi", "mo": "missouri",
+    "mt": "montana", "ne": "nebraska", "nv": "nevada",
+    "nh": "new hampshire", "nj": "new jersey", "nm": "new mexico",
+    "ny": "new york", "nc": "north carolina", "nd": "north dakota",
+    "oh": "ohio", "ok": "oklahoma", "or": "oregon", "pa": "pennsylvania",
+    "ri": "rhode island", "sc": "south carolina", "sd": "south dakota",
+    "tn": "tennessee", "tx": "texas", "ut": "utah", "vt": "vermont",
+    "va": "virginia", "wa": "washington", "wv": "west virginia",
+    "wi": "wisconsin", "wy": "wyoming",
+}
+
+
+def normalize_place_name(name: str) -> str:
+    """Return the normalised key of a place name ('' if it has no words).
+
+    Parts are kept in order and joined with ", ".
+    """
+    parts = [" ".join(normalize_tokens(part)) for part in split_place(name)]
+    parts = [part for part in parts if part]
+    normalized = []
+    for i, part in enumerate(parts):
+        following = parts[i + 1] if i + 1 < len(parts) else None
+        if part in COUNTRIES:
+            normalized.append(COUNTRIES[part])
+        elif part in US_STATES and (
+            following is None or COUNTRIES.get(following) == "usa"
+        ):
+            normalized.append(US_STATES[part])
+        else:
+            normalized.append(" ".join(ABBREVIATIONS.get(t, t) for t in part.split()))
+    return ", ".join(normalized)
+
+
+def cluster_key(key: str) -> str:
+    """A normalised key with the words of each part sorted.
+
+    "county cork, ireland" and "cork county, ireland" share a cluster key.
+    """
+    return ", ".join(" ".join(sorted(part.split())) for part in key.split(", "))
+
+
+def strip_level_words(key: str) -> str:
+    """A one-part key without level words ("suffolk county" -> "suffolk").
+
+    Keys made only of level words are returned unchanged.
+    """
+    words = [word for word in key.split() if word not in LEVEL_WORDS]
+    return " ".join(words) if words else key
+
+
+def _deletions(word: str) -> set:
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def is_single_typo(a: str, b: str) -> bool:
+    """Whether two words differ by one inserted, deleted or swapped letter."""
+    if a == b:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return (
+            len(diff) == 2
+            and diff[1] == diff[0] + 1
+            and a[diff[0]] == b[diff[1]]
+            and a[diff[1]] == b[diff[0]]
+        )
+    if abs(len(a) - len(b)) != 1:
+        return False
+    shorter, longer = sorted((a, b), key=len)
+    return shorter in _deletions(longer)
+
+
+def _typo_pairs(keys) -> set:
+    """Pairs of keys that differ by a single typo in one word below a parent."""
+    # Keys with one word blanked out, bucketed with that word and each of
+    # its one-letter deletions; typo pairs always share a bucket
+    buckets = defaultdict(list)
+    for key in keys:
+        parts = [part.split() for part in key.split(", ")]
+        # Words of the last part have no parent to share
+        for p, words in enumerate(parts[:-1]):
+            for i, word in enumerate(words):
+                # Words with digits ("Ward 10") are identifiers, not misspellings
+                if len(word) < MIN_TYPO_WORD_LENGTH or not word.isalpha():
+                    continue
+                blanked = [list(w) for w in parts]
+                blanked[p][i] = "*"
+                signature = ", ".join(" ".join(w) for w in blanked)
+                for variant in _deletions(word) | {word}:
+                    buckets[(signature, variant)].append((word, key))
+
+    pairs = set()
+    for entries in buckets.values():
+        if len(entries) < 2:
+            continue
+        for i, (word_a, key_a) in enumerate(entries):
+            for word_b, key_b in entries[i + 1:]:
+                if key_a != key_b and is_single_typo(word_a, word_b):
+                    pairs.add((min(key_a, key_b), max(key_a, key_b)))
+    return pairs
+
+
+def _near_pairs(keys) -> set:
+    """Pairs of keys under the same parent with near-identical first parts."""
+    # Grouped by parent and initial (misspelt initials are rare), so only a
+    # few first parts of similar length are compared with each other
+    groups = defaultdict(list)
+    for key in keys:
+        first, _, parent = key.partition(", ")
+        if parent and len(first) >= MIN_SIMILAR_LENGTH:
+            groups[(parent, first[0])].append((first, key))
+
+    pairs = set()
+    for entries in groups.values():
+        entries.sort(key=lambda entry: len(entry[0]))
+        for i, (first_a, key_a) in enumerate(entries):
+            # The second sequence is the one SequenceMatcher indexes
+            matcher = SequenceMatcher(None, "", first_a)
+            for first_b, key_b in entries[i + 1:]:
+                # The ratio is at most 2 * shorter / (both lengths)
+                if 2 * len(first_a) < SIMILARITY_THRESHOLD * (len(first_a) + len(first_b)):
+                    break
+                matcher.set_seq1(first_b)
+                if (
+                    matcher.real_quick_ratio() >= SIMILARITY_THRESHOLD
+                    and matcher.quick_ratio() >= SIMILARITY_THRESHOLD
+                    and matcher.ratio() >= SIMILARITY_THRESHOLD
+                ):
+                    pairs.add((min(key_a, key_b), max(key_a, key_b)))
+    return pairs
+
+
+def similar_keys(keys) -> list[tuple[str, str]]:
+    """Pairs of clustering keys that are typo or near-miss variants."""
+    keys = list(keys)
+    return sorted(_typo_pairs(keys) | _near_pairs(keys))
+
+
+def cluster_places(places) -> dict:
+    """Map each place ID to its canonical place ID.
+
+    `places` is a list of (id, normalised key) in order of preference, so
+    the first place of each cluster becomes its canonical place. Places with
+    an empty key are their own canonical place.
+    """
+    order = {}
+    by_key = defaultdict(list)
+    for rank, (place_id, key) in enumerate(places):
+        order[place_id] = rank
+        if key:
+            by_key[cluster_key(key)].append(place_id)
+
+    # Union-find over keys, keeping the most preferred key as each root
+    parent = {key: key for key in by_key}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for key_a, key_b in similar_keys(by_key):
+        root_a, root_b = find(key_a), find(key_b)
+        if root_a != root_b:
+            if order[by_key[root_b][0]] < order[by_key[root_a][0]]:
+                root_a, root_b = root_b, root_a
+            parent[root_b] = root_a
+
+    canonical = {place_id: place_id for place_id, _ in places}
+    for key, ids in by_key.items():
+        root_id = by_key[find(key)][0]
+        for place_id in ids:
+            canonical[place_id] = root_id
+    return canonical
+
+
+def propagate_coordinates(db: Session, place_ids=None) -> int:
+    """Copy geocoding results from canonical places to their variants.
+
+    Only canonical places that have been attempted are copied, optionally
+    limited to the given canonical place IDs. Does not commit. Returns the
+    number of variants changed.
+    """
+    canonical = aliased(Place)
+    query = update(Place)
+    if place_ids is not None:
+        query = query.where(Place.canonical_id == any_(array_param(list(place_ids))))
+    result = db.execute(
+        query
+        .where(
+            Place.canonical_id == canonical.id,
+            canonical.geocoded != 0,
+            (Place.geocoded.is_distinct_from(canonical.geocoded))
+            | Place.latitude.is_distinct_from(canonical.latitude)
+            | Place.longitude.is_distinct_from(canonical.longitude),
+        )
+        .values(
+            latitude=canonical.latitude,
+            longitude=canonical.longitude,
+            geocoded=canonical.geocoded,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def canonicalize_places(db: Session) -> dict:
+    """Recompute normalised names and canonical places for every place.
+
+    Variants then receive their canonical place's coordinates. Does not
+    commit. Returns counts of places, canonical places and variants.
+    """
+    rows = db.execute(
+        select(Place.id, Place.name, Place.normalized_name, Place.canonical_id)
+        .order_by(
+            (Place.geocoded == 1).desc(),
+            Place.total_event_count.desc(),
+            Place.id,
+        )
+    ).all()
+    keys = {row.id: normalize_place_name(row.name) for row in rows}
+    canonical = cluster_places([(row.id, keys[row.id]) for row in rows])
+
+    changes = []
+    for row in rows:
+        canonical_id = canonical[row.id] if canonical[row.id] != row.id else None
+        if row.normalized_name != keys[row.id] or row.canonical_id != canonical_id:
+            changes.append((row.id, keys[row.id], canonical_id))
+    if changes:
+        changed = (
+            func.unnest(
+                array_param([place_id for place_id, _, _ in changes]),
+                array_param([key for _, key, _ in changes], String),
+                array_param([canonical_id for _, _, canonical_id in changes], Integer),
+            )
+            .table_valued("place_id", "normalized_name", "canonical_id")
+            .render_derived()
+        )
+        db.execute(
+            update(Place)
+            .where(Place.id == changed.c.place_id)
+            .values(
+                normalized_name=changed.c.normalized_name,
+                canonical_id=changed.c.canonical_id,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    propagate_coordinates(db)
+
+    variants = sum(1 for place_id, root_id in canonical.items() if place_id != root_id)
+    return {
+        "places": len(rows),
+        "canonical": len(rows) - variants,
+        "variants": variants,
+    }
@@ -0,0 +1,357 @@
+"""Place hierarchy and event-to-place linking.
+
+Every distinct event place string maps to a `Place` row, and each place name
+is split on commas into a chain of ancestor places read from the right, using
+the GEDCOM convention "locality, county, state, country". For example
+"Boston, Suffolk, Massachusetts, USA" is linked under "Suffolk, Massachusetts,
+USA", then "Massachusetts, USA", then "USA".
+
+Levels (country, state, county, locality) are counted from the root, and
+only recorded where the name is long enough to be sure: a bare
+"Springfield" or "Boston, USA" may be missing its country or state, so its
+places get no level unless a longer name gives them one.
+
+Events reference their place through `Event.place_id`. Each place keeps the
+number of events recorded directly at it (`event_count`) and at it or any of
+its sub-places (`total_event_count`). Both are adjusted by deltas as events
+change, so an edit only touches the affected place chains.
+
+ORM writes are linked automatically by session hooks before each commit.
+Code that writes events with Core statements calls `link_event_places`
+itself.
+"""
+
+from collections import Counter
+
+from sqlalchemy import (
+    Integer,
+    String,
+    any_,
+    cast,
+    column,
+    event as sa_event,
+    func,
+    inspect,
+    literal,
+    literal_column,
+    select,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import Session
+
+from models import Event, Place
+
+# Level of a place by its depth below the root (the country, the last part)
+LEVELS = {1: "country", 2: "state", 3: "county"}
+LOCALITY = "locality"
+# Fewer parts than this may leave out the country or state ("Boston, USA")
+MIN_LEVEL_PARTS = 3
+
+
+def array_param(items: list, item_type=Integer):
+    """Bind a list as one typed array parameter rather than one per item."""
+    return cast(literal(items, ARRAY(item_type)), ARRAY(item_type))
+
+
+def split_place(name: str) -> list[str]:
+    """Split a place name into its non-empty, trimmed comma-separated parts."""
+    if not name:
+        return []
+    return [part.strip() for part in name.split(",") if part.strip()]
+
+
+def place_level(depth: int, parts_count: int) -> str | None:
+    """Level of the place `depth` parts from the root of a name, or None.
+
+    Levels are only known in names of at least MIN_LEVEL_PARTS parts. The
+    place a three-part name itself names may be a county or a town, so its
+    level is unknown too.
+    """
+    if parts_count < MIN_LEVEL_PARTS or depth == parts_count == MIN_LEVEL_PARTS:
+        return None
+    return LEVELS.get(depth, LOCALITY)
+
+
+def parse_place_hierarchy(name: str) -> list[tuple[str, str, str | None]]:
+    """Return (name, level, parent name) for a place and all its ancestors.
+
+    Ancestors come first. The place itself keeps its trimmed original
+    spelling so it still matches the event text; ancestors use the parts
+    joined with ", ". Levels may be None (see `place_level`).
+    """
+    parts = split_place(name)
+    nodes = []
+    parent = None
+    for start in range(len(parts) - 1, -1, -1):
+        node_name = ", ".join(parts[start:]) if start else name.strip()
+        nodes.append((node_name, place_level(len(parts) - start, len(parts)), parent))
+        parent = node_name
+    return nodes
+
+
+def ensure_places(db: Session, names) -> int:
+    """Create any missing places (and their ancestors) for the given names.
+
+    Parent links, levels and ancestor lists are filled in for new places and
+    repaired for existing ones; a known level is never replaced by an
+    unknown one. Returns the number of places created.
+    """
+    nodes = {}
+    for name in names:
+        for node_name, level, parent in parse_place_hierarchy(name):
+            # "USA" has no level in "Boston, USA" but does in longer names
+            if nodes.get(node_name, (None,))[0] is None:
+                nodes[node_name] = (level, parent)
+    if not nodes:
+        return 0
+
+    new_places = (
+        func.unnest(
+            array_param(list(nodes), String), array_param([n[0] for n in nodes.values()], String)
+        )
+        .table_valued("name", "level")
+        .render_derived()
+    )
+    result = db.execute(
+        insert(Place)
+        .from_select(
+            ["name", "level", "geocoded"],
+            select(new_places.c.name, new_places.c.level, literal(0)),
+        )
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+    created = result.rowcount
+
+    rows = db.execute(
+        select(Place.id, Place.name, Place.parent_id, Place.level, Place.ancestor_ids)
+        .where(Place.name == any_(array_param(list(nodes), String)))
+    ).all()
+    ids = {row.name: row.id for row in rows}
+
+    # Nodes were parsed ancestors-first, so parents are resolved before children
+    ancestors = {}
+    fixes = []
+    for node_name, (level, parent) in nodes.items():
+        parent_id = ids[parent] if parent else None
+        ancestors[node_name] = (ancestors[parent] + [parent_id]) if parent else []
+    for row in rows:
+        level, parent = nodes[row.name]
+        if level is None:
+            level = row.level
+        parent_id = ids[parent] if parent else None
+        if (
+            row.parent_id != parent_id
+            or row.level != level
+            or (row.ancestor_ids or []) != ancestors[row.name]
+        ):
+            fixes.append((row.id, parent_id, level, ancestors[row.name]))
+    if fixes:
+        fixed = values(
+            column("place_id", Integer),
+            column("parent_id", Integer),
+            column("level", String),
+            column("ancestor_ids", ARRAY(Integer)),
+            name="fixed",
+        ).data(fixes)
+        db.execute(
+            update(Place)
+            .where(Place.id == fixed.c.place_id)
+            .values(
+                parent_id=fixed.c.parent_id,
+                level=fixed.c.level,
+                # An empty list is sent as an untyped '{}' literal
+                ancestor_ids=cast(fixed.c.ancestor_ids, ARRAY(Integer)),
+            )
+            .execution_options(synchronize_session=False)
+        )
+    return created
+
+
+def _apply_count_deltas(db: Session, deltas: Counter) -> None:
+    """Add per-place direct event count changes to each place and its ancestors."""
+    deltas = {place_id: d for place_id, d in deltas.items() if place_id and d}
+    if not deltas:
+        return
+
+    chains = db.execute(
+        select(Place.id, Place.ancestor_ids).where(Place.id.in_(list(deltas)))
+    ).all()
+    totals = Counter()
+    for place_id, ancestor_ids in chains:
+        for node_id in (ancestor_ids or []) + [place_id]:
+            totals[node_id] += deltas[place_id]
+
+    rows = [
+        (node_id, deltas.get(node_id, 0), total)
+        for node_id, total in totals.items()
+        if total or deltas.get(node_id)
+    ]
+    if not rows:
+        return
+    changes = values(
+        column("place_id", Integer),
+        column("direct", Integer),
+        column("total", Integer),
+        name="changes",
+    ).data(rows)
+    db.execute(
+        update(Place)
+        .where(Place.id == changes.c.place_id)
+        .values(
+            event_count=Place.event_count + changes.c.direct,
+            total_event_count=Place.total_event_count + changes.c.total,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def refresh_place_counts(db: Session) -> None:
+    """Recompute every place's direct and rollup event counts from scratch."""
+    direct = (
+        select(Place.id.label("place_id"), func.count(Event.id).label("n"))
+        .outerjoin(Event, Event.place_id == Place.id)
+        .group_by(Place.id)
+        .subquery()
+    )
+    db.execute(
+        update(Place)
+        .where(Place.id == direct.c.place_id)
+        .values(event_count=direct.c.n)
+        .execution_options(synchronize_session=False)
+    )
+
+    # Each place contributes its direct count to itself and every ancestor
+    chain = func.array_append(
+        func.coalesce(Place.ancestor_ids, literal_column("'{}'::int[]")), Place.id
+    )
+    chain_ids = func.unnest(chain).table_valued("node_id").render_derived()
+    rollup = (
+        select(chain_ids.c.node_id, func.sum(Place.event_count).label("n"))
+        .select_from(Place)
+        .join(chain_ids, literal_column("true"))
+        .group_by(chain_ids.c.node_id)
+        .subquery()
+    )
+    db.execute(
+        update(Place)
+        .where(Place.id == rollup.c.node_id)
+        .values(total_event_count=rollup.c.n)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def link_event_places(db: Session, event_ids=None, removed_place_ids=()) -> int:
+    """Point events at the Place matching their place text, creating places as needed.
+
+    With `event_ids` only those events are relinked and counts are adjusted
+    incrementally; without it every event is relinked and all counts are
+    recomputed. `removed_place_ids` lists the places of deleted events so
+    their counts can be decremented. Does not commit. Returns the number of
+    places created.
+    """
+    db.flush()
+    place_text = func.trim(Event.place)
+
+    if event_ids is None:
+        names = db.execute(
+            select(place_text).where(place_text != "").distinct()
+        ).scalars()
+        created = ensure_places(db, names)
+        db.execute(
+            update(Event)
+            .where(Place.name == place_text, Event.place_id.is_distinct_from(Place.id))
+            .values(place_id=Place.id)
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            update(Event)
+            .where(Event.place_id.isnot(None), func.coalesce(place_text, "") == "")
+            .values(place_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        refresh_place_counts(db)
+        return created
+
+    event_ids = list(event_ids)
+    deltas = Counter()
+    for place_id in removed_place_ids:
+        deltas[place_id] -= 1
+
+    created = 0
+    if event_ids:
+        names = db.execute(
+            select(place_text)
+            .where(Event.id == any_(array_param(event_ids)), place_text != "")
+            .distinct()
+        ).scalars()
+        created = ensure_places(db, names)
+
+        changes = db.execute(
+            select(Event.id, Event.place_id, Place.id)
+            .outerjoin(Place, Place.name == place_text)
+            .where(
+                Event.id == any_(array_param(event_ids)),
+                Event.place_id.is_distinct_from(Place.id),
+            )
+        ).all()
+        if changes:
+            relinked = (
+                func.unnest(
+                    array_param([event_id for event_id, _, _ in changes]),
+                    array_param([new_id for _, _, new_id in changes]),
+                )
+                .table_valued("event_id", "place_id")
+                .render_derived()
+            )
+            db.execute(
+                update(Event)
+                .where(Event.id == relinked.c.event_id)
+                .values(place_id=relinked.c.place_id)
+                .execution_options(synchronize_session=False)
+            )
+            for _, old_place_id, new_place_id in changes:
+                deltas[old_place_id] -= 1
+                deltas[new_place_id] += 1
+
+    _apply_count_deltas(db, deltas)
+    return created
+
+
+def subtree_place_ids(place_id: int):
+    """Select the IDs of a place and all places below it (GIN-indexed)."""
+    return select(Place.id).where(
+        (Place.id == place_id) | Place.ancestor_ids.contains([place_id])
+    )
+
+
+@sa_event.listens_for(Session, "after_flush")
+def _collect_event_changes(session, flush_context):
+    pending = session.info.setdefault(
+        "place_link_pending", {"events": set(), "removed": []}
+    )
+    for obj in session.new:
+        if isinstance(obj, Event):
+            pending["events"].add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Event) and inspect(obj).attrs.place.history.has_changes():
+            pending["events"].add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Event):
+            pending["events"].discard(obj.id)
+            if obj.place_id:
+                pending["removed"].append(obj.place_id)
+
+
+@sa_event.listens_for(Session, "before_commit")
+def _link_pending_events(session):
+    session.flush()
+    pending = session.info.pop("place_link_pending", None)
+    if pending and (pending["events"] or pending["removed"]):
+        link_event_places(session, pending["events"], pending["removed"])
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_event_changes(session):
+    session.info.pop("place_link_pending", None)
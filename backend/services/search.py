@@ -0,0 +1,246 @@
+"""Unified full-text search across people, places, events, notes and media.
+
+Each entity carries a stored `search_vector` column (see models.py) that
+PostgreSQL maintains on write and indexes with GIN. A search runs one ranked
+UNION ALL over those indexes to pick the page of hits, then fetches display
+fields and highlighted snippets for just the hits on that page.
+"""
+
+from sqlalchemy import and_, func, literal, or_, select, tuple_, union_all, cast, Text
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from sqlalchemy.orm import Session
+
+from models import Individual, Event, Note, Media, individual_note
+from utils import encode_cursor, decode_cursor
+
+SEARCH_TYPES = ["person", "place", "event", "note", "media"]
+
+HEADLINE_OPTIONS = (
+    "StartSel=<mark>, StopSel=</mark>, MaxWords=25, MinWords=8, MaxFragments=2"
+)
+
+
+def _place_vector():
+    return func.to_tsvector("simple", func.coalesce(Event.place, ""))
+
+
+def _ranked_hits(types: list[str], simple_q, english_q):
+    """Build one (type, key, rank) select per requested entity type."""
+    selects = []
+    if "person" in types:
+        selects.append(
+            select(
+                literal("person").label("type"),
+                cast(Individual.id, Text).label("key"),
+                func.ts_rank(Individual.search_vector, simple_q).label("rank"),
+            ).where(Individual.search_vector.op("@@")(simple_q))
+        )
+    if "place" in types:
+        place_name = func.trim(Event.place)
+        selects.append(
+            select(
+                literal("place").label("type"),
+                place_name.label("key"),
+                func.max(func.ts_rank(_place_vector(), simple_q)).label("rank"),
+            )
+            .where(_place_vector().op("@@")(simple_q))
+            .group_by(place_name)
+        )
+    if "event" in types:
+        selects.append(
+            select(
+                literal("event").label("type"),
+                cast(Event.id, Text).label("key"),
+                func.ts_rank(Event.search_vector, english_q).label("rank"),
+            ).where(Event.search_vector.op("@@")(english_q))
+        )
+    if "note" in types:
+        selects.append(
+            select(
+                literal("note").label("type"),
+                cast(Note.id, Text).label("key"),
+                func.ts_rank(Note.search_vector, english_q).label("rank"),
+            ).where(Note.search_vector.op("@@")(english_q))
+        )
+    if "media" in types:
+        selects.append(
+            select(
+                literal("media").label("type"),
+                cast(Media.id, Text).label("key"),
+                func.ts_rank(Media.search_vector, english_q).label("rank"),
+            ).where(Media.search_vector.op("@@")(english_q))
+        )
+    return selects
+
+
+def _person_hits(db: Session, ids, simple_q) -> dict:
+    full_name = func.concat_ws(" ", Individual.first_name, Individual.last_name)
+    rows = db.query(
+        Individual.id,
+        Individual.first_name,
+        Individual.last_name,
+        Individual.sex,
+        func.ts_headline("simple", full_name, simple_q, HEADLINE_OPTIONS),
+    ).filter(Individual.id.in_(ids))
+    return {
+        str(r[0]): {
+            "id": r[0],
+            "title": f"{r[1]} {r[2]}",
+            "snippet": r[4],
+            "sex": r[3],
+        }
+        for r in rows
+    }
+
+
+def _place_hits(db: Session, names, simple_q) -> dict:
+    place_name = func.trim(Event.place)
+    rows = (
+        db.query(
+            place_name,
+            func.count(Event.id),
+            func.ts_headline("simple", place_name, simple_q, HEADLINE_OPTIONS),
+        )
+        .filter(place_name.in_(names))
+        .group_by(place_name)
+    )
+    return {
+        r[0]: {"id": r[0], "title": r[0], "snippet": r[2], "event_count": r[1]}
+        for r in rows
+    }
+
+
+def _event_hits(db: Session, ids, english_q) -> dict:
+    text = func.concat_ws(" — ", Event.description, Event.place)
+    rows = db.query(
+        Event.id,
+        Event.event_type,
+        Event.event_date,
+        Event.place,
+        func.ts_headline("english", text, english_q, HEADLINE_OPTIONS),
+    ).filter(Event.id.in_(ids))
+    return {
+        str(r[0]): {
+            "id": r[0],
+            "title": f"{r[1]} {r[2].isoformat() if r[2] else ''}".strip(),
+            "snippet": r[4],
+            "event_type": r[1],
+            "date": r[2],
+            "place": r[3],
+        }
+        for r in rows
+    }
+
+
+def _note_hits(db: Session, ids, english_q) -> dict:
+    rows = db.query(
+        Note.id,
+        func.left(Note.text, 80),
+        func.ts_headline("english", Note.text, english_q, HEADLINE_OPTIONS),
+    ).filter(Note.id.in_(ids))
+    links = (
+        db.query(individual_note.c.note_id, individual_note.c.individual_id)
+        .filter(individual_note.c.note_id.in_(ids))
+        .all()
+    )
+    hits = {
+        str(r[0]): {"id": r[0], "title": r[1], "snippet": r[2], "individual_ids": []}
+        for r in rows
+    }
+    for note_id, individual_id in links:
+        hits[str(note_id)]["individual_ids"].append(individual_id)
+    return hits
+
+
+def _media_hits(db: Session, ids, english_q) -> dict:
+    text = func.coalesce(func.nullif(Media.extracted_text, ""), Media.description, "")
+    rows = db.query(
+        Media.id,
+        Media.filename,
+        Media.media_type,
+        func.ts_headline("english", text, english_q, HEADLINE_OPTIONS),
+    ).filter(Media.id.in_(ids))
+    return {
+        str(r[0]): {
+            "id": r[0],
+            "title": r[1],
+            "snippet": r[3],
+            "media_type": r[2],
+        }
+        for r in rows
+    }
+
+
+def search_all(
+    db: Session,
+    query: str,
+    types: list[str] | None = None,
+    limit: int = 20,
+    cursor: str | None = None,
+) -> dict:
+    """Search every entity type and return one ranked page of typed hits.
+
+    Results are ordered by rank (best first), then type and key so paging is
+    stable. Pass the returned `next_cursor` to fetch the following page.
+    """
+    types = [t for t in (types or SEARCH_TYPES) if t in SEARCH_TYPES]
+    simple_q = func.websearch_to_tsquery("simple", query)
+    english_q = func.websearch_to_tsquery("english", query)
+
+    selects = _ranked_hits(types, simple_q, english_q)
+    if not selects:
+        return {"results": [], "next_cursor": None}
+
+    hits = union_all(*selects).subquery()
+    # ts_rank is float4; widen it so cursor values round-trip exactly
+    hit_rank = cast(hits.c.rank, DOUBLE_PRECISION)
+    page = select(hits.c.type, hits.c.key, hit_rank.label("rank"))
+    if cursor:
+        rank, hit_type, key = decode_cursor(cursor, (int, float), str, str)
+        page = page.where(
+            or_(
+                hit_rank < rank,
+                and_(
+                    hit_rank == rank,
+                    tuple_(hits.c.type, hits.c.key) > tuple_(hit_type, key),
+                ),
+            )
+        )
+    page = page.order_by(hit_rank.desc(), hits.c.type, hits.c.key).limit(limit + 1)
+    rows = db.execute(page).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    keys_by_type = {}
+    for row in rows:
+        keys_by_type.setdefault(row.type, []).append(row.key)
+
+    details = {}
+    if "person" in keys_by_type:
+        ids = [int(k) for k in keys_by_type["person"]]
+        details["person"] = _person_hits(db, ids, simple_q)
+    if "place" in keys_by_type:
+        details["place"] = _place_hits(db, keys_by_type["place"], simple_q)
+    if "event" in keys_by_type:
+        ids = [int(k) for k in keys_by_type["event"]]
+        details["event"] = _event_hits(db, ids, english_q)
+    if "note" in keys_by_type:
+        ids = [int(k) for k in keys_by_type["note"]]
+        details["note"] = _note_hits(db, ids, english_q)
+    if "media" in keys_by_type:
+        ids = [int(k) for k in keys_by_type["media"]]
+        details["media"] = _media_hits(db, ids, english_q)
+
+    results = []
+    for row in rows:
+        hit = details[row.type].get(row.key)
+        if hit:
+            results.append({"type": row.type, "rank": row.rank, **hit})
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(last.rank, last.type, last.key)
+
+    return {"results": results, "next_cursor": next_cursor}
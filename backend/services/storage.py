@@ -1,11 +1,21 @@
 """MinIO storage service for handling file uploads and retrieval."""
 
+import hashlib
 import io
 import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
 from minio import Minio
-from PIL import Image
 
-THUMBNAIL_SIZE = (300, 300)
+# Multipart upload part size; also the most an upload holds in memory
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE_MB", "8")) * 1024 * 1024
+# Local disk cache of objects read from MinIO
+OBJECT_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_MB", "1024")) * 1024 * 1024
+# Partial cache downloads older than this are left over from a restart
+STALE_DOWNLOAD_SECONDS = 3600
 
 
 def get_minio_client() -> Minio:
@@ -25,6 +35,8 @@ def ensure_buckets(client: Minio) -> None:
             client.make_bucket("gedcoms")
         if not client.bucket_exists("media"):
             client.make_bucket("media")
+        if not client.bucket_exists("derivatives"):
+            client.make_bucket("derivatives")
     except Exception as e:
         print(f"MinIO bucket creation failed: {e}")
 
@@ -42,6 +54,27 @@ def upload_file(
     )
 
 
+def upload_stream(
+    client: Minio,
+    bucket: str,
+    filename: str,
+    fileobj,
+    content_type: str = "application/octet-stream",
+) -> None:
+    """Stream a file object to MinIO as a multipart upload.
+
+    Only one part is held in memory at a time.
+    """
+    client.put_object(
+        bucket,
+        filename,
+        fileobj,
+        length=-1,
+        part_size=UPLOAD_PART_SIZE,
+        content_type=content_type,
+    )
+
+
 def get_file(client: Minio, bucket: str, filename: str) -> bytes:
     """Retrieve a file from MinIO."""
     response = client.get_object(bucket, filename)
@@ -64,53 +97,166 @@ def get_presigned_url(
     )
 
 
-def generate_thumbnail(image_data: bytes, filename: str) -> tuple[bytes, str] | None:
-    """Generate a thumbnail from image data. Returns (thumbnail_bytes, thumbnail_filename) or None if not an image."""
-    try:
-        img = Image.open(io.BytesIO(image_data))
-
-        # Convert RGBA to RGB for JPEG
-        if img.mode in ("RGBA", "LA", "P"):
-            background = Image.new("RGB", img.size, (255, 255, 255))
-            if img.mode == "P":
-                img = img.convert("RGBA")
-            background.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
-            img = background
-        elif img.mode != "RGB":
-            img = img.convert("RGB")
-
-        # Create thumbnail maintaining aspect ratio
-        img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-
-        # Save to bytes
-        thumb_buffer = io.BytesIO()
-        img.save(thumb_buffer, format="JPEG", quality=85, optimize=True)
-        thumb_buffer.seek(0)
-
-        # Generate thumbnail filename
-        base_name = filename.rsplit(".", 1)[0] if "." in filename else filename
-        thumb_filename = f"thumb_{base_name}.jpg"
-
-        return thumb_buffer.getvalue(), thumb_filename
-    except Exception as e:
-        print(f"Error generating thumbnail: {e}")
-        return None
+class ObjectCache:
+    """Size-bounded LRU cache of MinIO objects in a local directory.
 
+    Entries are keyed by bucket, object name and a version string chosen by
+    the caller (for example a content hash), so a changed object gets a new
+    entry and the stale one ages out. The least recently used files are
+    deleted once the total size passes `max_bytes`. Recency is kept in file
+    modification times, so the cache survives restarts.
+    """
 
-def upload_thumbnail(
-    client: Minio, bucket: str, thumb_data: bytes, thumb_filename: str
-) -> str:
-    """Upload a thumbnail to MinIO and return the path."""
-    client.put_object(
-        bucket,
-        thumb_filename,
-        io.BytesIO(thumb_data),
-        len(thumb_data),
-        content_type="image/jpeg",
-    )
-    return thumb_filename
+    def __init__(self, client: Minio, directory: str, max_bytes: int):
+        self.client = client
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Larger objects would push most of the cache out; stream them instead
+        self.max_object_bytes = max_bytes // 4
+        self._entries = OrderedDict()  # file path -> size, oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.bypassed = self.evictions = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Newer partial downloads may belong to another process sharing the
+        # directory; older ones were cut off by a restart
+        stale_tmp = time.time() - STALE_DOWNLOAD_SECONDS
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if not name.endswith(".tmp"):
+                        files.append((stat.st_mtime, path, stat.st_size))
+                    elif stat.st_mtime < stale_tmp:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._bytes += size
+        self._evict()
+
+    def _file(self, bucket: str, object_name: str, version: str) -> str:
+        key = hashlib.sha1(f"{bucket}/{object_name}@{version}".encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _download(self, bucket: str, object_name: str, path: str) -> bool:
+        """Download an object to `path`; False if it is too large to keep."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                response = self.client.get_object(bucket, object_name)
+                try:
+                    written = 0
+                    for chunk in response.stream(1024 * 1024):
+                        written += len(chunk)
+                        if written > self.max_object_bytes:
+                            break
+                        f.write(chunk)
+                finally:
+                    response.close()
+                    response.release_conn()
+            if written > self.max_object_bytes:
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return True
+
+    def open(self, bucket: str, object_name: str, version: str = "", size: int = None):
+        """Open an object's cached copy for reading, downloading it on a miss.
+
+        Returns None when the cache is disabled or the object is too large to
+        cache, whether known from `size` or found while downloading; the
+        caller then reads it from MinIO. The file is opened before it can be
+        evicted, so it stays readable until the caller closes it.
+        """
+        if not self.max_bytes or (size is not None and size > self.max_object_bytes):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        path = self._file(bucket, object_name, version)
+        with self._lock:
+            if path in self._entries:
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    self._bytes -= self._entries.pop(path)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(path)
+                    os.utime(path)
+                    return f
+            self.misses += 1
+
+        if not self._download(bucket, object_name, path):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        with self._lock:
+            f = open(path, "rb")
+            size = os.fstat(f.fileno()).st_size
+            self._bytes += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._evict()
+        return f
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
 
 
 # Global client instance
 minio_client = get_minio_client()
 ensure_buckets(minio_client)
+
+_object_cache = None
+_object_cache_lock = threading.Lock()
+
+
+def get_object_cache() -> ObjectCache:
+    """The media object cache, created on first use.
+
+    Only the API serves media, so worker processes that import this module
+    never scan or clean the cache directory.
+    """
+    global _object_cache
+    with _object_cache_lock:
+        if _object_cache is None:
+            _object_cache = ObjectCache(
+                minio_client,
+                os.getenv("MEDIA_CACHE_DIR", "")
+                or os.path.join(tempfile.gettempdir(), "yggdrasil-media-cache"),
+                OBJECT_CACHE_SIZE,
+            )
+        return _object_cache
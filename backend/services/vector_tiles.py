@@ -0,0 +1,285 @@
+"""Mapbox Vector Tiles of map events.
+
+Tiles follow the slippy-map z/x/y scheme and the Mapbox Vector Tile 2.1
+format, so they can be drawn with Leaflet.VectorGrid or MapLibre. Below
+DETAIL_ZOOM a tile has a "clusters" layer: events grouped into 16px grid
+cells, with the event count and a count per event type. From DETAIL_ZOOM up
+it has an "events" layer with one point per event and its id, type, year,
+person_id and family_id.
+
+Encoded tiles are written to MAP_TILE_CACHE_DIR under the current data
+version (see services/map_tiles.py), so any event or place change moves
+requests to a fresh directory. Directories of older versions are deleted
+once nobody has used them for STALE_VERSION_SECONDS, since a request that
+read the version just before a change may still be writing there. Low zoom
+levels are generated in bulk by `prewarm_tiles` at startup and after each
+geocoding job.
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import Integer, cast, func, select, true
+from sqlalchemy.orm import Session
+
+from models import Event, Place
+from services.map_tiles import (
+    DETAIL_ZOOM,
+    MAX_LATITUDE,
+    MAX_ZOOM,
+    cluster_tiles,
+    data_version,
+    event_filters,
+    event_name_columns,
+    tiles_bounds,
+)
+
+EXTENT = 4096
+# Cluster cell size in 256px tile pixels, 16 x 16 cells per tile
+CELL_SIZE = 16
+# Events encoded per detail tile, lowest IDs first
+MAX_TILE_EVENTS = 5000
+PREWARM_ZOOM = int(os.getenv("MAP_TILE_PREWARM_ZOOM", "4"))
+STALE_VERSION_SECONDS = 300
+
+MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+# Geometry command for a single point: MoveTo with a count of 1
+MOVE_TO_ONE = (1 << 3) | 1
+POINT = 1
+
+
+def _cache_dir() -> str:
+    return os.getenv("MAP_TILE_CACHE_DIR", "") or os.path.join(
+        tempfile.gettempdir(), "yggdrasil-tiles"
+    )
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field: int, values) -> bytes:
+    return _bytes_field(field, b"".join(_varint(v) for v in values))
+
+
+def _value(value) -> bytes:
+    """Encode a Value message (string, or unsigned / signed integer)."""
+    if isinstance(value, str):
+        return _bytes_field(1, value.encode())
+    if value >= 0:
+        return _key(5, 0) + _varint(value)
+    return _key(6, 0) + _varint(_zigzag(value))
+
+
+class Layer:
+    """A vector tile layer of point features."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._keys = {}
+        self._values = {}
+        self._features = []
+
+    def add_point(self, x: int, y: int, properties: dict, feature_id=None) -> None:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self._keys.setdefault(key, len(self._keys)))
+            tags.append(self._values.setdefault((type(value), value), len(self._values)))
+        x = min(EXTENT - 1, max(0, x))
+        y = min(EXTENT - 1, max(0, y))
+        feature = b""
+        if feature_id is not None:
+            feature += _key(1, 0) + _varint(feature_id)
+        feature += _packed(2, tags)
+        feature += _key(3, 0) + _varint(POINT)
+        feature += _packed(4, [MOVE_TO_ONE, _zigzag(x), _zigzag(y)])
+        self._features.append(feature)
+
+    def __len__(self):
+        return len(self._features)
+
+    def encode(self) -> bytes:
+        layer = _key(15, 0) + _varint(2) + _bytes_field(1, self.name.encode())
+        layer += b"".join(_bytes_field(2, f) for f in self._features)
+        layer += b"".join(_bytes_field(3, k.encode()) for k in self._keys)
+        layer += b"".join(_bytes_field(4, _value(v)) for _, v in self._values)
+        layer += _key(5, 0) + _varint(EXTENT)
+        return layer
+
+
+def encode_tile(layers) -> bytes:
+    """Encode non-empty layers as a Tile message."""
+    return b"".join(_bytes_field(3, layer.encode()) for layer in layers if len(layer))
+
+
+def _tile_point(lat: float, lng: float, zoom: int, x: int, y: int):
+    """Position of a coordinate inside tile (x, y), in tile extent units."""
+    scale = EXTENT * 2 ** zoom
+    lat = math.radians(min(MAX_LATITUDE, max(-MAX_LATITUDE, lat)))
+    px = (lng + 180.0) / 360.0 * scale
+    py = (1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * scale
+    return int(px - x * EXTENT), int(py - y * EXTENT)
+
+
+def _cluster_layer(clusters, zoom: int, x: int, y: int) -> Layer:
+    layer = Layer("clusters")
+    for cluster in clusters:
+        px, py = _tile_point(cluster["lat"], cluster["lng"], zoom, x, y)
+        layer.add_point(px, py, {"count": cluster["count"], **cluster["types"]})
+    return layer
+
+
+def _event_layer(db: Session, zoom: int, x: int, y: int) -> Layer:
+    person, family = event_name_columns()
+    rows = db.execute(
+        select(
+            Event.id,
+            Event.event_type,
+            cast(func.extract("year", Event.event_date), Integer).label("year"),
+            Place.latitude,
+            Place.longitude,
+            person.c.person_id,
+            family.c.family_id,
+        )
+        .select_from(Event)
+        .join(Place, Place.id == Event.place_id)
+        .outerjoin(person, true())
+        .outerjoin(family, true())
+        .where(*event_filters(None, None, None), *tiles_bounds([(x, y)], zoom))
+        .order_by(Event.id)
+        .limit(MAX_TILE_EVENTS)
+    ).all()
+
+    layer = Layer("events")
+    for row in rows:
+        px, py = _tile_point(row.latitude, row.longitude, zoom, x, y)
+        # Points on the far edge belong to the neighbouring tile
+        if 0 <= px < EXTENT and 0 <= py < EXTENT:
+            layer.add_point(
+                px,
+                py,
+                {
+                    "type": row.event_type,
+                    "year": row.year,
+                    "person_id": row.person_id,
+                    "family_id": row.family_id,
+                },
+                feature_id=row.id,
+            )
+    return layer
+
+
+def version_tag(db: Session) -> str:
+    """The current data version, used as directory name and ETag."""
+    return str(data_version(db))
+
+
+def _remove_old_versions(root: str, current: int) -> None:
+    """Delete directories of older versions not used for a while."""
+    cutoff = time.time() - STALE_VERSION_SECONDS
+    for name in os.listdir(root):
+        if not name.isdigit() or int(name) >= current:
+            continue
+        path = os.path.join(root, name)
+        try:
+            if os.stat(path).st_mtime > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _version_dir(version: str) -> str:
+    """Directory of a data version, marked as used.
+
+    Creating a new one removes the unused directories of older versions.
+    """
+    root = _cache_dir()
+    path = os.path.join(root, version)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(path, exist_ok=True)
+        _remove_old_versions(root, int(version))
+    return path
+
+
+def _write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def get_tile(db: Session, zoom: int, x: int, y: int, version: str) -> bytes:
+    """Return an encoded tile from the disk cache, generating it if needed.
+
+    Raises ValueError for tile coordinates outside the zoom level.
+    """
+    if not 0 <= zoom <= MAX_ZOOM or not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+        raise ValueError("Tile coordinates out of range")
+    path = os.path.join(_version_dir(version), str(zoom), str(x), f"{y}.mvt")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    if zoom >= DETAIL_ZOOM:
+        layer = _event_layer(db, zoom, x, y)
+    else:
+        clusters = cluster_tiles(
+            db, [(x, y)], zoom, event_filters(None, None, None), CELL_SIZE
+        )
+        layer = _cluster_layer(clusters[(x, y)], zoom, x, y)
+    data = encode_tile([layer])
+    _write(path, data)
+    return data
+
+
+def prewarm_tiles(db: Session, max_zoom: int = PREWARM_ZOOM) -> int:
+    """Generate every tile up to `max_zoom` with one query per zoom level.
+
+    Returns the number of tiles written.
+    """
+    max_zoom = min(max_zoom, DETAIL_ZOOM - 1)
+    version = version_tag(db)
+    root = _version_dir(version)
+    written = 0
+    for zoom in range(max_zoom + 1):
+        tiles = [(x, y) for x in range(2 ** zoom) for y in range(2 ** zoom)]
+        clusters = cluster_tiles(
+            db, tiles, zoom, event_filters(None, None, None), CELL_SIZE
+        )
+        for (x, y), items in clusters.items():
+            data = encode_tile([_cluster_layer(items, zoom, x, y)])
+            _write(os.path.join(root, str(zoom), str(x), f"{y}.mvt"), data)
+            written += 1
+    return written
@@ -1,5 +1,9 @@
 """Utility functions and helpers."""
 
-from .helpers import get_male_birth_year
+from .pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
 
-__all__ = ["get_male_birth_year"]
+__all__ = [
+    "NEXT_CURSOR_HEADER",
+    "encode_cursor",
+    "decode_cursor",
+]
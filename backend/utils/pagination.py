@@ -0,0 +1,36 @@
+"""Opaque keyset-pagination cursors shared by list endpoints."""
+
+import base64
+import json
+
+# Response header carrying the cursor for the next page of a list endpoint
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of the last row on a page."""
+    raw = json.dumps(list(values)).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    """Decode a cursor produced by encode_cursor.
+
+    `types` gives the expected type of each value, or a tuple of types as
+    for isinstance (with type(None) for values that may be null). Raises
+    ValueError if the cursor is malformed or a value has the wrong type.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError("Invalid cursor")
+    for value, expected in zip(values, types):
+        expected = expected if isinstance(expected, tuple) else (expected,)
+        # JSON booleans would otherwise pass as integers
+        if not isinstance(value, expected) or (
+            isinstance(value, bool) and bool not in expected
+        ):
+            raise ValueError("Invalid cursor")
+    return values
@@ -109,7 +109,7 @@ function People() {
                 <td style={{ padding: '8px', width: '50px' }}>
                   {p.profile_image_id ? (
                     <img
-                      src={`http://localhost:8001/api/media/${p.profile_image_id}/file`}
+                      src={`http://localhost:8001/api/media/${p.profile_image_id}/image?w=80&h=80&fit=cover`}
                       alt={`${p.first_name} ${p.last_name}`}
                       loading="lazy"
                       decoding="async"
@@ -172,7 +172,7 @@ function PersonForm() {
             >
               {profileImageId ? (
                 <img
-                  src={`http://localhost:8001/api/media/${profileImageId}/file`}
+                  src={`http://localhost:8001/api/media/${profileImageId}/image?w=240&h=240&fit=cover`}
                   alt="Profile"
                   style={{ width: '100%', height: '100%', objectFit: 'cover' }}
                 />
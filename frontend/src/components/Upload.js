@@ -68,13 +68,23 @@ function Upload() {
     setGeocodeResults(null);
 
     try {
-      const res = await axios.post('http://localhost:8001/api/map/places/geocode', { force });
-      setGeocodeResults(res.data.results);
-      setGeocodeStats(res.data.stats);
-      setToast({
-        message: `Geocoding complete! ${res.data.results.success} places found, ${res.data.results.failed} failed.`,
-        type: 'success'
-      });
+      // Geocoding runs as a background job; poll it until it finishes
+      let { data: job } = await axios.post('http://localhost:8001/api/map/places/geocode', { force });
+      while (job.running) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        ({ data: job } = await axios.get(`http://localhost:8001/api/map/places/geocode/jobs/${job.id}`));
+      }
+      const stats = await axios.get('http://localhost:8001/api/map/places/stats');
+      setGeocodeResults(job);
+      setGeocodeStats(stats.data);
+      if (job.status === 'failed') {
+        setToast({ message: job.error || 'Error during geocoding', type: 'error' });
+      } else {
+        setToast({
+          message: `Geocoding complete! ${job.success} places found, ${job.failed} failed.`,
+          type: 'success'
+        });
+      }
     } catch (err) {
       if (err.response?.status === 409) {
         setToast({ message: 'Geocoding already in progress', type: 'error' });
@@ -887,7 +897,7 @@ function Upload() {
                 Geocoding in progress... This may take several minutes.
               </p>
               <p style={{ margin: '10px 0 0 0', fontSize: '12px', color: '#666' }}>
-                Processing at ~1 place per second to respect API rate limits.
+                Places missing from the local gazetteer are looked up online within each provider's rate limit.
               </p>
             </div>
           )}
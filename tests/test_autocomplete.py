@@ -0,0 +1,85 @@
+import uuid
+from datetime import date
+
+import requests
+
+from database import SessionLocal
+from models import Event, Individual
+from services import autocomplete
+
+BASE_URL = "http://localhost:8001/api"
+
+
+def test_autocomplete_people_prefix():
+    """A newly created person is returned for a prefix of their names."""
+    resp = requests.post(
+        f"{BASE_URL}/people",
+        json={
+            "first_name": "Zebediah",
+            "last_name": "Quillfeather",
+            "sex": "M",
+            "birth_date": "1901-02-03",
+            "birth_place": "Qwerton, Zedshire",
+        },
+    )
+    assert resp.status_code == 200
+    person_id = resp.json()["id"]
+
+    results = requests.get(
+        f"{BASE_URL}/autocomplete/people", params={"q": "zeb quill"}
+    ).json()
+    match = next(r for r in results if r["id"] == person_id)
+    assert match["birth_year"] == 1901
+
+    # Renames are picked up without a full rebuild
+    requests.put(f"{BASE_URL}/people/{person_id}", json={"last_name": "Quixley"})
+    results = requests.get(
+        f"{BASE_URL}/autocomplete/people", params={"q": "quix"}
+    ).json()
+    assert any(r["id"] == person_id for r in results)
+
+
+def test_autocomplete_places_prefix():
+    """Event places are searchable by any word prefix."""
+    results = requests.get(
+        f"{BASE_URL}/autocomplete/places", params={"q": "zedsh"}
+    ).json()
+    assert any(r["name"] == "Qwerton, Zedshire" for r in results)
+
+
+def test_autocomplete_requires_query():
+    """An empty query is rejected."""
+    resp = requests.get(f"{BASE_URL}/autocomplete/people", params={"q": ""})
+    assert resp.status_code == 422
+
+
+def test_prefix_search_ranks_the_whole_prefix_range():
+    """The best match is found however many entries sort before it."""
+    index = autocomplete.PrefixIndex()
+    index.load((i, [f"jo{i:05d}"], {"id": i}) for i in range(5000))
+
+    results = index.search("jo", 3, lambda r, exact: -r["id"])
+    assert [r["id"] for r in results] == [4999, 4998, 4997]
+
+
+def test_deleted_birth_clears_birth_year():
+    """Deleting a birth event refreshes the person's birth year."""
+    surname = f"Unborn{uuid.uuid4().hex[:8]}"
+    db = SessionLocal()
+    try:
+        person = Individual(first_name="Ida", last_name=surname)
+        birth = Event(event_type="BIRT", event_date=date(1880, 5, 1), individuals=[person])
+        db.add_all([person, birth])
+        db.commit()
+        (match,) = autocomplete.search_people(db, surname)
+        assert match["birth_year"] == 1880
+
+        db.delete(birth)
+        db.commit()
+        (match,) = autocomplete.search_people(db, surname)
+        assert match["birth_year"] is None
+    finally:
+        db.rollback()
+        db.delete(db.get(Individual, person.id))
+        db.commit()
+        db.close()
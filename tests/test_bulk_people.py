@@ -0,0 +1,72 @@
+import requests
+
+BASE_URL = "http://localhost:8001/api"
+
+
+def test_bulk_create_family_with_temp_ids():
+    """People and a family referencing them by temp_id are created together."""
+    payload = {
+        "people": [
+            {"temp_id": "dad", "first_name": "Barnaby", "last_name": "Thistlewood",
+             "sex": "M", "birth_date": "1870-04-02", "birth_place": "Thistle Vale"},
+            {"temp_id": "mum", "first_name": "Clementine", "last_name": "Thistlewood",
+             "sex": "F", "birth_date": "1872-09-30"},
+            {"temp_id": "kid", "first_name": "Percival", "last_name": "Thistlewood",
+             "sex": "M", "birth_date": "1899-01-15", "death_date": "1960-06-01",
+             "death_place": "Thistle Vale"},
+        ],
+        "families": [
+            {"temp_id": "fam", "spouse1": "dad", "spouse2": "mum",
+             "children": ["kid"], "marriage_date": "1895-05-05",
+             "marriage_place": "Thistle Vale"},
+        ],
+    }
+    resp = requests.post(f"{BASE_URL}/people/bulk", json=payload)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert set(data["people"]) == {"dad", "mum", "kid"}
+    assert data["created"] == 3
+    assert data["events_created"] == 5
+
+    kid = requests.get(f"{BASE_URL}/people/{data['people']['kid']}").json()
+    assert {p["id"] for p in kid["parents"]} == {data["people"]["dad"], data["people"]["mum"]}
+    assert kid["deaths"][0]["place"] == "Thistle Vale"
+
+    dad = requests.get(f"{BASE_URL}/people/{data['people']['dad']}").json()
+    assert dad["marriages"][0]["date"] == "1895-05-05"
+
+
+def test_bulk_update_existing_person():
+    """Existing people are updated in place without duplicating events."""
+    created = requests.post(
+        f"{BASE_URL}/people/bulk",
+        json={"people": [{"temp_id": "p", "first_name": "Mabel",
+                          "last_name": "Quince", "birth_place": "Old Quince"}]},
+    ).json()
+    person_id = created["people"]["p"]
+
+    resp = requests.post(
+        f"{BASE_URL}/people/bulk",
+        json={"people": [{"id": person_id, "last_name": "Quincey",
+                          "birth_date": "1911-11-11"}]},
+    )
+    assert resp.status_code == 200
+    person = requests.get(f"{BASE_URL}/people/{person_id}").json()
+    assert person["last_name"] == "Quincey"
+    assert person["births"] == [{"date": "1911-11-11", "place": "Old Quince"}]
+
+
+def test_bulk_unknown_temp_id_rolls_back():
+    """An unresolvable reference rejects the whole request."""
+    resp = requests.post(
+        f"{BASE_URL}/people/bulk",
+        json={
+            "people": [{"temp_id": "a", "first_name": "Orphaned", "last_name": "Rollback"}],
+            "families": [{"spouse1": "a", "children": ["nobody"]}],
+        },
+    )
+    assert resp.status_code == 400
+    results = requests.get(
+        f"{BASE_URL}/autocomplete/people", params={"q": "orphaned rollback"}
+    ).json()
+    assert results == []
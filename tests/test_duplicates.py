@@ -0,0 +1,170 @@
+import time
+
+import requests
+
+from database import SessionLocal
+from models import DuplicateScan
+from routers.duplicates import fail_interrupted_scans
+from services import duplicates
+
+BASE_URL = "http://localhost:8001/api"
+
+
+def wait_for_scan(scan_id, timeout=60):
+    """Poll a duplicate scan until it leaves the running state."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        scan = requests.get(f"{BASE_URL}/duplicates/scans/{scan_id}").json()
+        if scan["status"] != "running":
+            return scan
+        time.sleep(0.5)
+    raise AssertionError(f"Scan {scan_id} did not finish")
+
+
+def test_duplicate_scan_finds_pair():
+    """Two records for the same person are reported as a candidate pair."""
+    ids = []
+    for place in ["Little Snoring, Norfolk", "Little Snoring, Norfolk, England"]:
+        resp = requests.post(
+            f"{BASE_URL}/people",
+            json={
+                "first_name": "Ignatius",
+                "last_name": "Pennyworth",
+                "sex": "M",
+                "birth_date": "1843-11-02",
+                "birth_place": place,
+            },
+        )
+        ids.append(resp.json()["id"])
+
+    resp = requests.post(f"{BASE_URL}/duplicates/scan", json={"incremental": False})
+    assert resp.status_code == 200
+    scan = wait_for_scan(resp.json()["id"])
+    assert scan["status"] == "completed"
+
+    candidates = requests.get(
+        f"{BASE_URL}/duplicates", params={"limit": 500}
+    ).json()
+    pair = next(
+        c for c in candidates
+        if {c["individual1"]["id"], c["individual2"]["id"]} == set(ids)
+    )
+    assert pair["score"] >= 0.75
+    assert pair["individual1"]["birth_year"] == 1843
+
+
+def test_dismissed_pair_not_resuggested():
+    """A dismissed pair stays dismissed after an incremental rescan."""
+    candidates = requests.get(f"{BASE_URL}/duplicates").json()
+    assert candidates
+    candidate = candidates[0]
+    resp = requests.post(f"{BASE_URL}/duplicates/{candidate['id']}/dismiss")
+    assert resp.status_code == 200
+
+    resp = requests.post(f"{BASE_URL}/duplicates/scan", json={"incremental": True})
+    wait_for_scan(resp.json()["id"])
+
+    pending = requests.get(f"{BASE_URL}/duplicates", params={"limit": 500}).json()
+    assert candidate["id"] not in {c["id"] for c in pending}
+    pairs = {(c["individual1"]["id"], c["individual2"]["id"]) for c in pending}
+    assert (
+        candidate["individual1"]["id"], candidate["individual2"]["id"]
+    ) not in pairs
+
+
+def test_merge_people_moves_references():
+    """Merging moves the source's events, parents and children to the target."""
+    people = {}
+    for key, first in [("target", "Horatio"), ("source", "Horatio"),
+                       ("parent", "Augustus"), ("child", "Cornelius")]:
+        resp = requests.post(
+            f"{BASE_URL}/people",
+            json={"first_name": first, "last_name": "Fumblethorpe", "sex": "M"},
+        )
+        people[key] = resp.json()["id"]
+    requests.put(
+        f"{BASE_URL}/people/{people['source']}",
+        json={"death_date": "1901-01-01", "death_place": "Fumblethorpe Hall"},
+    )
+    requests.post(
+        f"{BASE_URL}/people/{people['source']}/add-parent",
+        json={"related_person_id": people["parent"]},
+    )
+    requests.post(
+        f"{BASE_URL}/people/{people['source']}/add-child",
+        json={"related_person_id": people["child"]},
+    )
+
+    resp = requests.post(
+        f"{BASE_URL}/people/merge",
+        json={"merges": [{"target_id": people["target"], "source_ids": [people["source"]]}]},
+    )
+    assert resp.status_code == 200
+    assert resp.json()["merged"] == 1
+
+    assert requests.get(f"{BASE_URL}/people/{people['source']}").status_code == 404
+    target = requests.get(f"{BASE_URL}/people/{people['target']}").json()
+    assert [d["place"] for d in target["deaths"]] == ["Fumblethorpe Hall"]
+    assert people["parent"] in [p["id"] for p in target["parents"]]
+    assert people["child"] in [c["id"] for c in target["children"]]
+
+
+def test_merge_rejects_invalid_requests():
+    """Self-merges and unknown people are rejected before anything changes."""
+    resp = requests.post(
+        f"{BASE_URL}/people/merge",
+        json={"merges": [{"target_id": 1, "source_ids": [1]}]},
+    )
+    assert resp.status_code == 400
+    resp = requests.post(
+        f"{BASE_URL}/people/merge",
+        json={"merges": [{"target_id": 1, "source_ids": [999999999]}]},
+    )
+    assert resp.status_code == 404
+
+
+def test_merge_rejects_spouses_of_one_family():
+    """Merging a couple would leave a family married to itself."""
+    resp = requests.post(f"{BASE_URL}/people/bulk", json={
+        "people": [
+            {"temp_id": "h", "first_name": "Hal", "last_name": "Wedlocke", "sex": "M"},
+            {"temp_id": "w", "first_name": "Hal", "last_name": "Wedlocke", "sex": "F"},
+        ],
+        "families": [{"spouse1": "h", "spouse2": "w"}],
+    })
+    people = resp.json()["people"]
+
+    resp = requests.post(
+        f"{BASE_URL}/people/merge",
+        json={"merges": [{"target_id": people["h"], "source_ids": [people["w"]]}]},
+    )
+    assert resp.status_code == 400
+    assert requests.get(f"{BASE_URL}/people/{people['w']}").status_code == 200
+
+
+def test_undated_comparisons_capped_per_person(monkeypatch):
+    """Undated namesakes take part in at most the cap of pairs, on both sides."""
+    monkeypatch.setattr(duplicates, "MAX_UNDATED_COMPARISONS", 3)
+    block = [(i, "john", "smith", "M", None) for i in range(10)]
+
+    pairs = list(duplicates._candidate_pairs(block))
+    counts = [sum(i in pair for pair in pairs) for i in range(len(block))]
+    assert max(counts) == 3
+    # People past the others' caps are still paired with each other
+    assert (8, 9) in pairs
+
+
+def test_interrupted_scan_failed_at_startup():
+    """A scan left running by a stopped server no longer blocks new scans."""
+    db = SessionLocal()
+    try:
+        scan = DuplicateScan(mode="full", status="running")
+        db.add(scan)
+        db.commit()
+
+        fail_interrupted_scans()
+        db.refresh(scan)
+        assert scan.status == "failed"
+        assert scan.finished_at is not None
+    finally:
+        db.close()
@@ -0,0 +1,86 @@
+import base64
+import json
+import uuid
+
+import requests
+
+BASE_URL = "http://localhost:8001/api"
+
+
+def _create_people(surname, births):
+    people = [
+        {"temp_id": f"p{i}", "first_name": f"Person{i}", "last_name": surname,
+         "sex": "M", "birth_date": birth_date, "birth_place": place}
+        for i, (birth_date, place) in enumerate(births)
+    ]
+    resp = requests.post(f"{BASE_URL}/people/bulk", json={"people": people})
+    assert resp.status_code == 200
+    return resp.json()["people"]
+
+
+def test_events_filtered_by_place_and_paged():
+    """Events are filtered by place words and paged in date order, undated last."""
+    # Unique names, so earlier runs against the same server don't match
+    tag = uuid.uuid4().hex[:8]
+    surname = f"Oddington{tag}"
+    _create_people(surname, [
+        ("1820-03-01", f"Little Wobbleton {tag}, Kent"),
+        (None, f"Little Wobbleton {tag}, Kent"),
+        ("1810-06-15", f"Little Wobbleton {tag}, Kent"),
+        ("1815-01-01", f"Great Wobbleton {tag}, Kent"),
+    ])
+    seen = []
+    cursor = None
+    while True:
+        params = {"type": "birt", "place": f"little wobbleton {tag}", "limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        resp = requests.get(f"{BASE_URL}/events", params=params)
+        assert resp.status_code == 200
+        seen.extend(resp.json())
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert [e["date"] for e in seen] == ["1810-06-15", "1820-03-01", None]
+    assert seen[0]["individuals"][0]["name"] == f"Person2 {surname}"
+    assert all(e["event_type"] == "BIRT" for e in seen)
+
+
+def test_events_filtered_by_person_and_date_range():
+    """A person's own events and their marriages are found by person_id."""
+    payload = {
+        "people": [
+            {"temp_id": "h", "first_name": "Ambrose", "last_name": "Pettigrew",
+             "sex": "M", "birth_date": "1830-01-01", "death_date": "1890-01-01"},
+            {"temp_id": "w", "first_name": "Ottoline", "last_name": "Pettigrew",
+             "sex": "F"},
+        ],
+        "families": [{"spouse1": "h", "spouse2": "w", "marriage_date": "1855-07-07"}],
+    }
+    ids = requests.post(f"{BASE_URL}/people/bulk", json=payload).json()["people"]
+
+    events = requests.get(f"{BASE_URL}/events",
+                          params={"person_id": ids["h"]}).json()
+    assert [e["event_type"] for e in events] == ["BIRT", "MARR", "DEAT"]
+    marriage = events[1]
+    assert marriage["families"][0]["spouse2"]["name"] == "Ottoline Pettigrew"
+
+    events = requests.get(f"{BASE_URL}/events", params={
+        "person_id": ids["h"], "date_from": "1850-01-01", "date_to": "1860-01-01",
+    }).json()
+    assert [e["event_type"] for e in events] == ["MARR"]
+
+    marriages = requests.get(f"{BASE_URL}/marriages").json()
+    assert any(m["family"] == "Ambrose Pettigrew and Ottoline Pettigrew"
+               and m["male_birth_year"] == 1830 for m in marriages)
+
+
+def test_events_invalid_cursor():
+    resp = requests.get(f"{BASE_URL}/events", params={"cursor": "bogus"})
+    assert resp.status_code == 400
+
+    # Well-formed cursors with values of the wrong type are rejected too
+    for values in ([1800, 1], ["1800-01-01", "x"], [None, True], [{}, 1]):
+        cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+        resp = requests.get(f"{BASE_URL}/events", params={"cursor": cursor})
+        assert resp.status_code == 400, values
@@ -0,0 +1,110 @@
+import json
+import uuid
+
+import requests
+
+BASE_URL = "http://localhost:8001/api"
+
+
+def _create_families(surname, years):
+    """Create one couple per birth year for the husband, via the bulk endpoint.
+
+    Returns the surname made unique, so earlier runs against the same server
+    don't match it.
+    """
+    surname = f"{surname}{uuid.uuid4().hex[:8]}"
+    people = []
+    families = []
+    for i, year in enumerate(years):
+        people.append({"temp_id": f"h{i}", "first_name": f"Husband{i}",
+                       "last_name": surname, "sex": "M",
+                       "birth_date": f"{year}-01-01" if year else None})
+        people.append({"temp_id": f"w{i}", "first_name": f"Wife{i}",
+                       "last_name": surname, "sex": "F"})
+        people.append({"temp_id": f"c{i}", "first_name": f"Child{i}",
+                       "last_name": surname})
+        families.append({"spouse1": f"w{i}", "spouse2": f"h{i}",
+                         "children": [f"c{i}"]})
+    resp = requests.post(f"{BASE_URL}/people/bulk",
+                         json={"people": people, "families": families})
+    assert resp.status_code == 200
+    return surname
+
+
+def test_families_sorted_and_filtered_by_surname():
+    """Families are sorted by the husband's birth year, newest first, then undated."""
+    surname = _create_families("Fennimore", [1850, None, 1900, 1875])
+    resp = requests.get(f"{BASE_URL}/families", params={"surname": surname[:-2].lower()})
+    assert resp.status_code == 200
+    families = resp.json()
+    assert [f["male_birth_year"] for f in families] == [1900, 1875, 1850, None]
+    assert all(f["children_count"] == 1 for f in families)
+    assert families[0]["spouse2_name"] == f"Husband2 {surname}"
+
+
+def test_families_cursor_pagination_and_year_filter():
+    """Pages chained by the X-Next-Cursor header cover every family once."""
+    surname = _create_families("Gallowglass", [1801, 1802, 1803, None, None])
+    seen = []
+    cursor = None
+    while True:
+        params = {"surname": surname, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        resp = requests.get(f"{BASE_URL}/families", params=params)
+        assert resp.status_code == 200
+        page = resp.json()
+        assert len(page) <= 2
+        seen.extend(f["male_birth_year"] for f in page)
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [1803, 1802, 1801, None, None]
+
+    resp = requests.get(f"{BASE_URL}/families",
+                        params={"surname": surname, "year_from": 1802,
+                                "year_to": 1802})
+    assert [f["male_birth_year"] for f in resp.json()] == [1802]
+
+    resp = requests.get(f"{BASE_URL}/families", params={"cursor": "not-a-cursor"})
+    assert resp.status_code == 400
+
+
+def test_family_media_with_tags_and_paging():
+    """Media tagged to any member is listed with its tagged people and can be paged."""
+    payload = {
+        "people": [
+            {"temp_id": "h", "first_name": "Horatio", "last_name": "Quill", "sex": "M"},
+            {"temp_id": "w", "first_name": "Wilhelmina", "last_name": "Quill", "sex": "F"},
+            {"temp_id": "c", "first_name": "Cornelius", "last_name": "Quill"},
+            {"temp_id": "o", "first_name": "Outsider", "last_name": "Pike"},
+        ],
+        "families": [{"temp_id": "f", "spouse1": "h", "spouse2": "w", "children": ["c"]}],
+    }
+    created = requests.post(f"{BASE_URL}/people/bulk", json=payload).json()
+    ids = created["people"]
+    family_id = created["families"]["f"]
+
+    tags = [[ids["h"], ids["o"]], [ids["c"]], [ids["w"], ids["c"]], [ids["o"]]]
+    for i, individual_ids in enumerate(tags):
+        resp = requests.post(
+            f"{BASE_URL}/media/upload",
+            files={"file": (f"quill_{i}.txt", b"family papers", "text/plain")},
+            data={"metadata": json.dumps({"individual_ids": individual_ids})},
+        )
+        assert resp.status_code == 200
+
+    family = requests.get(f"{BASE_URL}/families/{family_id}").json()
+    assert [m["filename"] for m in family["media"]] == [
+        "quill_0.txt", "quill_1.txt", "quill_2.txt"]
+    assert [p["name"] for p in family["media"][0]["tagged_individuals"]] == [
+        "Horatio Quill", "Outsider Pike"]
+    assert family["media_next_cursor"] is None
+
+    page = requests.get(f"{BASE_URL}/families/{family_id}",
+                        params={"media_limit": 2}).json()
+    assert [m["filename"] for m in page["media"]] == ["quill_0.txt", "quill_1.txt"]
+    page = requests.get(f"{BASE_URL}/families/{family_id}", params={
+        "media_limit": 2, "media_cursor": page["media_next_cursor"]}).json()
+    assert [m["filename"] for m in page["media"]] == ["quill_2.txt"]
+    assert page["media_next_cursor"] is None
@@ -0,0 +1,56 @@
+from services.gazetteer import GazetteerIndex, build_index
+
+# geonameid, name, asciiname, alternatenames, lat, lng, class, code,
+# country, cc2, admin1, admin2, admin3, admin4, population, elevation, dem,
+# timezone, modified
+ROWS = [
+    ("1", "France", "France", "", "46.0", "2.0", "A", "PCLI", "FR", "", "00", "", "66000000"),
+    ("2", "United States", "United States", "", "39.8", "-98.5", "A", "PCLI", "US", "", "00", "", "330000000"),
+    ("3", "Texas", "Texas", "", "31.2", "-99.3", "A", "ADM1", "US", "", "TX", "", "29000000"),
+    ("4", "Lamar County", "Lamar County", "", "33.7", "-95.6", "A", "ADM2", "US", "", "TX", "277", "50000"),
+    ("5", "Paris", "Paris", "Lutetia,Parigi", "48.85341", "2.3488", "P", "PPLC", "FR", "", "11", "75", "2138551"),
+    ("6", "Paris", "Paris", "", "33.66094", "-95.55551", "P", "PPLA2", "US", "", "TX", "277", "24782"),
+    ("7", "Zürich", "Zurich", "Zurigo,Цюрих", "47.36667", "8.55", "P", "PPLA", "CH", "", "ZH", "112", "341730"),
+]
+
+
+def _write_dump(path):
+    with open(path, "w", encoding="utf-8") as f:
+        for gid, name, ascii_name, alt, lat, lng, cls, code, cc, cc2, a1, a2, pop in ROWS:
+            row = [gid, name, ascii_name, alt, lat, lng, cls, code, cc, cc2, a1, a2,
+                   "", "", pop, "", "", "", "2024-01-01"]
+            f.write("\t".join(row) + "\n")
+
+
+def _index(tmp_path):
+    dump = tmp_path / "cities.txt"
+    _write_dump(dump)
+    counts = build_index(str(dump), str(tmp_path / "cities.idx"))
+    assert counts["records"] == len(ROWS)
+    return GazetteerIndex(str(tmp_path / "cities.idx"))
+
+
+def test_lookup_exact_and_alternate_names(tmp_path):
+    index = _index(tmp_path)
+    assert index.lookup("Zürich") == {"lat": 47.36667, "lng": 8.55}
+    assert index.lookup("zurich") == {"lat": 47.36667, "lng": 8.55}
+    # Latin-script alternate names are indexed, others are skipped
+    assert index.lookup("Zurigo") == {"lat": 47.36667, "lng": 8.55}
+    assert index.lookup("Цюрих") is None
+    assert index.lookup("Atlantis") is None
+
+
+def test_lookup_disambiguates_by_region(tmp_path):
+    index = _index(tmp_path)
+    france = {"lat": 48.85341, "lng": 2.3488}
+    texas = {"lat": 33.66094, "lng": -95.55551}
+    # Without context the larger place wins
+    assert index.lookup("Paris") == france
+    assert index.lookup("Paris, France") == france
+    assert index.lookup("Paris, USA") == texas
+    assert index.lookup("Paris, Lamar, Texas") == texas
+    assert index.lookup("Lutetia, France") == france
+    # Context that matches no candidate rules the name out
+    assert index.lookup("Paris, Germany") is None
+    # Unknown first parts fall through to the next part
+    assert index.lookup("Old Mill, Paris, Texas") == texas
@@ -0,0 +1,93 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import GeocodeCache, Place
+from services import geocoding
+from services.place_names import normalize_place_name
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setenv("GEOCODE_PROVIDERS", "nominatim:1,photon:1")
+    session = SessionLocal()
+    yield session
+    session.rollback()
+    session.close()
+
+
+def _place(db, name=None):
+    name = name or f"Testville {uuid.uuid4().hex[:8]}"
+    place = Place(
+        name=name, normalized_name=normalize_place_name(name), geocoded=0, event_count=1
+    )
+    db.add(place)
+    db.flush()
+    return place
+
+
+def _cache(db, place, provider, coords=None, expires_in=timedelta(days=30)):
+    db.add(GeocodeCache(
+        query=place.normalized_name,
+        provider=provider,
+        latitude=coords[0] if coords else None,
+        longitude=coords[1] if coords else None,
+        expires_at=None if coords else datetime.now(timezone.utc) + expires_in,
+    ))
+    db.flush()
+
+
+def _pending_ids(db):
+    return {row.id for row in db.execute(geocoding._pending_places(force=False))}
+
+
+def test_cached_location_geocodes_without_lookup(db):
+    place = _place(db)
+    _cache(db, place, "photon", (51.5, -0.12))
+
+    assert geocoding.apply_cached_results(db) >= 1
+    db.refresh(place)
+    assert (place.geocoded, place.latitude, place.longitude) == (1, 51.5, -0.12)
+
+
+def test_cached_miss_skips_place_only_for_every_provider(db):
+    place = _place(db)
+    _cache(db, place, "nominatim")
+
+    # Photon has not been asked yet, so the place is still looked up with it
+    pending = db.execute(
+        geocoding._pending_places(force=False).where(Place.id == place.id)
+    ).one()
+    assert pending.missed == ["nominatim"]
+
+    _cache(db, place, "photon")
+    assert place.id not in _pending_ids(db)
+    geocoding.apply_cached_results(db)
+    db.refresh(place)
+    assert place.geocoded == -1
+
+
+def test_expired_miss_is_retried(db):
+    place = _place(db)
+    for provider in ("nominatim", "photon"):
+        _cache(db, place, provider, expires_in=timedelta(days=-1))
+
+    assert place.id in _pending_ids(db)
+    geocoding.apply_cached_results(db)
+    db.refresh(place)
+    assert place.geocoded == 0
+    assert db.execute(
+        select(GeocodeCache.provider).where(GeocodeCache.query == place.normalized_name)
+    ).all()
+
+
+def test_geocoder_mode_accepts_former_name(monkeypatch):
+    monkeypatch.setenv("GEOCODER", "Nominatim")
+    assert geocoding._geocoder_mode() == "remote"
+
+    monkeypatch.setenv("GEOCODER", "nominatin")
+    with pytest.raises(ValueError):
+        geocoding._geocoder_mode()
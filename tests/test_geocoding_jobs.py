@@ -0,0 +1,155 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+import requests
+from sqlalchemy import delete, func, select
+
+from database import SessionLocal, engine
+from models import GeocodeCache, GeocodeJob, Place
+from services import geocoding
+from services.place_names import normalize_place_name
+
+BASE_URL = "http://localhost:8001/api"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setenv("GEOCODER", "remote")
+    monkeypatch.setenv("GEOCODE_PROVIDERS", "nominatim:50")
+    looked_up = []
+
+    async def fake_remote(client, name, place_name):
+        looked_up.append(place_name)
+        return {"lat": 10.0, "lng": 20.0}
+
+    monkeypatch.setattr(geocoding, "_geocode_remote", fake_remote)
+    session = SessionLocal()
+    session.looked_up = looked_up
+    session.created = {"places": [], "jobs": []}
+    yield session
+
+    session.rollback()
+    places, jobs = session.created["places"], session.created["jobs"]
+    keys = [p.normalized_name for p in places]
+    session.execute(delete(GeocodeCache).where(GeocodeCache.query.in_(keys)))
+    session.execute(delete(Place).where(Place.id.in_([p.id for p in places])))
+    session.execute(delete(GeocodeJob).where(GeocodeJob.id.in_([j.id for j in jobs])))
+    session.commit()
+    session.close()
+
+
+def _places(db, count):
+    tag = uuid.uuid4().hex[:8]
+    places = []
+    for i in range(count):
+        name = f"Jobtown {tag} {chr(97 + i)}"
+        places.append(Place(
+            name=name, normalized_name=normalize_place_name(name), geocoded=0, event_count=1
+        ))
+    db.add_all(places)
+    db.commit()
+    db.created["places"].extend(places)
+    return places
+
+
+def _job(db, last_place_id=None):
+    job = GeocodeJob(mode="pending", status="running", last_place_id=last_place_id)
+    db.add(job)
+    db.commit()
+    db.created["jobs"].append(job)
+    return job
+
+
+def test_token_bucket_limits_rate():
+    async def timings():
+        bucket = geocoding.TokenBucket(rate=20, burst=2)
+        start = time.monotonic()
+        stamps = []
+        for _ in range(6):
+            await bucket.acquire()
+            stamps.append(time.monotonic() - start)
+        return stamps
+
+    stamps = asyncio.run(timings())
+    # The burst is immediate, then one token every 1/20 s
+    assert stamps[1] < 0.02
+    assert stamps[-1] >= 0.19
+    assert stamps[-1] < 0.5
+
+
+def test_job_resumes_after_checkpoint(db):
+    first, second, third = _places(db, 3)
+    # As if a stopped process had checkpointed after the first place
+    job = _job(db, last_place_id=first.id)
+
+    assert geocoding.run_geocode_job(db, job.id) is True
+    assert db.looked_up == [second.name, third.name]
+
+    for place in (first, second, third):
+        db.refresh(place)
+    assert first.geocoded == 0
+    assert (second.geocoded, second.latitude, second.longitude) == (1, 10.0, 20.0)
+    assert third.geocoded == 1
+
+    status = requests.get(f"{BASE_URL}/map/places/geocode/jobs/{job.id}").json()
+    assert status["status"] == "completed"
+    assert status["running"] is False
+    assert status["remote"] == 2
+    assert status["success"] == 2
+    assert status["finished_at"] is not None
+    cached = db.execute(
+        select(func.count()).select_from(GeocodeCache)
+        .where(GeocodeCache.query.in_([second.normalized_name, third.normalized_name]))
+    ).scalar()
+    assert cached == 2
+
+
+def test_job_lock_excludes_other_runners(db):
+    (place,) = _places(db, 1)
+    job = _job(db, last_place_id=place.id - 1)
+
+    with engine.connect() as other:
+        assert other.execute(
+            select(func.pg_try_advisory_lock(geocoding.JOB_LOCK_KEY))
+        ).scalar()
+        try:
+            assert geocoding.geocoding_job_locked(db)
+            assert geocoding.run_geocode_job(db, job.id) is False
+            # The API refuses to start a second job as well
+            resp = requests.post(f"{BASE_URL}/map/places/geocode", json={})
+            assert resp.status_code == 409
+        finally:
+            other.execute(select(func.pg_advisory_unlock(geocoding.JOB_LOCK_KEY)))
+            other.commit()
+
+    db.refresh(job)
+    assert job.status == "running"
+    assert db.looked_up == []
+    assert geocoding.run_geocode_job(db, job.id) is True
+    assert db.looked_up == [place.name]
+
+
+def test_ancestors_are_placed_at_their_sub_places(db):
+    tag = uuid.uuid4().hex[:8]
+    country = Place(name=f"Jobland {tag}", normalized_name=f"jobland {tag}", geocoded=0)
+    db.add(country)
+    db.commit()
+    db.created["places"].append(country)
+    towns = [
+        Place(name=f"{name}, {country.name}", normalized_name=f"{name} {tag}",
+              ancestor_ids=[country.id], event_count=events,
+              latitude=lat, longitude=lng, geocoded=1)
+        for name, events, lat, lng in (("Ayr", 1, 10.0, 20.0), ("Bree", 3, 20.0, 40.0))
+    ]
+    db.add_all(towns)
+    db.commit()
+    db.created["places"].extend(towns)
+    job = _job(db, last_place_id=country.id - 1)
+
+    assert geocoding.run_geocode_job(db, job.id) is True
+    # Not looked up remotely, but weighted by the towns' events
+    assert db.looked_up == []
+    db.refresh(country)
+    assert (country.geocoded, country.latitude, country.longitude) == (1, 17.5, 35.0)
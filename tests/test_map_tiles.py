@@ -0,0 +1,58 @@
+import os
+import time
+import uuid
+
+from sqlalchemy import delete
+
+from database import SessionLocal
+from models import Place
+from services import vector_tiles
+from services.map_tiles import data_version
+
+
+def test_data_version_bumps_once_per_committed_change():
+    """Inserts, updates and deletes bump the version when they commit."""
+    reader = SessionLocal()
+    writer = SessionLocal()
+    name = f"Versionville {uuid.uuid4().hex[:8]}"
+    try:
+        before = data_version(reader)
+        reader.rollback()
+
+        place = Place(name=name, geocoded=0)
+        writer.add(place)
+        writer.flush()
+        place.latitude = 1.0
+        writer.flush()
+        # Not visible (and not counted) until the writer commits
+        assert data_version(reader) == before
+        reader.rollback()
+
+        writer.commit()
+        assert data_version(reader) == before + 1
+        reader.rollback()
+
+        writer.execute(delete(Place).where(Place.name == name))
+        writer.commit()
+        assert data_version(reader) == before + 2
+    finally:
+        writer.rollback()
+        writer.execute(delete(Place).where(Place.name == name))
+        writer.commit()
+        reader.close()
+        writer.close()
+
+
+def test_vector_tile_cleanup_keeps_recent_and_newer_versions(tmp_path, monkeypatch):
+    """Only older version directories unused for a while are deleted."""
+    monkeypatch.setenv("MAP_TILE_CACHE_DIR", str(tmp_path))
+    stale = time.time() - vector_tiles.STALE_VERSION_SECONDS - 60
+    for name in ("5", "8", "12"):
+        (tmp_path / name).mkdir()
+    os.utime(tmp_path / "5", (stale, stale))
+    os.utime(tmp_path / "12", (stale, stale))
+
+    vector_tiles._version_dir("10")
+
+    # 5 is old and idle, 8 was used recently, 12 is newer
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["10", "12", "8"]
@@ -0,0 +1,199 @@
+import hashlib
+import io
+import json
+import time
+import uuid
+
+import requests
+from PIL import Image
+
+BASE_URL = "http://localhost:8001/api"
+
+
+def _jpeg(size=(1200, 800), color=(120, 60, 30)):
+    buffer = io.BytesIO()
+    # A unique comment makes every upload new content, also on re-runs
+    Image.new("RGB", size, color).save(buffer, format="JPEG", comment=uuid.uuid4().hex)
+    return buffer.getvalue()
+
+
+def _upload(name, data, metadata=None):
+    return requests.post(
+        f"{BASE_URL}/media/upload",
+        files={"file": (name, data)},
+        data={"metadata": json.dumps(metadata or {})},
+    )
+
+
+def _wait_for_derivatives(media_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        media = next(
+            m for m in requests.get(f"{BASE_URL}/media").json() if m["id"] == media_id
+        )
+        if media["derivatives_status"] != "pending":
+            return media["derivatives_status"]
+        time.sleep(0.5)
+    return "pending"
+
+
+def test_media_upload_records_size_and_hash():
+    """Uploads are streamed to storage with their size and SHA-256 recorded."""
+    data = _jpeg()
+    resp = _upload("scan.jpg", data, {"description": "Parish register scan"})
+    assert resp.status_code == 200
+    media = resp.json()
+    assert media["file_size"] == len(data)
+    assert media["content_hash"] == hashlib.sha256(data).hexdigest()
+    assert _wait_for_derivatives(media["id"]) == "ready"
+
+    thumb = requests.get(f"{BASE_URL}/media/{media['id']}/thumbnail")
+    assert thumb.status_code == 200
+    assert max(Image.open(io.BytesIO(thumb.content)).size) == 300
+
+    assert requests.get(f"{BASE_URL}/media/{media['id']}/file").content == data
+
+
+def test_thumbnail_sizes_and_formats():
+    """Each derivative size is generated in JPEG and WebP in the background."""
+    media = _upload("portrait.jpg", _jpeg((2400, 1600))).json()
+    assert media["derivatives_status"] == "pending"
+    assert _wait_for_derivatives(media["id"]) == "ready"
+
+    url = f"{BASE_URL}/media/{media['id']}/thumbnail"
+    avatar = requests.get(url, params={"size": "avatar"}, headers={"Accept": "image/webp"})
+    assert avatar.headers["content-type"] == "image/webp"
+    image = Image.open(io.BytesIO(avatar.content))
+    assert image.format == "WEBP"
+    assert image.size == (96, 64)
+
+    preview = requests.get(url, params={"size": "preview", "format": "jpeg"})
+    image = Image.open(io.BytesIO(preview.content))
+    assert image.format == "JPEG"
+    assert image.size == (1200, 800)
+
+    assert requests.get(url, params={"size": "huge"}).status_code == 400
+
+
+def test_resized_image_on_demand():
+    """Images are resized to allowed sizes on request and cached."""
+    media = _upload("wedding.jpg", _jpeg((1600, 1200))).json()
+    url = f"{BASE_URL}/media/{media['id']}/image"
+
+    resp = requests.get(url, params={"w": 80, "h": 80, "fit": "cover", "format": "webp"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(resp.content)).size == (80, 80)
+
+    resp = requests.get(url, params={"w": 320}, headers={"Accept": "image/jpeg"})
+    assert Image.open(io.BytesIO(resp.content)).size == (320, 240)
+    again = requests.get(url, params={"w": 320}, headers={"Accept": "image/jpeg"})
+    assert again.content == resp.content
+    cached = requests.get(
+        url, params={"w": 320}, headers={"If-None-Match": resp.headers["etag"]}
+    )
+    assert cached.status_code == 304
+
+    assert requests.get(url, params={"w": 333}).status_code == 400
+    assert requests.get(url).status_code == 400
+    # Bad parameters are rejected before revalidation
+    bogus = requests.get(url, params={"w": 333}, headers={"If-None-Match": "*"})
+    assert bogus.status_code == 400
+
+
+def test_media_file_range_and_conditional_get():
+    """Files support byte ranges and revalidation without a body."""
+    data = bytes(range(256)) * 1024
+    media = _upload("register.bin", data).json()
+    url = f"{BASE_URL}/media/{media['id']}/file"
+
+    full = requests.get(url)
+    assert full.headers["accept-ranges"] == "bytes"
+    assert full.content == data
+
+    part = requests.get(url, headers={"Range": "bytes=1000-1999"})
+    assert part.status_code == 206
+    assert part.headers["content-range"] == f"bytes 1000-1999/{len(data)}"
+    assert part.content == data[1000:2000]
+
+    tail = requests.get(url, headers={"Range": "bytes=-10"})
+    assert tail.status_code == 206
+    assert tail.content == data[-10:]
+
+    unsatisfiable = requests.get(url, headers={"Range": f"bytes={len(data)}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{len(data)}"
+
+    stale = requests.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert stale.status_code == 200
+    assert stale.content == data
+    # If-Range uses strong comparison, so a weak tag never matches
+    weak = requests.get(
+        url, headers={"Range": "bytes=0-9", "If-Range": f"W/{full.headers['etag']}"}
+    )
+    assert weak.status_code == 200
+    current = requests.get(
+        url, headers={"Range": "bytes=0-9", "If-Range": full.headers["etag"]}
+    )
+    assert current.status_code == 206
+
+    assert requests.get(url, headers={"Range": "bytes=-0"}).status_code == 416
+    empty = _upload("empty.txt", b"").json()
+    empty_url = f"{BASE_URL}/media/{empty['id']}/file"
+    assert requests.get(empty_url, headers={"Range": "bytes=-5"}).status_code == 416
+
+    cached = requests.get(url, headers={"If-None-Match": full.headers["etag"]})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    cached = requests.get(url, headers={"If-Modified-Since": full.headers["last-modified"]})
+    assert cached.status_code == 304
+
+
+def test_thumbnail_conditional_get():
+    media = _upload("headstone.jpg", _jpeg()).json()
+    assert _wait_for_derivatives(media["id"]) == "ready"
+    url = f"{BASE_URL}/media/{media['id']}/thumbnail"
+
+    thumb = requests.get(url)
+    assert thumb.status_code == 200
+    cached = requests.get(url, headers={"If-None-Match": thumb.headers["etag"]})
+    assert cached.status_code == 304
+    # Editing the description does not invalidate the thumbnail
+    edit = requests.put(f"{BASE_URL}/media/{media['id']}", json={"description": "Churchyard"})
+    assert edit.status_code == 200
+    assert requests.get(url).headers["etag"] == thumb.headers["etag"]
+    part = requests.get(url, headers={"Range": "bytes=0-1"})
+    assert part.status_code == 206
+    assert part.content == b"\xff\xd8"
+
+
+def test_duplicate_upload_shares_stored_file():
+    """Uploading the same content again links to the stored file."""
+    data = _jpeg(color=(10, 200, 90))
+    first = _upload("census_1881.jpg", data).json()
+    second = _upload("census copy.jpg", data, {"description": "From a cousin"}).json()
+
+    assert first["deduplicated"] is False
+    assert second["deduplicated"] is True
+    assert second["id"] != first["id"]
+    assert second["content_hash"] == first["content_hash"]
+    for media in (first, second):
+        assert requests.get(f"{BASE_URL}/media/{media['id']}/file").content == data
+
+
+def test_media_cache_serves_repeat_requests():
+    """Repeated reads are served from the local object cache."""
+    data = b"parish register page " * 4096
+    media = _upload("register.txt", data).json()
+    url = f"{BASE_URL}/media/{media['id']}/file"
+
+    assert requests.get(url).content == data
+    before = requests.get(f"{BASE_URL}/media/cache/stats").json()
+    assert requests.get(url).content == data
+    assert requests.get(url, headers={"Range": "bytes=0-5"}).content == data[:6]
+    after = requests.get(f"{BASE_URL}/media/cache/stats").json()
+
+    assert after["hits"] == before["hits"] + 2
+    assert after["misses"] == before["misses"]
+    assert 0 < after["hit_rate"] <= 1
+    assert after["bytes"] <= after["max_bytes"]
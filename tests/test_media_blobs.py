@@ -0,0 +1,59 @@
+import io
+import uuid
+
+from database import SessionLocal
+from models import MediaBlob
+from services import media_blobs
+from services.storage import minio_client
+
+
+def test_rolled_back_upload_leaves_collectable_blob():
+    """A blob uploaded in a transaction that rolls back is recorded unreferenced."""
+    data = f"orphan check {uuid.uuid4()}".encode()
+    db = SessionLocal()
+    try:
+        path, size, content_hash, uploaded = media_blobs.store(db, io.BytesIO(data))
+        assert uploaded
+        db.rollback()
+
+        blob = db.get(MediaBlob, content_hash)
+        assert blob is not None
+        assert blob.ref_count == 0
+        assert minio_client.stat_object("media", path).size == size
+    finally:
+        db.rollback()
+        db.query(MediaBlob).filter(MediaBlob.content_hash == content_hash).delete()
+        db.commit()
+        minio_client.remove_object("media", path)
+        db.close()
+
+
+def test_garbage_collection_keeps_referenced_blobs():
+    """Only old blobs without references are deleted, with their files."""
+    db = SessionLocal()
+    paths = {}
+    try:
+        for refs in (0, 1):
+            data = f"garbage check {refs} {uuid.uuid4()}".encode()
+            path, _, content_hash, _ = media_blobs.store(db, io.BytesIO(data))
+            paths[refs] = (path, content_hash)
+        db.query(MediaBlob).filter(
+            MediaBlob.content_hash == paths[0][1]
+        ).update({"ref_count": 0})
+        db.query(MediaBlob).filter(
+            MediaBlob.content_hash.in_([h for _, h in paths.values()])
+        ).update({"created_at": MediaBlob.created_at - media_blobs.GARBAGE_GRACE * 2})
+        db.commit()
+
+        assert media_blobs.collect_garbage(db) >= 1
+        assert db.get(MediaBlob, paths[0][1]) is None
+        assert not list(minio_client.list_objects("media", prefix=paths[0][0]))
+        assert db.get(MediaBlob, paths[1][1]).ref_count == 1
+        assert minio_client.stat_object("media", paths[1][0])
+    finally:
+        db.rollback()
+        for path, content_hash in paths.values():
+            db.query(MediaBlob).filter(MediaBlob.content_hash == content_hash).delete()
+            minio_client.remove_object("media", path)
+        db.commit()
+        db.close()
@@ -0,0 +1,34 @@
+from services.place_names import cluster_key, normalize_place_name, similar_keys
+
+
+def _key(name):
+    return cluster_key(normalize_place_name(name))
+
+
+def test_state_codes_only_before_the_us_or_last():
+    assert normalize_place_name("Denver, CO") == "denver, colorado"
+    assert normalize_place_name("Denver, CO, USA") == "denver, colorado, usa"
+    # "Co." before another country is the county abbreviation
+    assert normalize_place_name("Cork, Co., Ireland") == "cork, county, ireland"
+
+
+def test_word_order_variants_share_a_cluster_key():
+    assert _key("Co. Cork, Ireland") == _key("Cork Co., Ireland")
+    assert _key("Jackson County, Missouri") != _key("Jackson, Missouri")
+
+
+def test_similar_keys_need_a_shared_parent():
+    keys = [
+        _key("Springfeld, Illinois"),
+        _key("Springfield, Illinois"),
+        _key("Quillsborouch, Wexcombe County, MA"),
+        _key("Quillsborough, Wexcombe County, MA"),
+        _key("Quillsborough, Essex County, MA"),
+        _key("Bristol, Maine"),
+        _key("Bristow, Maine"),
+    ]
+    assert similar_keys(keys) == [
+        ("quillsborouch, county wexcombe, massachusetts",
+         "quillsborough, county wexcombe, massachusetts"),
+        ("springfeld, illinois", "springfield, illinois"),
+    ]
@@ -0,0 +1,264 @@
+import uuid
+
+import requests
+
+BASE_URL = "http://localhost:8001/api"
+
+
+def _place(name):
+    """A place's level and counts, or None without events anywhere below it."""
+    resp = requests.get(f"{BASE_URL}/places/{name}",
+                        params={"include_subplaces": True, "people_limit": 1})
+    if resp.status_code == 404:
+        return None
+    detail = resp.json()
+    direct = requests.get(f"{BASE_URL}/places/{name}", params={"people_limit": 1})
+    return {
+        "id": detail["place_id"],
+        "level": detail["level"],
+        "count": direct.json()["event_count"] if direct.ok else 0,
+        "total_count": detail["event_count"],
+    }
+
+
+def test_place_hierarchy_and_rollup_counts():
+    """Event places are split into a hierarchy with per-level event counts."""
+    # A unique country, so earlier runs against the same server don't count
+    country = f"Ruritania {uuid.uuid4().hex[:8]}"
+    bulk = {
+        "people": [
+            {"temp_id": "a", "first_name": "Aoife", "last_name": "Strelsau",
+             "birth_place": f"Zenda, Strelsau, Fritzland, {country}"},
+            {"temp_id": "b", "first_name": "Brian", "last_name": "Strelsau",
+             "birth_place": f"Tarlenheim, Strelsau, Fritzland, {country}",
+             "death_place": f"Zenda, Strelsau, Fritzland, {country}"},
+        ]
+    }
+    assert requests.post(f"{BASE_URL}/people/bulk", json=bulk).status_code == 200
+    resp = requests.post(f"{BASE_URL}/people", json={
+        "first_name": "Ciara", "last_name": "Strelsau",
+        "birth_place": f"Hentzau, {country}"})
+    assert resp.status_code == 200
+
+    root = _place(country)
+    assert root["level"] == "country"
+    assert root["count"] == 0
+    assert root["total_count"] == 4
+
+    children = requests.get(f"{BASE_URL}/places",
+                            params={"parent_id": root["id"]}).json()
+    # Levels count from the country; a two-part name may lack its state
+    assert {(p["name"], p["level"], p["total_count"]) for p in children} == {
+        (f"Fritzland, {country}", "state", 3),
+        (f"Hentzau, {country}", None, 1),
+    }
+    assert _place(f"Strelsau, Fritzland, {country}")["level"] == "county"
+    zenda = _place(f"Zenda, Strelsau, Fritzland, {country}")
+    assert zenda["level"] == "locality"
+    assert zenda["count"] == 2
+
+    # Everyone born anywhere in the country
+    assert requests.get(f"{BASE_URL}/places/{country}").status_code == 404
+    detail = requests.get(f"{BASE_URL}/places/{country}",
+                          params={"include_subplaces": True}).json()
+    assert sorted(b["individual_name"] for b in detail["births"]) == [
+        "Aoife Strelsau", "Brian Strelsau", "Ciara Strelsau"]
+
+
+def test_place_counts_follow_event_edits():
+    """Moving an event updates the counts of both place chains."""
+    tag = uuid.uuid4().hex[:8]
+    old, new = f"Elphbergia {tag}", f"Osraige {tag}"
+    person = requests.post(f"{BASE_URL}/people", json={
+        "first_name": "Dara", "last_name": "Elphberg",
+        "birth_place": f"Modenstein, {old}"}).json()
+    assert _place(old)["total_count"] == 1
+
+    resp = requests.put(f"{BASE_URL}/people/{person['id']}",
+                        json={"birth_place": f"Borrowdale, {new}"})
+    assert resp.status_code == 200
+    # Places without events anywhere below them drop out of the listings
+    assert _place(old) is None
+    assert _place(f"Modenstein, {old}") is None
+    assert _place(new)["total_count"] == 1
+
+    # A full resync agrees with the incrementally maintained counts
+    assert requests.post(f"{BASE_URL}/map/places/sync").status_code == 200
+    assert _place(new)["total_count"] == 1
+    assert _place(old) is None
+
+
+def test_place_detail_marriages_and_people_paging():
+    """Marriages list the family's spouses and people can be paged by name."""
+    kirk = f"Glenwhistle Kirk {uuid.uuid4().hex[:8]}"
+    payload = {
+        "people": [
+            {"temp_id": "h", "first_name": "Hamish", "last_name": "Wedderburn",
+             "sex": "M", "birth_place": kirk},
+            {"temp_id": "w", "first_name": "Agnes", "last_name": "Wedderburn",
+             "sex": "F", "burial_place": kirk},
+            {"temp_id": "x", "first_name": "Zander", "last_name": "Wedderburn",
+             "death_place": kirk},
+        ],
+        "families": [{"temp_id": "f", "spouse1": "h", "spouse2": "w",
+                      "marriage_place": kirk}],
+    }
+    created = requests.post(f"{BASE_URL}/people/bulk", json=payload).json()
+    ids = created["people"]
+
+    detail = requests.get(f"{BASE_URL}/places/{kirk}").json()
+    assert detail["event_count"] == 4
+    assert detail["people_count"] == 3
+    assert [b["individual_name"] for b in detail["births"]] == ["Hamish Wedderburn"]
+    assert [b["individual_id"] for b in detail["burials"]] == [ids["w"]]
+    marriage = detail["marriages"][0]
+    assert marriage["family_id"] == created["families"]["f"]
+    assert [s["name"] for s in marriage["spouses"]] == [
+        "Hamish Wedderburn", "Agnes Wedderburn"]
+
+    page = requests.get(f"{BASE_URL}/places/{kirk}",
+                        params={"people_limit": 2}).json()
+    assert [p["name"] for p in page["people"]] == [
+        "Agnes Wedderburn", "Hamish Wedderburn"]
+    page = requests.get(f"{BASE_URL}/places/{kirk}", params={
+        "people_limit": 2, "people_cursor": page["people_next_cursor"]}).json()
+    assert [p["name"] for p in page["people"]] == ["Zander Wedderburn"]
+    assert page["people_next_cursor"] is None
+
+
+def test_place_spelling_variants_share_canonical_place():
+    """Case, abbreviation, word order, typo and near-miss variants map to one place."""
+    variants = [
+        "Quillsborough, Wexcombe Co., MA, USA",
+        "quillsborough, wexcombe county, Massachusetts, United States",
+        "Quillsborough, County Wexcombe, MA, USA",
+        "Quillsborogh, Wexcombe County, Massachusetts, USA",
+        "Quillsborouch, Wexcombe County, MA, USA",
+    ]
+    # Different level, and a typo without a shared parent
+    distinct = [
+        "Quillsborough, Massachusetts, USA",
+        "Quillsborough, Wexcombe County, Masachusetts",
+    ]
+    bulk = {"people": [
+        {"first_name": f"Variant{i}", "last_name": "Quill", "birth_place": name}
+        for i, name in enumerate(variants + distinct)
+    ]}
+    assert requests.post(f"{BASE_URL}/people/bulk", json=bulk).status_code == 200
+
+    resp = requests.post(f"{BASE_URL}/map/places/normalize")
+    assert resp.status_code == 200
+    assert resp.json()["variants"] >= 4
+
+    places = {p["name"]: p for p in requests.get(f"{BASE_URL}/map/places").json()}
+    ids = {places[name]["canonical_id"] or places[name]["id"] for name in variants}
+    assert len(ids) == 1
+    for name in distinct:
+        assert (places[name]["canonical_id"] or places[name]["id"]) not in ids
+
+
+def test_map_clusters_by_zoom_and_bounding_box():
+    """Clusters below the detail zoom, events above it, and bbox validation."""
+    world = {"west": -180, "south": -85, "east": 180, "north": 85}
+    resp = requests.get(f"{BASE_URL}/map/clusters", params={**world, "zoom": 2})
+    assert resp.status_code == 200
+    overview = resp.json()
+    assert overview["detail"] is False and overview["tiles"] == 16
+    assert overview["events"] == []
+    for cluster in overview["clusters"]:
+        assert cluster["count"] == sum(cluster["types"].values())
+
+    # Repeating the view is served from the tile cache
+    again = requests.get(f"{BASE_URL}/map/clusters", params={**world, "zoom": 2}).json()
+    assert again["cached_tiles"] == 16
+    assert again["clusters"] == overview["clusters"]
+
+    detail = requests.get(f"{BASE_URL}/map/clusters", params={
+        "west": -0.2, "south": 51.4, "east": 0.0, "north": 51.6, "zoom": 14,
+        "year_from": 1800, "year_to": 1900, "type": "BIRT,MARR",
+    }).json()
+    assert detail["detail"] is True and detail["clusters"] == []
+
+    resp = requests.get(f"{BASE_URL}/map/clusters", params={**world, "zoom": 12})
+    assert resp.status_code == 400
+    resp = requests.get(f"{BASE_URL}/map/clusters", params={**world, "zoom": 30})
+    assert resp.status_code == 422
+
+
+def test_map_years_histogram():
+    """The timeline years come with per-year, per-type event counts."""
+    data = requests.get(f"{BASE_URL}/map/years").json()
+    assert data["years"] == [bucket["year"] for bucket in data["histogram"]]
+    assert data["years"] == sorted(data["years"])
+    if data["years"]:
+        assert data["min_year"] == data["years"][0]
+        assert data["max_year"] == data["years"][-1]
+    for bucket in data["histogram"]:
+        assert bucket["count"] == sum(bucket["types"].values()) > 0
+
+
+def test_map_vector_tiles():
+    """Vector tiles are served with a data-version ETag."""
+    resp = requests.get(f"{BASE_URL}/map/tiles/0/0/0")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+    etag = resp.headers["etag"]
+
+    resp = requests.get(f"{BASE_URL}/map/tiles/0/0/0", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+    assert requests.get(f"{BASE_URL}/map/tiles/14/8200/5400").status_code == 200
+    assert requests.get(f"{BASE_URL}/map/tiles/2/4/0").status_code == 404
+
+
+def test_migration_flows_by_level_and_decade():
+    """Birth -> death place moves are counted per region pair and decade."""
+    tag = uuid.uuid4().hex[:8]
+    north, south = f"Norvania {tag}", f"Sudland {tag}"
+    bulk = {"people": [
+        {"first_name": "Orla", "last_name": "Flowe", "birth_date": "1851-03-01",
+         "birth_place": f"Kilbrack, Westmark, {north}",
+         "death_place": f"Port Ellery, Eastmere, Southby, {south}"},
+        {"first_name": "Piers", "last_name": "Flowe", "birth_date": "1858-07-09",
+         "birth_place": f"Dunvale, Westmark, {north}",
+         "death_place": f"Harrowgate, Eastmere, Southby, {south}"},
+        {"first_name": "Quinn", "last_name": "Flowe", "birth_date": "1862-01-01",
+         "birth_place": f"Kilbrack, Westmark, {north}",
+         "death_place": f"Dunvale, Westmark, {north}"},
+    ]}
+    assert requests.post(f"{BASE_URL}/people/bulk", json=bulk).status_code == 200
+
+    data = requests.get(f"{BASE_URL}/map/migrations", params={"level": "country"}).json()
+    flows = [f for f in data["flows"] if f["origin"]["name"] == north]
+    assert [(f["period"], f["destination"]["name"], f["count"]) for f in flows] == [
+        (1850, south, 2)]
+
+    # Three-part names only know their state, so Quinn's move stays inside it
+    data = requests.get(f"{BASE_URL}/map/migrations", params={
+        "level": "state", "bucket": 100}).json()
+    flows = {(f["period"], f["origin"]["name"], f["destination"]["name"]): f["count"]
+             for f in data["flows"] if f["origin"]["name"].endswith(north)}
+    assert flows == {(1800, f"Westmark, {north}", f"Southby, {south}"): 2}
+
+    # ... and have no county to count them in
+    data = requests.get(f"{BASE_URL}/map/migrations", params={"level": "county"}).json()
+    assert not [f for f in data["flows"] if f["origin"]["name"].endswith(north)]
+
+    resp = requests.get(f"{BASE_URL}/map/migrations", params={"level": "planet"})
+    assert resp.status_code == 400
+
+
+def test_map_heatmap_cells():
+    """The heatmap returns weighted cells for a view and year window."""
+    world = {"west": -180, "south": -85, "east": 180, "north": 85}
+    data = requests.get(f"{BASE_URL}/map/heatmap", params={**world, "zoom": 1}).json()
+    assert data["cell_size"] == 16
+    assert data["max_weight"] == max((c["weight"] for c in data["cells"]), default=0)
+
+    window = requests.get(f"{BASE_URL}/map/heatmap", params={
+        **world, "zoom": 1, "year_from": 1853, "year_to": 1871}).json()
+    assert sum(c["weight"] for c in window["cells"]) <= sum(
+        c["weight"] for c in data["cells"])
+
+    resp = requests.get(f"{BASE_URL}/map/heatmap", params={**world, "zoom": 12})
+    assert resp.status_code == 400
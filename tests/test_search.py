@@ -0,0 +1,75 @@
+import base64
+import json
+
+import requests
+
+BASE_URL = "http://localhost:8001/api"
+
+
+def test_search_returns_typed_hits():
+    """People and places matching the query come back as typed, ranked hits."""
+    requests.post(
+        f"{BASE_URL}/people",
+        json={
+            "first_name": "Ottoline",
+            "last_name": "Vandersnoot",
+            "birth_date": "1899-07-01",
+            "birth_place": "Vandersnoot Hollow",
+        },
+    )
+    response = requests.get(f"{BASE_URL}/search", params={"q": "vandersnoot"})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    types = {r["type"] for r in results}
+    assert "person" in types
+    assert "place" in types
+    person = next(r for r in results if r["type"] == "person")
+    assert "<mark>" in person["snippet"]
+
+
+def test_search_cursor_paging():
+    """Pages chained by cursor do not repeat hits."""
+    for i in range(3):
+        requests.post(
+            f"{BASE_URL}/people",
+            json={"first_name": f"Pager{i}", "last_name": "Wolfenbarger"},
+        )
+    first = requests.get(
+        f"{BASE_URL}/search",
+        params={"q": "wolfenbarger", "types": "person", "limit": 2},
+    ).json()
+    assert len(first["results"]) == 2
+    assert first["next_cursor"]
+    second = requests.get(
+        f"{BASE_URL}/search",
+        params={
+            "q": "wolfenbarger",
+            "types": "person",
+            "limit": 2,
+            "cursor": first["next_cursor"],
+        },
+    ).json()
+    first_ids = {r["id"] for r in first["results"]}
+    assert second["results"]
+    assert not first_ids & {r["id"] for r in second["results"]}
+
+
+def test_search_rejects_unknown_type():
+    """Unknown hit types are a client error."""
+    response = requests.get(
+        f"{BASE_URL}/search", params={"q": "smith", "types": "spaceship"}
+    )
+    assert response.status_code == 400
+
+
+def test_search_rejects_bad_cursor():
+    """Malformed cursors, and cursors with values of the wrong type, are a client error."""
+    for values in (None, [0.5, "person"], ["high", "person", "1"], [0.5, 1, "1"]):
+        cursor = (
+            "bogus" if values is None
+            else base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+        )
+        response = requests.get(
+            f"{BASE_URL}/search", params={"q": "smith", "cursor": cursor}
+        )
+        assert response.status_code == 400, values
@@ -0,0 +1,55 @@
+import io
+import os
+import time
+import uuid
+
+import pytest
+
+from services.storage import STALE_DOWNLOAD_SECONDS, ObjectCache, minio_client
+
+
+@pytest.fixture
+def objects():
+    names = []
+
+    def put(size):
+        name = f"test/{uuid.uuid4().hex}"
+        minio_client.put_object("media", name, io.BytesIO(b"x" * size), size)
+        names.append(name)
+        return name
+
+    yield put
+    for name in names:
+        minio_client.remove_object("media", name)
+
+
+def test_open_file_survives_eviction(tmp_path, objects):
+    """A copy being served stays readable after the cache evicts it."""
+    cache = ObjectCache(minio_client, str(tmp_path), 4000)
+    f = cache.open("media", objects(900))
+    for _ in range(4):
+        # Fill the cache until the first object is evicted
+        cache.open("media", objects(900)).close()
+    assert cache.evictions
+    assert f.read() == b"x" * 900
+    f.close()
+
+
+def test_object_too_large_is_not_kept(tmp_path, objects):
+    """Objects found too large while downloading are left to MinIO."""
+    cache = ObjectCache(minio_client, str(tmp_path), 4000)
+    assert cache.open("media", objects(2000)) is None
+    assert cache.stats()["bypassed"] == 1
+    assert cache.stats()["bytes"] == 0
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names]
+
+
+def test_only_stale_partial_downloads_are_removed(tmp_path):
+    old, recent = tmp_path / "old.tmp", tmp_path / "recent.tmp"
+    old.write_bytes(b"x")
+    recent.write_bytes(b"x")
+    stale = time.time() - STALE_DOWNLOAD_SECONDS - 60
+    os.utime(old, (stale, stale))
+
+    ObjectCache(minio_client, str(tmp_path), 4000)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["recent.tmp"]